@@ -11,13 +11,27 @@ block_cipher = None
 a = Analysis(
     [
         'main.py', 'gui/main_window.py', 'gui/file_list_window.py',
+        'core/change_watcher.py',
+        'core/compression_policy.py',
         'core/config_manager.py',
+        'core/delta.py',
+        'core/digest.py',
         'core/file_cache_manager.py',
+        'core/file_clone.py',
         'core/file_comparator.py',
+        'core/file_reader.py',
         'core/file_scanner.py',
         'core/make_win_center.py',
+        'core/merkle_index.py',
+        'core/package_applier.py',
         'core/package_builder.py',
-        'core/version_manager.py'
+        'core/package_history.py',
+        'core/package_manifest.py',
+        'core/scan_checkpoint.py',
+        'core/scan_walker.py',
+        'core/version_manager.py',
+        'core/zip_writer.py',
+        'core/zone_deployer.py'
     ],
     pathex=[],
     binaries=[],
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+文件变更监控模块，记录目标路径下发生变化的文件（脏文件集合），扫描时只需处理这些文件
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from core.scan_walker import ExcludeMatcher, collapse_paths, iter_target_files, normalize_relative_path
+
+# inotify 常量（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = getattr(os, 'O_NONBLOCK', 0o4000)
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+               IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+
+
+def _load_libc():
+    """加载提供 inotify 的C库，不支持时返回None"""
+    global _libc
+    if _libc is None and sys.platform.startswith('linux'):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            if hasattr(libc, 'inotify_init1'):
+                _libc = libc
+        except OSError:
+            pass
+    return _libc
+
+
+def inotify_available() -> bool:
+    """当前系统是否支持 inotify"""
+    return _load_libc() is not None
+
+
+class _InotifyBackend:
+    """基于 inotify 的监控后端，对每个目录添加一个监控"""
+
+    name = 'inotify'
+
+    def __init__(self, watcher: 'ChangeWatcher'):
+        self.watcher = watcher
+        self.libc = _load_libc()
+        self.fd = -1
+        self.watches: Dict[int, Tuple[str, Optional[frozenset]]] = {}  # wd -> (相对目录, 只关注的文件名)
+        self.wd_by_dir: Dict[str, int] = {}
+        self.missing_roots: List[Tuple[str, str, Optional[frozenset]]] = []
+        self.last_root_check = 0.0
+
+    def setup(self):
+        """创建 inotify 实例并为所有目标路径添加监控"""
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.missing_roots = list(self.watcher.roots)
+        self._check_roots(initial=True)
+
+    def _check_roots(self, initial: bool = False):
+        """为尚未监控的目标路径添加监控（目标目录被删除后重新出现时也走这里）"""
+        still_missing = []
+        for root in self.missing_roots:
+            target_path, watch_dir, names = root
+            full_path = os.path.join(self.watcher.directory, watch_dir)
+            if not os.path.isdir(full_path):
+                still_missing.append(root)
+                continue
+            if names is None:
+                self._add_tree(full_path, watch_dir)
+            else:
+                self._add_watch(full_path, watch_dir, names)
+            if not initial:
+                # 目标重新出现，扫描时完整遍历该目标
+                self.watcher.record(target_path)
+        self.missing_roots = still_missing
+        self.last_root_check = time.monotonic()
+
+    def _add_watch(self, full_path: str, relative_dir: str, names: Optional[frozenset] = None):
+        """添加一个目录监控"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(full_path), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, f"{os.strerror(error)}: {full_path}")
+
+        existing = self.watches.get(wd)
+        if existing is not None and names is not None:
+            # 同一目录既是目标目录又是目标文件的父目录时，合并关注的文件名
+            names = None if existing[1] is None else existing[1] | names
+        self.watches[wd] = (relative_dir, names)
+        self.wd_by_dir[relative_dir] = wd
+
+    def _add_tree(self, full_path: str, relative_dir: str):
+        """递归为目录及其所有未排除的子目录添加监控"""
+        matcher = self.watcher.matcher
+        stack = [(full_path, relative_dir)]
+        while stack:
+            current_dir, current_relative = stack.pop()
+            self._add_watch(current_dir, current_relative)
+            try:
+                with os.scandir(current_dir) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and not matcher.excludes_dir(entry.name):
+                            stack.append((entry.path, current_relative + os.sep + entry.name))
+            except OSError as e:
+                print(f"遍历目录失败 {current_dir}: {e}")
+
+    def _remove_tree(self, relative_dir: str):
+        """移除目录及其子目录的监控（目录被移走后旧的监控会指向新位置）"""
+        prefix = relative_dir + os.sep
+        for watched_dir in [d for d in self.wd_by_dir if d == relative_dir or d.startswith(prefix)]:
+            wd = self.wd_by_dir.pop(watched_dir)
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _find_root(self, relative_dir: str):
+        """查找以该目录为监控目录的目标路径"""
+        for root in self.watcher.roots:
+            if root[1] == relative_dir:
+                return root
+        return None
+
+    def poll(self, timeout: float):
+        """等待并处理事件"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            while True:
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    break
+                if not data:
+                    break
+                self._handle_events(data)
+
+        if self.missing_roots and time.monotonic() - self.last_root_check >= 1.0:
+            self._check_roots()
+
+    def _handle_events(self, data: bytes):
+        """解析并处理一批 inotify 事件"""
+        matcher = self.watcher.matcher
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，丢失的变化无从得知
+                self.watcher.invalidate()
+                continue
+
+            watch = self.watches.get(wd)
+            if watch is None:
+                continue
+            relative_dir, names = watch
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                if mask & IN_MOVE_SELF:
+                    self._remove_tree(relative_dir)
+                else:
+                    self.watches.pop(wd, None)
+                    if self.wd_by_dir.get(relative_dir) == wd:
+                        del self.wd_by_dir[relative_dir]
+                root = self._find_root(relative_dir)
+                if root is not None and root not in self.missing_roots:
+                    self.watcher.record(root[0])
+                    self.missing_roots.append(root)
+                continue
+
+            if not name or (names is not None and name not in names):
+                continue
+            relative_path = relative_dir + os.sep + name
+
+            if mask & IN_ISDIR:
+                if matcher.excludes_dir(name) or not mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+                    continue
+                if mask & IN_MOVED_FROM:
+                    self._remove_tree(relative_path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(os.path.join(self.watcher.directory, relative_path), relative_path)
+                # 记录整个目录，扫描时遍历该目录
+                self.watcher.record(relative_path)
+            elif not matcher.excludes_file(name, relative_path):
+                self.watcher.record(relative_path)
+
+    def close(self):
+        """关闭 inotify 实例"""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _PollingBackend:
+    """轮询后端，定期遍历目标路径并对比 size/mtime_ns/inode"""
+
+    name = 'polling'
+
+    def __init__(self, watcher: 'ChangeWatcher'):
+        self.watcher = watcher
+        self.snapshot: Dict[str, Tuple[int, int, int]] = {}
+
+    def _take_snapshot(self) -> Optional[Dict[str, Tuple[int, int, int]]]:
+        """遍历目标路径，被停止时返回None"""
+        stop_event = self.watcher.stop_event
+        snapshot = {
+            entry.relative_path: (entry.stat.st_size, entry.stat.st_mtime_ns, entry.inode)
+            for entry in iter_target_files(self.watcher.directory, self.watcher.target_paths,
+                                           self.watcher.matcher, stop_event.is_set)
+        }
+        return None if stop_event.is_set() else snapshot
+
+    def setup(self):
+        """建立初始快照"""
+        self.snapshot = self._take_snapshot() or {}
+
+    def poll(self, timeout: float):
+        """等待轮询间隔后重新遍历，记录有变化的文件"""
+        if self.watcher.stop_event.wait(self.watcher.poll_interval):
+            return
+        snapshot = self._take_snapshot()
+        if snapshot is None:
+            return
+        for relative_path, stat in snapshot.items():
+            if self.snapshot.get(relative_path) != stat:
+                self.watcher.record(relative_path)
+        for relative_path in self.snapshot.keys() - snapshot.keys():
+            self.watcher.record(relative_path)
+        self.snapshot = snapshot
+
+    def close(self):
+        pass
+
+
+class ChangeWatcher:
+    """
+    文件变更监控器
+    
+    在后台线程中监控输入目录下的目标路径，把新建、修改、删除、重命名的文件（或整个目录）记录到脏文件集合，
+    并持久化到状态文件。Linux 使用 inotify，其它系统或 inotify 不可用时使用轮询。
+    
+    只有在监控器从一次完整扫描开始之前就一直在运行（期间没有事件丢失）时，脏文件集合才是可信的，
+    见 take_dirty / mark_baseline / is_trusted。
+    """
+
+    def __init__(self, directory: Path, target_paths: Iterable[str], matcher: ExcludeMatcher,
+                 state_file: Optional[Path] = None, backend: str = 'auto', poll_interval: float = 5.0):
+        """
+        初始化变更监控器
+        
+        Args:
+            directory: 输入目录
+            target_paths: 目标路径列表 (相对于输入目录)
+            matcher: 排除规则匹配器，应与扫描器使用的规则一致
+            state_file: 脏文件集合的持久化文件
+            backend: 监控后端，'auto' 优先使用 inotify、'inotify'、'polling'
+            poll_interval: 轮询后端的遍历间隔（秒）
+        """
+        self.directory = str(directory)
+        self.target_paths = [normalize_relative_path(path).strip(os.sep) for path in target_paths]
+        self.matcher = matcher
+        self.state_file = Path(state_file) if state_file else None
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.backend_name = ''
+
+        # (目标路径, 监控的目录, 只关注的文件名)，目标是文件时监控其父目录
+        self.roots = []
+        for target_path in self.target_paths:
+            if os.path.isfile(os.path.join(self.directory, target_path)):
+                parent, _, name = target_path.rpartition(os.sep)
+                self.roots.append((target_path, parent, frozenset([name])))
+            else:
+                self.roots.append((target_path, target_path, None))
+
+        self.stop_event = threading.Event()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self._dirty: Set[str] = set()
+        self._dirty_changed = False
+        self._last_save = 0.0
+        self._generation = 0  # 每次可能丢失事件时递增
+        self._trusted = False
+        self._last_full_scan = 0.0
+
+    def start(self):
+        """启动后台监控线程"""
+        if self._thread is not None:
+            return
+        self._load_state()
+        self.stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止监控并保存脏文件集合"""
+        self.stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            self._trusted = False
+
+    @property
+    def is_running(self) -> bool:
+        """监控线程是否在运行"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        """监控线程"""
+        backend = None
+        if self.backend in ('auto', 'inotify') and inotify_available():
+            try:
+                backend = _InotifyBackend(self)
+                backend.setup()
+            except OSError as e:
+                # 例如超过 fs.inotify.max_user_watches
+                print(f"启动inotify监控失败，改用轮询: {e}")
+                backend.close()
+                backend = None
+        if backend is None:
+            backend = _PollingBackend(self)
+            backend.setup()
+
+        self.backend_name = backend.name
+        self._ready.set()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    backend.poll(0.5)
+                except OSError as e:
+                    print(f"监控文件变化失败: {e}")
+                    self.invalidate()
+                    self.stop_event.wait(1.0)
+                self._save_state()
+        finally:
+            backend.close()
+            self._ready.clear()
+            self._save_state(force=True)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """等待监控建立完成"""
+        return self._ready.wait(timeout)
+
+    def record(self, relative_path: str):
+        """记录一个发生变化的相对路径（文件或目录）"""
+        with self._lock:
+            if relative_path not in self._dirty:
+                self._dirty.add(relative_path)
+                self._dirty_changed = True
+
+    def invalidate(self):
+        """可能有变化没有被记录到，下一次扫描需要完整遍历"""
+        with self._lock:
+            self._generation += 1
+            self._trusted = False
+
+    def take_dirty(self) -> Tuple[frozenset, Optional[int]]:
+        """
+        取出当前的脏文件集合（之后发生的变化记录到新的集合中）
+        
+        Returns:
+            (去重后的脏路径集合, 监控标记)，监控标记用于完整扫描结束后调用 mark_baseline，
+            监控尚未建立时为None
+        """
+        with self._lock:
+            dirty = collapse_paths(self._dirty)
+            self._dirty = set()
+            self._dirty_changed = True
+            token = self._generation if self._ready.is_set() else None
+        return dirty, token
+
+    def restore(self, relative_paths: Iterable[str]):
+        """扫描未完成时放回取出的脏文件集合"""
+        with self._lock:
+            self._dirty.update(relative_paths)
+            self._dirty_changed = True
+
+    def mark_baseline(self, token: Optional[int]):
+        """
+        完整扫描成功结束，之后的脏文件集合相对于这次扫描结果是完整的
+        
+        Args:
+            token: 完整扫描开始时 take_dirty 返回的监控标记
+        """
+        with self._lock:
+            self._trusted = token is not None and token == self._generation and self.is_running
+            self._last_full_scan = time.monotonic()
+
+    def is_trusted(self) -> bool:
+        """脏文件集合是否可信（可以只扫描脏文件）"""
+        with self._lock:
+            return self._trusted and self.is_running
+
+    def needs_full_scan(self, interval_seconds: float) -> bool:
+        """距离上一次完整扫描是否已超过间隔（定期完整遍历作为兜底）"""
+        return interval_seconds <= 0 or time.monotonic() - self._last_full_scan >= interval_seconds
+
+    def _load_state(self):
+        """加载持久化的脏文件集合（只作为补充，重启期间的变化无从得知，仍需一次完整扫描）"""
+        if not self.state_file or not self.state_file.exists():
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('directory') == self.directory:
+                with self._lock:
+                    self._dirty.update(state.get('dirty', []))
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"加载变更记录失败: {e}")
+
+    def _save_state(self, force: bool = False):
+        """持久化脏文件集合，最多每秒写入一次"""
+        if not self.state_file:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not self._dirty_changed or (not force and now - self._last_save < 1.0):
+                return
+            state = {'directory': self.directory, 'dirty': sorted(self._dirty)}
+            self._dirty_changed = False
+            self._last_save = now
+        try:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.state_file.with_suffix('.tmp')
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(temp_file, self.state_file)
+        except IOError as e:
+            print(f"保存变更记录失败: {e}")
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+压缩策略模块，按文件内容和历史压缩统计为每个文件选择压缩方式
+"""
+
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+# 压缩级别
+FAST_LEVEL = 1
+MAX_LEVEL = 9
+
+
+class CompressionChoice(NamedTuple):
+    """文件的压缩方式"""
+    stored: bool  # 不压缩直接存储
+    level: int  # deflate 压缩级别（stored 时无意义）
+    reason: str  # 选择依据：stats / entropy / sample / small
+
+
+class CompressionPolicy:
+    """
+    自适应压缩策略
+    
+    估算文件的压缩率（压缩后大小 / 原始大小）：
+        同扩展名的历史统计数据足够时直接使用统计结果；
+        否则对文件开头的数据计算字节熵，接近随机数据（已压缩的图片、音频、压缩包等）直接存储，
+        其余用快速压缩试压缩样本。
+    压缩率高于 stored_ratio 存储，高于 fast_ratio 使用快速压缩，否则使用最高压缩级别；
+    该扩展名最高级别的历史压缩速度低于 min_max_level_speed 时退回默认级别。
+    按统计决定的文件每 resample_interval 个仍试压缩一次样本并按样本决定，
+    否则统计结论为存储的扩展名不再产生压缩数据，内容变得可压缩后也无法重新学习。
+    每次压缩的结果（原始大小、压缩后大小、耗时）按扩展名和压缩级别累计，保存后供下次打包使用。
+    """
+
+    def __init__(self, stats_file: Optional[Path] = None, default_level: int = 6,
+                 sample_size: int = 64 * 1024,
+                 stored_ratio: float = 0.95, fast_ratio: float = 0.75,
+                 entropy_threshold: float = 7.9,
+                 min_max_level_speed: float = 8 * 1024 * 1024,
+                 min_stats_bytes: int = 4 * 1024 * 1024, min_stats_files: int = 4,
+                 resample_interval: int = 16):
+        """
+        初始化压缩策略
+        
+        Args:
+            stats_file: 压缩统计文件，为None时不保存
+            default_level: 默认压缩级别
+            sample_size: 采样的数据量（文件开头）
+            stored_ratio: 压缩率高于该值时不压缩
+            fast_ratio: 压缩率高于该值时使用快速压缩
+            entropy_threshold: 样本字节熵（bit/字节）高于该值时视为已压缩数据
+            min_max_level_speed: 最高压缩级别的最低可接受速度（字节/秒/线程）
+            min_stats_bytes: 使用扩展名统计所需的最少数据量
+            min_stats_files: 使用扩展名统计所需的最少文件数
+            resample_interval: 按统计决定时每隔多少个文件重新试压缩一次样本，0 表示不重新试压缩
+        """
+        self.stats_file = Path(stats_file) if stats_file else None
+        self.default_level = default_level
+        self.sample_size = sample_size
+        self.stored_ratio = stored_ratio
+        self.fast_ratio = fast_ratio
+        self.entropy_threshold = entropy_threshold
+        self.min_max_level_speed = min_max_level_speed
+        self.min_stats_bytes = min_stats_bytes
+        self.min_stats_files = min_stats_files
+        self.resample_interval = resample_interval
+
+        self._lock = threading.Lock()
+        # {扩展名: 按统计决定的文件数}
+        self._stats_decisions: Counter = Counter()
+        self._dirty = False
+
+        # {扩展名: {压缩级别（'0' 为存储，'sample' 为试压缩样本）: {'bytes', 'compressed', 'seconds', 'files'}}}
+        self.stats: Dict[str, Dict[str, dict]] = self._load_stats()
+
+    @staticmethod
+    def get_extension(relative_path: str) -> str:
+        """获取统计使用的扩展名（小写，没有扩展名时为空字符串）"""
+        return os.path.splitext(relative_path)[1].lower()
+
+    @staticmethod
+    def byte_entropy(data) -> float:
+        """计算数据的字节熵（bit/字节，0~8）"""
+        if not data:
+            return 0.0
+        total = len(data)
+        return -sum(count / total * math.log2(count / total) for count in Counter(data).values())
+
+    def choose(self, relative_path: str, sample) -> CompressionChoice:
+        """
+        为文件选择压缩方式
+        
+        Args:
+            relative_path: 文件相对路径（用于扩展名统计）
+            sample: 文件开头的数据（超过 sample_size 的部分不使用）
+        
+        Returns:
+            压缩方式
+        """
+        sample = memoryview(sample)[:self.sample_size]
+        extension = self.get_extension(relative_path)
+
+        ratio = self.get_ratio(extension)
+        if ratio is not None:
+            reason = 'stats'
+            if len(sample) >= 512 and self._should_resample(extension):
+                ratio = self._sample_ratio(extension, sample)
+                reason = 'sample'
+        elif len(sample) < 512:
+            # 小文件压缩耗时可以忽略，统一使用默认级别
+            return CompressionChoice(False, self.default_level, 'small')
+        elif self.byte_entropy(sample[:4096]) >= self.entropy_threshold:
+            ratio = 1.0
+            reason = 'entropy'
+        else:
+            ratio = self._sample_ratio(extension, sample)
+            reason = 'sample'
+
+        if ratio >= self.stored_ratio:
+            return CompressionChoice(True, 0, reason)
+        if ratio >= self.fast_ratio:
+            return CompressionChoice(False, FAST_LEVEL, reason)
+
+        speed = self.get_speed(extension, MAX_LEVEL)
+        if speed is not None and speed < self.min_max_level_speed:
+            return CompressionChoice(False, self.default_level, reason)
+        return CompressionChoice(False, MAX_LEVEL, reason)
+
+    def _should_resample(self, extension: str) -> bool:
+        """按统计决定的文件是否需要重新试压缩样本（每个扩展名每 resample_interval 个一次）"""
+        if self.resample_interval <= 0:
+            return False
+        with self._lock:
+            self._stats_decisions[extension] += 1
+            return self._stats_decisions[extension] % self.resample_interval == 0
+
+    def _sample_ratio(self, extension: str, sample) -> float:
+        """用快速压缩试压缩样本，记录并返回样本的压缩率"""
+        start = time.perf_counter()
+        compressed_size = len(zlib.compress(sample, FAST_LEVEL))
+        self.record(extension, 'sample', len(sample), compressed_size, time.perf_counter() - start)
+        return compressed_size / len(sample)
+
+    def get_ratio(self, extension: str) -> Optional[float]:
+        """
+        获取扩展名的历史压缩率（不含存储的文件）
+        
+        Args:
+            extension: 扩展名
+        
+        Returns:
+            压缩率，统计数据不足时返回None
+        """
+        with self._lock:
+            entries = [entry for key, entry in self.stats.get(extension, {}).items() if key != '0']
+            total_bytes = sum(entry['bytes'] for entry in entries)
+            total_files = sum(entry['files'] for entry in entries)
+            if total_bytes < self.min_stats_bytes or total_files < self.min_stats_files:
+                return None
+            return sum(entry['compressed'] for entry in entries) / total_bytes
+
+    def get_speed(self, extension: str, level: int) -> Optional[float]:
+        """获取扩展名在指定压缩级别下的历史压缩速度（字节/秒），统计数据不足时返回None"""
+        with self._lock:
+            entry = self.stats.get(extension, {}).get(str(level))
+            if not entry or entry['bytes'] < self.min_stats_bytes or entry['seconds'] <= 0:
+                return None
+            return entry['bytes'] / entry['seconds']
+
+    def record(self, extension: str, level, raw_size: int, compressed_size: int, seconds: float):
+        """
+        累计一次压缩的结果
+        
+        Args:
+            extension: 扩展名
+            level: 压缩级别（0 为存储，'sample' 为试压缩样本）
+            raw_size: 原始大小
+            compressed_size: 压缩后大小
+            seconds: 压缩耗时（各线程合计）
+        """
+        with self._lock:
+            entry = self.stats.setdefault(extension, {}).setdefault(
+                str(level), {'bytes': 0, 'compressed': 0, 'seconds': 0.0, 'files': 0}
+            )
+            entry['bytes'] += raw_size
+            entry['compressed'] += compressed_size
+            entry['seconds'] += seconds
+            entry['files'] += 1
+            self._dirty = True
+
+    def _load_stats(self) -> Dict[str, Dict[str, dict]]:
+        """加载压缩统计"""
+        if not self.stats_file or not self.stats_file.exists():
+            return {}
+        try:
+            with open(self.stats_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"加载压缩统计失败: {e}")
+            return {}
+
+    def save(self):
+        """保存压缩统计（没有新数据时不写入）"""
+        if not self.stats_file or not self._dirty:
+            return
+        try:
+            with self._lock:
+                data = json.dumps(self.stats, ensure_ascii=False, indent=2)
+                self._dirty = False
+            self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.stats_file.with_suffix('.tmp')
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(temp_file, self.stats_file)
+        except IOError as e:
+            print(f"保存压缩统计失败: {e}")
@@ -36,7 +36,8 @@ class ConfigManager:
         # 版本配置模板
         self._version_config_template = {
             "input_directory": "",
-            "output_directory": ""
+            "output_directory": "",
+            "last_deep_verify": ""
         }
 
         self._default_config = {
@@ -51,6 +52,28 @@ class ConfigManager:
                 "exclude_folders": ["Log"],
                 "exclude_extensions": [".log", ".zip", ".dll", ".exe", ".json"]
             },
+            "scan_options": {
+                "incremental_scan": True,  # 复用上次扫描的hash（size/mtime/inode未变化的文件）
+                "deep_verify_interval_days": 7,  # 定期深度校验间隔（天），0 表示不定期校验
+                "hash_backend": "auto",  # hash后端：auto / thread / process
+                "hash_algorithm": "sha256",  # 变更检测摘要算法：sha256 / blake2b / crc32
+                "change_tracking": False,  # 监控输入目录的文件变化，扫描时只处理变化的文件
+                "watch_backend": "auto",  # 监控后端：auto（Linux 使用 inotify）/ inotify / polling
+                "full_scan_interval_minutes": 60,  # 开启监控时定期完整遍历的间隔（分钟），0 表示每次都完整遍历
+                "trust_directory_mtime": False  # 目录mtime未变化时跳过该目录（原地修改的文件会被漏掉，依赖定期深度校验）
+            },
+            "package_options": {
+                "adaptive_compression": True,  # 按文件内容和历史统计选择存储/快速压缩/最高压缩，否则全部使用默认级别
+                "delta_patches": False  # 增量包中修改的文件以二进制补丁代替完整文件（服务端需用 python -m core.package_applier apply 应用）
+            },
+            "cache_options": {
+                "compress": True,  # 压缩存放缓存文件（不值得压缩的文件原样存放）
+                "delta_text": False,  # 文本文件以相对上一版本的补丁存放
+                "max_delta_chain": 8,  # 补丁链的最大长度，超过时存放完整内容
+                "max_size_mb": 0,  # 缓存文件占用磁盘空间的上限（MB），0 表示不限制；超出时丢弃最早版本的内容、淘汰最久未读取的文件
+                "keep_versions": 0,  # 保留内容的最近版本数，0 表示全部保留
+                "max_age_days": 0  # 保留内容的版本的最长时间（天），0 表示不限制
+            },
             "ui_theme": {
                 "appearance_mode": "light",  # 改为白色主题
                 "color_theme": "blue"
@@ -218,6 +241,54 @@ class ConfigManager:
         """获取扫描过滤器配置"""
         return self.get("scan_filters", self._default_config["scan_filters"])
 
+    def get_scan_options(self) -> Dict[str, Any]:
+        """获取扫描选项配置"""
+        return self.get("scan_options", self._default_config["scan_options"])
+
+    def get_package_options(self) -> Dict[str, Any]:
+        """获取打包选项配置"""
+        return self.get("package_options", self._default_config["package_options"])
+
+    def get_cache_options(self) -> Dict[str, Any]:
+        """获取文件缓存选项配置"""
+        return self.get("cache_options", self._default_config["cache_options"])
+
+    def get_last_deep_verify(self, version_index: Optional[int] = None) -> str:
+        """获取最近一次深度校验的时间"""
+        if version_index is None:
+            version_index = self.current_version_index
+        return self.get(f"versions.{version_index}.last_deep_verify", "")
+
+    def set_last_deep_verify(self, timestamp: str, version_index: Optional[int] = None, auto_save: bool = True):
+        """设置最近一次深度校验的时间"""
+        if version_index is None:
+            version_index = self.current_version_index
+        self.set(f"versions.{version_index}.last_deep_verify", timestamp, auto_save)
+
+    def is_deep_verify_due(self, version_index: Optional[int] = None) -> bool:
+        """
+        判断是否到了定期深度校验的时间
+        
+        Args:
+            version_index: 版本配置索引
+            
+        Returns:
+            是否需要执行深度校验
+        """
+        interval_days = self.get_scan_options().get("deep_verify_interval_days", 0)
+        if not interval_days:
+            return False
+
+        last_deep_verify = self.get_last_deep_verify(version_index)
+        if not last_deep_verify:
+            return True
+
+        try:
+            elapsed = datetime.now() - datetime.fromisoformat(last_deep_verify)
+        except ValueError:
+            return True
+        return elapsed.total_seconds() >= interval_days * 86400
+
     def get_ui_theme(self) -> Dict[str, str]:
         """获取UI主题配置"""
         return self.get("ui_theme", self._default_config["ui_theme"])
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+"""
+二进制差异补丁模块，根据旧版本内容生成修改文件的补丁，并在服务端还原和校验
+（服务端由 core.package_applier 应用更新包中的补丁）
+
+补丁格式：
+    第一行为 MIRDELTA，第二行为JSON头（格式版本、基准和目标的sha256与大小），
+    之后是 zlib 压缩的操作流，每个操作为
+        b'C' + <偏移:8字节><长度:8字节>   从基准文件复制
+        b'A' + <长度:8字节> + 数据        写入新数据
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+DELTA_MAGIC = b'MIRDELTA\n'
+DELTA_FORMAT = 1
+DELTA_ALGORITHM = 'sha256'
+
+# 压缩包中补丁成员的根目录和后缀
+DELTA_ROOT = '_delta\\'
+DELTA_SUFFIX = '.mdelta'
+
+_COPY = struct.Struct('<QQ')
+_LENGTH = struct.Struct('<Q')
+
+# 重新对齐时用于查找的锚点长度，以及认定为匹配的最短长度
+_ANCHOR_SIZE = 32
+_MIN_MATCH = 64
+
+# 在预期位置附近查找锚点的范围
+_SEARCH_WINDOW = 256 * 1024
+
+# 每个补丁在整个基准文件中查找锚点的次数上限（每次查找需要遍历基准文件）
+_GLOBAL_SEARCHES = 64
+
+# 重新对齐时先不查找、只按当前偏移向后检查的距离上限（原地修改的固定长度记录在这里就能对齐）
+_LOCAL_RESYNC = 4096
+
+# 每个补丁查找锚点时扫描的数据量上限：目标大小的倍数加固定额度，超过时放弃补丁、打包完整文件
+_SEARCH_BUDGET_RATIO = 32
+_SEARCH_BUDGET_MIN = 64 * 1024 * 1024
+
+# 比较数据时每次比较的块大小
+_COMPARE_CHUNK = 64 * 1024
+
+
+class DeltaError(Exception):
+    """补丁无法应用（格式错误或校验失败）"""
+
+
+def _match_forward(base: memoryview, base_pos: int, target: memoryview, target_pos: int) -> int:
+    """计算 base[base_pos:] 与 target[target_pos:] 的相同前缀长度"""
+    limit = min(len(base) - base_pos, len(target) - target_pos)
+    matched = 0
+    while matched < limit:
+        size = min(_COMPARE_CHUNK, limit - matched)
+        if base[base_pos + matched:base_pos + matched + size] == \
+                target[target_pos + matched:target_pos + matched + size]:
+            matched += size
+            continue
+        # 二分查找第一个不同的字节
+        while size > 1:
+            half = size // 2
+            if base[base_pos + matched:base_pos + matched + half] == \
+                    target[target_pos + matched:target_pos + matched + half]:
+                matched += half
+                size -= half
+            else:
+                size = half
+        if base[base_pos + matched] == target[target_pos + matched]:
+            matched += 1
+        break
+    return matched
+
+
+def _match_backward(base: memoryview, base_end: int, target: memoryview, target_end: int, limit: int) -> int:
+    """计算 base[:base_end] 与 target[:target_end] 的相同后缀长度（最多 limit）"""
+    limit = min(limit, base_end, target_end)
+    matched = 0
+    while matched < limit:
+        size = min(_COMPARE_CHUNK, limit - matched)
+        if base[base_end - matched - size:base_end - matched] == \
+                target[target_end - matched - size:target_end - matched]:
+            matched += size
+            continue
+        while size > 1:
+            half = size // 2
+            if base[base_end - matched - half:base_end - matched] == \
+                    target[target_end - matched - half:target_end - matched]:
+                matched += half
+                size -= half
+            else:
+                size = half
+        if base[base_end - matched - 1] == target[target_end - matched - 1]:
+            matched += 1
+        break
+    return matched
+
+
+class _SearchExhausted(Exception):
+    """查找锚点的数据量超过上限"""
+
+
+class _DeltaEncoder:
+    """根据基准数据为目标数据生成操作流"""
+
+    def __init__(self, base, target, max_literal: int, should_stop: Optional[Callable[[], bool]] = None):
+        self.base = base  # 支持 find 的对象（bytes 或 mmap）
+        self.base_view = memoryview(base)
+        self.target_view = memoryview(target)
+        self.max_literal = max_literal
+        self.should_stop = should_stop
+
+        self.literal_size = 0
+        self.global_searches = 0
+        self.search_budget = len(target) * _SEARCH_BUDGET_RATIO + _SEARCH_BUDGET_MIN
+        self.compressor = zlib.compressobj(9)
+        self.chunks = []
+
+    def _emit(self, data):
+        self.chunks.append(self.compressor.compress(data))
+
+    def _emit_literal(self, start: int, end: int) -> bool:
+        """写入新数据，总量超过上限时返回False"""
+        if end <= start:
+            return True
+        self.literal_size += end - start
+        if self.literal_size > self.max_literal:
+            return False
+        self._emit(b'A' + _LENGTH.pack(end - start))
+        self._emit(self.target_view[start:end])
+        return True
+
+    def _emit_copy(self, offset: int, length: int):
+        self._emit(b'C' + _COPY.pack(offset, length))
+
+    def _match_at(self, target_pos: int, expected: int) -> Optional[Tuple[int, int]]:
+        """检查 target[target_pos:] 是否与预期位置的基准数据匹配，返回 (基准位置, 匹配长度) 或None"""
+        if 0 <= expected <= len(self.base_view) - _ANCHOR_SIZE and \
+                self.base_view[expected:expected + _ANCHOR_SIZE] == \
+                self.target_view[target_pos:target_pos + _ANCHOR_SIZE]:
+            length = _match_forward(self.base_view, expected, self.target_view, target_pos)
+            if length >= _MIN_MATCH:
+                return expected, length
+        return None
+
+    def _find_match(self, target_pos: int, expected: int) -> Optional[Tuple[int, int]]:
+        """
+        在基准数据中查找与 target[target_pos:] 匹配的位置：先看预期位置，再在附近查找，最后在整个基准中查找
+        
+        Returns:
+            (基准位置, 匹配长度)，没有足够长的匹配时返回None
+        
+        Raises:
+            _SearchExhausted: 查找的数据量超过上限
+        """
+        base_size = len(self.base_view)
+        anchor = bytes(self.target_view[target_pos:target_pos + _ANCHOR_SIZE])
+
+        match = self._match_at(target_pos, expected)
+        if match:
+            return match
+
+        ranges = [(max(0, expected - _SEARCH_WINDOW), min(base_size, expected + _SEARCH_WINDOW + _ANCHOR_SIZE))]
+        if self.global_searches < _GLOBAL_SEARCHES:
+            self.global_searches += 1
+            ranges.append((0, base_size))
+        for start, end in ranges:
+            # 每个范围只尝试前几个出现位置，避免重复数据中反复匹配失败
+            for _ in range(8):
+                if self.search_budget <= 0:
+                    raise _SearchExhausted()
+                found = self.base.find(anchor, start, end)
+                self.search_budget -= (end if found < 0 else found + _ANCHOR_SIZE) - start
+                if found < 0:
+                    break
+                length = _match_forward(self.base_view, found, self.target_view, target_pos)
+                if length >= _MIN_MATCH:
+                    return found, length
+                start = found + 1
+        return None
+
+    def encode(self) -> Optional[bytes]:
+        """生成压缩后的操作流，新数据或查找量超过上限、被停止时返回None"""
+        try:
+            return self._encode()
+        except _SearchExhausted:
+            return None
+
+    def _stopped(self) -> bool:
+        return bool(self.should_stop and self.should_stop())
+
+    def _encode(self) -> Optional[bytes]:
+        """生成压缩后的操作流，见 encode"""
+        target_size = len(self.target_view)
+        position = 0
+        literal_start = 0
+        shift = 0  # 基准位置 - 目标位置
+
+        while position < target_size:
+            if self._stopped():
+                return None
+
+            # 按当前偏移继续匹配（原地修改的文件大部分走这里）
+            expected = position + shift
+            if 0 <= expected < len(self.base_view):
+                length = _match_forward(self.base_view, expected, self.target_view, position)
+                if length >= _MIN_MATCH or (length and position + length == target_size):
+                    if not self._emit_literal(literal_start, position):
+                        return None
+                    self._emit_copy(expected, length)
+                    position += length
+                    literal_start = position
+                    continue
+
+            # 重新对齐：按指数增长的距离向后取锚点，先只检查当前偏移，再查找，找到后向前扩展匹配
+            match = None
+            step = 16
+            while step <= _LOCAL_RESYNC and position + step + _ANCHOR_SIZE <= target_size:
+                match = self._match_at(position + step, position + step + shift)
+                if match:
+                    break
+                step *= 2
+            if match is None:
+                step = 0
+                while position + step + _ANCHOR_SIZE <= target_size:
+                    if self._stopped():
+                        return None
+                    match = self._find_match(position + step, position + step + shift)
+                    if match:
+                        break
+                    step = step * 2 if step else 16
+            if match is None:
+                break
+
+            base_pos, length = match
+            target_pos = position + step
+            back = _match_backward(self.base_view, base_pos, self.target_view, target_pos, target_pos - literal_start)
+            base_pos -= back
+            target_pos -= back
+            length += back
+
+            if not self._emit_literal(literal_start, target_pos):
+                return None
+            self._emit_copy(base_pos, length)
+            position = target_pos + length
+            literal_start = position
+            shift = base_pos - target_pos
+
+        if not self._emit_literal(literal_start, target_size):
+            return None
+        self.chunks.append(self.compressor.flush())
+        return b''.join(self.chunks)
+
+
+def create_delta(base, target, base_sha256: str = '', target_sha256: str = '',
+                 max_literal_ratio: float = 0.5,
+                 should_stop: Optional[Callable[[], bool]] = None) -> Optional[bytes]:
+    """
+    生成补丁
+    
+    Args:
+        base: 基准（旧版本）数据，bytes 或 mmap
+        target: 目标（新版本）数据，bytes 或 mmap
+        base_sha256: 基准数据的sha256，为空时计算
+        target_sha256: 目标数据的sha256，为空时计算
+        max_literal_ratio: 新数据超过目标大小的该比例时放弃（补丁不比完整文件小多少）
+        should_stop: 返回True时停止生成
+    
+    Returns:
+        补丁数据，放弃（包括查找锚点的数据量超过上限）或被停止时返回None
+    """
+    max_literal = int(len(target) * max_literal_ratio)
+    operations = _DeltaEncoder(base, target, max_literal, should_stop).encode()
+    if operations is None:
+        return None
+
+    header = {
+        "format": DELTA_FORMAT,
+        "algorithm": DELTA_ALGORITHM,
+        "base_hash": base_sha256 or hashlib.sha256(base).hexdigest(),
+        "base_size": len(base),
+        "target_hash": target_sha256 or hashlib.sha256(target).hexdigest(),
+        "target_size": len(target)
+    }
+    return DELTA_MAGIC + json.dumps(header).encode('utf-8') + b'\n' + operations
+
+
+def read_delta_header(patch: bytes) -> Tuple[dict, int]:
+    """
+    解析补丁头
+    
+    Args:
+        patch: 补丁数据
+    
+    Returns:
+        (补丁头, 操作流的起始位置)
+    """
+    if not patch.startswith(DELTA_MAGIC):
+        raise DeltaError("不是补丁文件")
+    header_end = patch.find(b'\n', len(DELTA_MAGIC))
+    if header_end < 0:
+        raise DeltaError("补丁头不完整")
+    try:
+        header = json.loads(patch[len(DELTA_MAGIC):header_end].decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise DeltaError(f"补丁头错误: {e}")
+    if header.get('format') != DELTA_FORMAT or header.get('algorithm') != DELTA_ALGORITHM:
+        raise DeltaError(f"不支持的补丁格式: {header.get('format')}")
+    return header, header_end + 1
+
+
+class _OperationReader:
+    """按需解压补丁的操作流"""
+
+    def __init__(self, patch: bytes, offset: int, chunk_size: int = 1024 * 1024):
+        self._input = memoryview(patch)[offset:]
+        self._pending = b''
+        self._buffer = bytearray()
+        self._decompressor = zlib.decompressobj()
+        self.chunk_size = chunk_size
+
+    def _fill(self, size: int):
+        while len(self._buffer) < size and not self._decompressor.eof:
+            if not self._pending:
+                if not self._input:
+                    break
+                self._pending = self._input[:self.chunk_size]
+                self._input = self._input[self.chunk_size:]
+            self._buffer += self._decompressor.decompress(self._pending, self.chunk_size)
+            self._pending = self._decompressor.unconsumed_tail
+
+    def read(self, size: int) -> bytes:
+        """读取指定长度的数据，数据不足时抛出 DeltaError"""
+        self._fill(size)
+        if len(self._buffer) < size:
+            raise DeltaError("补丁数据不完整")
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def at_end(self) -> bool:
+        """操作流是否已经读完"""
+        self._fill(1)
+        if self._buffer:
+            return False
+        if not self._decompressor.eof:
+            raise DeltaError("补丁数据不完整")
+        return True
+
+
+def _iter_target(patch: bytes, offset: int, base_view: memoryview):
+    """按操作流依次产生目标数据（复制的数据是基准的视图，只在下一次迭代前有效）"""
+    reader = _OperationReader(patch, offset)
+    while not reader.at_end():
+        kind = reader.read(1)
+        if kind == b'C':
+            source, length = _COPY.unpack(reader.read(_COPY.size))
+            if source + length > len(base_view):
+                raise DeltaError("补丁复制范围超出基准文件")
+            for position in range(source, source + length, reader.chunk_size):
+                with base_view[position:min(position + reader.chunk_size, source + length)] as data:
+                    yield data
+        elif kind == b'A':
+            length, = _LENGTH.unpack(reader.read(_LENGTH.size))
+            for position in range(0, length, reader.chunk_size):
+                yield reader.read(min(reader.chunk_size, length - position))
+        else:
+            raise DeltaError("补丁操作错误")
+
+
+def apply_delta_data(patch: bytes, base) -> bytes:
+    """
+    在内存中应用补丁（用于缓存中以补丁存放的小文件）
+    
+    Args:
+        patch: 补丁数据
+        base: 基准数据
+    
+    Returns:
+        目标数据
+    
+    Raises:
+        DeltaError: 补丁格式错误、基准数据不一致或还原结果校验失败
+    """
+    header, offset = read_delta_header(patch)
+    if len(base) != header['base_size'] or hashlib.sha256(base).hexdigest() != header['base_hash']:
+        raise DeltaError("基准数据与补丁不一致")
+    target = bytearray()
+    try:
+        with memoryview(base) as base_view:
+            for data in _iter_target(patch, offset, base_view):
+                target += data
+    except zlib.error as e:
+        raise DeltaError(f"补丁数据错误: {e}")
+    if len(target) != header['target_size'] or hashlib.sha256(target).hexdigest() != header['target_hash']:
+        raise DeltaError("还原结果校验失败")
+    return bytes(target)
+
+
+def apply_delta(patch: bytes, base_file: Path, output_file: Optional[Path] = None) -> dict:
+    """
+    应用补丁：校验基准文件，还原目标文件并校验后替换（替换基准文件且其内容已经是目标版本时直接返回）
+    
+    Args:
+        patch: 补丁数据
+        base_file: 基准文件（旧版本）
+        output_file: 输出文件，为None时替换基准文件
+    
+    Returns:
+        补丁头
+    
+    Raises:
+        DeltaError: 补丁格式错误、基准文件不一致或还原结果校验失败
+    """
+    header, offset = read_delta_header(patch)
+    base_file = Path(base_file)
+    output_file = Path(output_file) if output_file else base_file
+
+    if not base_file.exists():
+        raise DeltaError(f"基准文件不存在: {base_file}")
+
+    base_handle, base_data = map_file(base_file)
+    try:
+        base_digest = hashlib.sha256(base_data).hexdigest()
+        if output_file == base_file and len(base_data) == header['target_size'] and \
+                base_digest == header['target_hash']:
+            # 已经应用过该补丁
+            close_map(base_handle, base_data)
+            return header
+        if len(base_data) != header['base_size'] or base_digest != header['base_hash']:
+            raise DeltaError(f"基准文件与补丁不一致: {base_file}")
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=str(output_file.parent), suffix='.tmp')
+    except BaseException:
+        close_map(base_handle, base_data)
+        raise
+
+    try:
+        hasher = hashlib.sha256()
+        written = 0
+        with os.fdopen(fd, 'wb') as out, memoryview(base_data) as base_view:
+            for data in _iter_target(patch, offset, base_view):
+                out.write(data)
+                hasher.update(data)
+                written += len(data)
+
+        if written != header['target_size'] or hasher.hexdigest() != header['target_hash']:
+            raise DeltaError(f"还原结果校验失败: {output_file}")
+    except zlib.error as e:
+        _remove(temp_path)
+        raise DeltaError(f"补丁数据错误: {e}")
+    except BaseException:
+        _remove(temp_path)
+        raise
+    finally:
+        close_map(base_handle, base_data)
+
+    # 基准文件映射关闭后再替换（Windows 不能替换已映射的文件）；mkstemp 创建的文件为 0600，沿用基准文件的权限
+    try:
+        os.chmod(temp_path, os.stat(base_file).st_mode & 0o7777)
+        os.replace(temp_path, output_file)
+    except BaseException:
+        _remove(temp_path)
+        raise
+    return header
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def map_file(path: Path):
+    """
+    只读映射文件内容，空文件返回 b''
+    
+    Returns:
+        (文件对象, 映射数据)，使用完后需要关闭
+    """
+    f = open(path, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return f, b''
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except BaseException:
+        f.close()
+        raise
+
+
+def close_map(handle, data):
+    """关闭 map_file 返回的文件对象和映射"""
+    if isinstance(data, mmap.mmap):
+        data.close()
+    handle.close()
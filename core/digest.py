@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+文件摘要算法模块
+"""
+
+import hashlib
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+from core.file_reader import digest_file
+
+# 变更检测默认使用的摘要算法：与打包清单一致，旧快照不需要迁移；
+# OpenSSL 的 sha256 可以使用 SHA 扩展指令，在支持的 CPU 上比 blake2b 更快（见 benchmarks/bench_file_reader.py）
+DEFAULT_ALGORITHM = 'sha256'
+
+# 写入打包清单的摘要算法
+MANIFEST_ALGORITHM = 'sha256'
+
+# 旧版本快照没有记录算法时使用的算法
+LEGACY_ALGORITHM = 'sha256'
+
+# 不小于该大小的文件使用分段树形摘要，各分段并行计算
+TREE_THRESHOLD = 256 * 1024 * 1024
+
+# 树形摘要的分段大小
+TREE_SEGMENT_SIZE = 32 * 1024 * 1024
+
+# 分段内每次读取的大小
+_TREE_READ_SIZE = 1024 * 1024
+
+
+class Crc32SizeHasher:
+    """CRC32 + 文件大小的快速摘要，只用于变更检测"""
+
+    name = 'crc32'
+
+    def __init__(self):
+        self._crc = 0
+        self._size = 0
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+
+    def hexdigest(self) -> str:
+        return f"{self._crc & 0xffffffff:08x}-{self._size:x}"
+
+
+def _new_blake2b():
+    return hashlib.blake2b(digest_size=16)
+
+
+# 算法名称 -> 摘要对象工厂
+_ALGORITHMS: Dict[str, Callable] = {
+    'sha256': hashlib.sha256,
+    'blake2b': _new_blake2b,
+    'crc32': Crc32SizeHasher,
+}
+
+
+def available_algorithms() -> Tuple[str, ...]:
+    """获取支持的摘要算法"""
+    return tuple(_ALGORITHMS)
+
+
+def is_supported(algorithm: str) -> bool:
+    """判断摘要算法是否支持"""
+    return algorithm in _ALGORITHMS
+
+
+def new_hasher(algorithm: str = DEFAULT_ALGORITHM):
+    """
+    创建摘要对象
+    
+    Args:
+        algorithm: 摘要算法名称
+    
+    Returns:
+        支持 update / hexdigest 的摘要对象
+    """
+    try:
+        return _ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError(f"不支持的摘要算法: {algorithm}")
+
+
+def bytes_digest(data: bytes, algorithm: str = DEFAULT_ALGORITHM) -> str:
+    """计算内存数据的摘要"""
+    hasher = new_hasher(algorithm)
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def file_digests(file_path: Union[str, Path], algorithms: Sequence[str],
+                 should_stop: Optional[Callable[[], bool]] = None) -> Tuple[str, ...]:
+    """
+    读取一次文件，同时计算多个摘要
+    
+    Args:
+        file_path: 文件路径
+        algorithms: 摘要算法列表
+        should_stop: 返回True时中止读取
+    
+    Returns:
+        与 algorithms 顺序一致的摘要元组，读取失败时均为空字符串
+    """
+    hashers = [new_hasher(algorithm) for algorithm in algorithms]
+    try:
+        if digest_file(file_path, hashers, should_stop) is None:
+            return ('',) * len(hashers)
+        return tuple(hasher.hexdigest() for hasher in hashers)
+    except (OSError, IOError, ValueError) as e:
+        print(f"读取文件失败 {file_path}: {e}")
+        return ('',) * len(hashers)
+
+
+def file_digest(file_path: Union[str, Path], algorithm: str = DEFAULT_ALGORITHM,
+                should_stop: Optional[Callable[[], bool]] = None) -> str:
+    """
+    计算文件摘要
+    
+    Args:
+        file_path: 文件路径
+        algorithm: 摘要算法
+        should_stop: 返回True时中止读取
+    
+    Returns:
+        文件摘要，读取失败时返回空字符串
+    """
+    return file_digests(file_path, (algorithm,), should_stop)[0]
+
+
+def _segment_digest(file_path: Union[str, Path], offset: int, length: int, algorithm: str,
+                    should_stop: Optional[Callable[[], bool]] = None) -> str:
+    """
+    使用定位读取计算文件一个分段的摘要
+    
+    Args:
+        file_path: 文件路径
+        offset: 分段起始偏移
+        length: 分段长度
+        algorithm: 摘要算法
+        should_stop: 返回True时中止读取
+    
+    Returns:
+        分段摘要
+    """
+    hasher = new_hasher(algorithm)
+    end = offset + length
+    buffer = memoryview(bytearray(_TREE_READ_SIZE))
+    # 每个分段单独打开文件，Windows 没有 os.preadv 时改用 seek + readinto
+    with open(file_path, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        positional = hasattr(os, 'preadv')
+        if not positional:
+            f.seek(offset)
+        while offset < end:
+            if should_stop and should_stop():
+                raise InterruptedError("读取已中止")
+            view = buffer[:min(_TREE_READ_SIZE, end - offset)]
+            count = os.preadv(fd, [view], offset) if positional else f.readinto(view)
+            if not count:
+                break
+            hasher.update(view[:count])
+            offset += count
+    return hasher.hexdigest()
+
+
+def combine_segment_digests(segment_digests: Sequence[str], algorithm: str,
+                            segment_size: int, file_size: int) -> str:
+    """
+    将分段摘要合并为文件摘要
+    
+    Args:
+        segment_digests: 按顺序排列的分段摘要
+        algorithm: 摘要算法
+        segment_size: 分段大小
+        file_size: 文件大小
+    
+    Returns:
+        文件的树形摘要
+    """
+    hasher = new_hasher(algorithm)
+    hasher.update(f"tree:{segment_size}:{file_size}\n".encode('ascii'))
+    for segment_digest in segment_digests:
+        hasher.update(segment_digest.encode('ascii') + b'\n')
+    return hasher.hexdigest()
+
+
+def tree_digest(file_path: Union[str, Path], algorithm: str = DEFAULT_ALGORITHM,
+                segment_size: int = TREE_SEGMENT_SIZE, max_workers: Optional[int] = None,
+                should_stop: Optional[Callable[[], bool]] = None) -> Tuple[str, Tuple[str, ...]]:
+    """
+    分段并行计算大文件的树形摘要
+    
+    Args:
+        file_path: 文件路径
+        algorithm: 摘要算法
+        segment_size: 分段大小
+        max_workers: 并行线程数，默认为CPU核数
+        should_stop: 返回True时中止读取
+    
+    Returns:
+        (文件摘要, 各分段摘要)，读取失败时为 ('', ())
+    """
+    try:
+        file_size = os.path.getsize(file_path)
+        offsets = range(0, max(file_size, 1), segment_size)
+        workers = min(len(offsets), max_workers or os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            segment_digests = tuple(executor.map(
+                lambda offset: _segment_digest(file_path, offset, min(segment_size, file_size - offset),
+                                               algorithm, should_stop),
+                offsets
+            ))
+        return combine_segment_digests(segment_digests, algorithm, segment_size, file_size), segment_digests
+    except (OSError, IOError, InterruptedError) as e:
+        print(f"读取文件失败 {file_path}: {e}")
+        return '', ()
+
+
+class ContentHasher:
+    """
+    流式计算与 content_digest 一致的摘要（大文件按分段计算树形摘要），
+    用于在一次读取中同时完成打包、缓存和校验
+    """
+
+    def __init__(self, algorithm: str = DEFAULT_ALGORITHM, file_size: int = 0):
+        """
+        初始化流式摘要
+        
+        Args:
+            algorithm: 摘要算法
+            file_size: 预期的文件大小，决定是否使用树形摘要
+        """
+        self.algorithm = algorithm
+        self.tree = file_size >= TREE_THRESHOLD
+        self.size = 0
+        self.segments = []
+        self._hasher = new_hasher(algorithm)
+        self._segment_filled = 0
+
+    def update(self, data):
+        self.size += len(data)
+        if not self.tree:
+            self._hasher.update(data)
+            return
+
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), TREE_SEGMENT_SIZE - self._segment_filled)
+            self._hasher.update(view[:take])
+            self._segment_filled += take
+            view = view[take:]
+            if self._segment_filled == TREE_SEGMENT_SIZE:
+                self.segments.append(self._hasher.hexdigest())
+                self._hasher = new_hasher(self.algorithm)
+                self._segment_filled = 0
+
+    def hexdigest(self) -> str:
+        if not self.tree:
+            return self._hasher.hexdigest()
+        segments = list(self.segments)
+        if self._segment_filled or not segments:
+            segments.append(self._hasher.hexdigest())
+        return combine_segment_digests(segments, self.algorithm, TREE_SEGMENT_SIZE, self.size)
+
+
+def content_digest(file_path: Union[str, Path], algorithm: str = DEFAULT_ALGORITHM,
+                   file_size: Optional[int] = None,
+                   should_stop: Optional[Callable[[], bool]] = None) -> Tuple[str, Optional[Tuple[str, ...]]]:
+    """
+    计算用于变更检测的文件摘要：小文件整体计算，大文件使用分段树形摘要
+    
+    扫描、缓存等所有做变更检测的地方都必须使用该函数，保证同一文件得到相同的摘要。
+    
+    Args:
+        file_path: 文件路径
+        algorithm: 摘要算法
+        file_size: 文件大小，为None时重新获取
+        should_stop: 返回True时中止读取
+    
+    Returns:
+        (文件摘要, 分段摘要)，小文件的分段摘要为None，读取失败时摘要为空字符串
+    """
+    try:
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+    except OSError as e:
+        print(f"读取文件失败 {file_path}: {e}")
+        return '', None
+
+    if file_size >= TREE_THRESHOLD:
+        return tree_digest(file_path, algorithm, should_stop=should_stop)
+    return file_digest(file_path, algorithm, should_stop), None
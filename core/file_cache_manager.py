@@ -1,27 +1,176 @@
 # -*- coding: utf-8 -*-
 """
 文件缓存管理模块
+
+缓存文件按内容存储在 blobs/<hash算法>/<hash前2位>/<hash>，不同路径的相同内容只保存一份，
+索引中每个路径记录指向的缓存文件，缓存文件的引用计数由索引统计。
+缓存文件有三种存放形式（文件名后缀）：
+    无后缀  原始内容（不值得压缩的文件、关闭压缩时或旧版缓存）
+    .z      zlib 压缩的内容
+    .d      相对同一路径上一版本的补丁（可选，仅文本文件）：第一行为 MIRBLOB，第二行为JSON头
+            {base: 基准内容的hash, depth: 补丁链长度}，之后是 core.delta 格式的补丁
+各版本打包的文件内容记录在索引的 history 中（{相对路径: [[版本, hash或None（删除）], ...]}，只在内容变化时追加），
+versions 按记录顺序保存版本号和hash算法，可以读取任意版本的文件内容，对比任意两个版本。
+collect_garbage 按保留版本数、版本时间和磁盘预算裁剪版本链、淘汰最久未访问的文件（读取缓存内容的时间批量记录在日志中），
+再标记索引和保留版本引用的缓存文件（包括补丁的基准），删除其余的缓存文件。
+缓存索引由快照 cache_index.json 和只追加写入的日志 cache_index.journal（JSON Lines）组成：
+每次修改追加一行日志，批量修改（一次打包）结束时才落盘一次，日志超过快照的条目数时合并为新的快照。
+加载时先读取快照再重放日志，中断时留下的不完整的最后一行会被忽略。
 """
 
+import difflib
 import hashlib
 import json
 import os
 import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from core.delta import DeltaError, apply_delta_data, close_map, create_delta, map_file
+from core.digest import DEFAULT_ALGORITHM, LEGACY_ALGORITHM, TREE_THRESHOLD, ContentHasher, content_digest
+from core.file_clone import FileCloner
+
+# 日志条目数超过该值且超过索引中的文件数时合并为快照
+_COMPACT_MIN_ENTRIES = 1000
+
+# 缓存文件的后缀：zlib 压缩、补丁
+_ZLIB_SUFFIX = '.z'
+_DELTA_SUFFIX = '.d'
+_DELTA_MAGIC = b'MIRBLOB\n'
+
+# 缓存写入在打包的主线程中进行，使用快速压缩；采样压缩后不超过原大小的该比例才压缩存放
+_COMPRESS_LEVEL = 1
+_COMPRESS_SAMPLE = 256 * 1024
+_COMPRESS_RATIO = 0.9
+_COMPRESS_CHUNK = 1024 * 1024
+
+# 超过该大小的文件不以补丁存放（补丁在内存中生成和还原）
+_DELTA_MAX_SIZE = 8 * 1024 * 1024
+
+_TEXT_EXTENSIONS = {
+    '.txt', '.md', '.py', '.js', '.html', '.css', '.xml', '.json',
+    '.ini', '.cfg', '.conf', '.log', '.csv', '.sql', '.sh', '.bat',
+    '.yml', '.yaml', '.toml', '.properties', '.c', '.cpp', '.h',
+    '.java', '.cs', '.php', '.rb', '.go', '.rs', '.kt', '.swift'
+}
+
+
+class CacheWriter:
+    """
+    缓存文件写入器，打包时与压缩、校验共用同一次读取的数据
+    
+    需要压缩时先缓存开头 _COMPRESS_SAMPLE 字节的数据，采样值得压缩则之后边写入边压缩（suffix 为 .z），
+    否则原样写入，存入缓存时不再重新读取文件压缩。
+    """
+
+    def __init__(self, temp_dir: Path, compress: bool = False):
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=str(temp_dir), suffix='.tmp')
+        self.temp_path = Path(temp_path)
+        self._file = os.fdopen(fd, 'wb')
+        self.compress = compress
+        # 已写入内容的存放形式：None 为尚未决定（采样中），'' 为原样，.z 为压缩
+        self.suffix: Optional[str] = None if compress else ''
+        self._sample = bytearray()
+        self._compressor = None
+
+    def update(self, data):
+        """写入一块数据（与摘要对象接口一致，可直接作为 file_reader 的输出目标）"""
+        if self.suffix is None:
+            self._sample += data
+            if len(self._sample) >= _COMPRESS_SAMPLE:
+                self._decide()
+        elif self._compressor is not None:
+            self._file.write(self._compressor.compress(data))
+        else:
+            self._file.write(data)
+
+    def _decide(self):
+        """根据采样决定存放形式，并写入采样数据"""
+        sample = bytes(self._sample[:_COMPRESS_SAMPLE])
+        if sample and len(zlib.compress(sample, _COMPRESS_LEVEL)) <= len(sample) * _COMPRESS_RATIO:
+            self.suffix = _ZLIB_SUFFIX
+            self._compressor = zlib.compressobj(_COMPRESS_LEVEL)
+        else:
+            self.suffix = ''
+        data = self._sample
+        self._sample = bytearray()
+        self.update(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.suffix is None:
+                self._decide()
+            if self._compressor is not None:
+                self._file.write(self._compressor.flush())
+                self._compressor = None
+        finally:
+            self._file.close()
+
+    def discard(self):
+        """放弃写入并删除临时文件"""
+        self._file.close()
+        try:
+            self.temp_path.unlink()
+        except OSError:
+            pass
+
+
+@dataclass
+class CacheGCReport:
+    """缓存清理结果"""
+    removed_blobs: int = 0  # 删除的缓存文件数
+    reclaimed_bytes: int = 0  # 释放的磁盘空间
+    stored_bytes: int = 0  # 清理后缓存文件占用的磁盘空间
+    dropped_versions: List[str] = field(default_factory=list)  # 不再保留内容的版本
+    evicted_files: int = 0  # 因超出预算从索引中淘汰的文件数
+    stopped: bool = False  # 是否被中途停止（已删除的文件和已提交的索引修改保持有效）
+
+
+class _GCStopped(Exception):
+    """清理缓存被停止"""
 
 
 class FileCacheManager:
     """文件缓存管理器，负责缓存文件内容用于差异对比"""
 
-    def __init__(self, cache_dir: Optional[Path] = None):
+    def __init__(self, cache_dir: Optional[Path] = None, hash_algorithm: str = DEFAULT_ALGORITHM,
+                 link_mode: str = 'reflink', compress: bool = True, delta_text: bool = False,
+                 max_delta_chain: int = 8, lru_bytes: int = 32 * 1024 * 1024):
         """
         初始化缓存管理器
         
         Args:
             cache_dir: 缓存目录路径，如果为None则使用默认路径
+            hash_algorithm: 判断文件是否变化使用的摘要算法，见 core.digest
+            link_mode: 原样存放时把源文件存入缓存的方式，见 core.file_clone.CLONE_MODES；
+                默认不使用硬链接，避免原地修改源文件时缓存内容跟着变化
+            compress: 是否压缩存放缓存文件
+            delta_text: 文本文件是否以相对上一版本的补丁存放
+            max_delta_chain: 补丁链的最大长度，超过时存放完整内容
+            lru_bytes: 内存中保留的最近读取内容的总大小
         """
+        self.hash_algorithm = hash_algorithm
+        self.cloner = FileCloner(link_mode)
+        self.compress = compress
+        self.delta_text = delta_text
+        self.max_delta_chain = max_delta_chain
+        self.lru_bytes = lru_bytes
+        # {缓存文件: 原始内容}，按最近读取排序
+        self._decoded: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._decoded_bytes = 0
+        self._lru_lock = threading.Lock()
+
         if cache_dir is None:
             # 默认使用用户主目录下的缓存目录（但推荐传入output_dir/cache）
             home_dir = Path.home()
@@ -31,61 +180,676 @@ class FileCacheManager:
 
         self.cache_dir.mkdir(parents=True, exist_ok=True)
 
-        # 缓存索引文件
+        # 缓存索引文件（快照 + 日志）
         self.index_file = self.cache_dir / "cache_index.json"
+        self.journal_file = self.cache_dir / "cache_index.journal"
+        self._journal = None
+        self._journal_entries = 0
+        self._batch_depth = 0
+        # 后台清理缓存时与打包线程共用索引
+        self._lock = threading.RLock()
+        self._gc_lock = threading.Lock()
         self.cache_index = self._load_cache_index()
+        # {缓存文件: 引用它的路径数}
+        self._blob_refs = Counter(info.get("cache_file") for info in self.cache_index["files"].values())
+        # {版本号: 记录顺序}
+        self._version_positions = self._index_versions()
+        # {相对路径: 最近读取时间}，提交时写入日志
+        self._accessed: Dict[str, str] = {}
 
     @classmethod
-    def create_for_output_dir(cls, output_dir: Path) -> 'FileCacheManager':
+    def create_for_output_dir(cls, output_dir: Path,
+                              hash_algorithm: str = DEFAULT_ALGORITHM, **options) -> 'FileCacheManager':
         """
         为指定输出目录创建缓存管理器
         
         Args:
             output_dir: 输出目录路径
+            hash_algorithm: 判断文件是否变化使用的摘要算法
+            options: 其他初始化参数（compress、delta_text 等）
             
         Returns:
             缓存管理器实例
         """
         cache_dir = output_dir / "cache"
-        return cls(cache_dir)
+        return cls(cache_dir, hash_algorithm, **options)
 
     def _load_cache_index(self) -> Dict:
-        """加载缓存索引"""
+        """加载缓存索引（读取快照并重放日志）"""
+        cache_index = {"files": {}, "last_update": None}
         if self.index_file.exists():
             try:
                 with open(self.index_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    cache_index = json.load(f)
             except (json.JSONDecodeError, IOError):
                 pass
-        return {"files": {}, "last_update": None}
+
+        if self.journal_file.exists():
+            try:
+                with open(self.journal_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except (json.JSONDecodeError, ValueError):
+                            # 中断时可能留下不完整的最后一行
+                            continue
+                        self._apply_record(cache_index, record)
+                        self._journal_entries += 1
+            except IOError as e:
+                print(f"加载缓存索引日志失败: {e}")
+        return cache_index
+
+    @staticmethod
+    def _apply_record(cache_index: Dict, record: Dict):
+        """把一条日志应用到索引（重复应用结果不变）"""
+        op = record.get("op")
+        if op == "set":
+            cache_index["files"][record["path"]] = record["info"]
+        elif op == "del":
+            cache_index["files"].pop(record["path"], None)
+        elif op == "last_update":
+            cache_index["last_update"] = record["value"]
+        elif op == "version":
+            FileCacheManager._apply_version(cache_index, record)
+        elif op == "trim_history":
+            FileCacheManager._apply_trim(cache_index, record["keep_from"])
+        elif op == "evict":
+            cache_index["files"].pop(record["path"], None)
+            cache_index.get("history", {}).pop(record["path"], None)
+        elif op == "access":
+            for path, accessed in record["paths"].items():
+                if path in cache_index["files"]:
+                    cache_index["files"][path]["accessed"] = accessed
+
+    @staticmethod
+    def _apply_version(cache_index: Dict, record: Dict):
+        """把版本记录追加到各路径的版本链"""
+        versions = cache_index.setdefault("versions", [])
+        history = cache_index.setdefault("history", {})
+        version = record["version"]
+
+        names = [item["version"] for item in versions]
+        if version in names:
+            # 版本记录被重置后重新打包，丢弃该版本及之后的记录
+            dropped = set(names[names.index(version):])
+            del versions[names.index(version):]
+            for path in list(history):
+                chain = [entry for entry in history[path] if entry[0] not in dropped]
+                if chain:
+                    history[path] = chain
+                else:
+                    del history[path]
+
+        versions.append({"version": version, "algorithm": record["algorithm"], "timestamp": record.get("timestamp")})
+        for path, file_hash in record["files"].items():
+            chain = history.setdefault(path, [])
+            if not chain or chain[-1][1] != file_hash:
+                chain.append([version, file_hash])
+        for path in record["deleted"]:
+            chain = history.get(path)
+            if chain and chain[-1][1] is not None:
+                chain.append([version, None])
+
+    @staticmethod
+    def _apply_trim(cache_index: Dict, keep_from: str):
+        """丢弃 keep_from 之前的版本，各路径在 keep_from 时的内容改记在 keep_from 下"""
+        versions = cache_index.get("versions", [])
+        names = [item["version"] for item in versions]
+        if keep_from not in names or names.index(keep_from) == 0:
+            return
+        start = names.index(keep_from)
+        dropped = {item["version"]: item["algorithm"] for item in versions[:start]}
+        del versions[:start]
+        algorithm = versions[0]["algorithm"]
+
+        history = cache_index.get("history", {})
+        for path in list(history):
+            old = [entry for entry in history[path] if entry[0] in dropped]
+            chain = [entry for entry in history[path] if entry[0] not in dropped]
+            if old and old[-1][1] is not None and dropped[old[-1][0]] == algorithm and \
+                    (not chain or chain[0][0] != keep_from):
+                chain.insert(0, [keep_from, old[-1][1]])
+            if chain:
+                history[path] = chain
+            else:
+                del history[path]
+
+    def _index_versions(self) -> Dict[str, int]:
+        return {item["version"]: position for position, item in enumerate(self.cache_index.get("versions", []))}
+
+    def _record(self, record: Dict):
+        """修改索引并追加日志，不在批量修改中时立即提交"""
+        with self._lock:
+            self._append_record(record)
+            if not self._batch_depth:
+                self.commit()
+
+    def _append_record(self, record: Dict):
+        """修改索引并追加日志（不提交）"""
+        with self._lock:
+            self._apply_record(self.cache_index, record)
+            try:
+                if self._journal is None:
+                    self._journal = open(self.journal_file, 'a', encoding='utf-8')
+                    if self._journal.tell() > 0:
+                        # 结束上次中断时可能残留的不完整行
+                        self._journal.write('\n')
+                self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self._journal_entries += 1
+            except IOError as e:
+                print(f"保存缓存索引失败: {e}")
+
+    def _touch_path(self, relative_path: str):
+        """记录读取了该路径的缓存内容（超出预算时按最近读取时间淘汰），下次提交时写入日志"""
+        with self._lock:
+            if relative_path in self.cache_index["files"]:
+                self._accessed[relative_path] = datetime.now().isoformat()
+
+    def _get_access_time(self, relative_path: str, info: Dict) -> str:
+        """获取路径最近一次读取或缓存的时间"""
+        return self._accessed.get(relative_path) or info.get("accessed") or info.get("timestamp") or ''
+
+    def _set_file_info(self, relative_path: str, info: Dict):
+        with self._lock:
+            self._release_blob(relative_path)
+            self._blob_refs[info["cache_file"]] += 1
+            self._record({"op": "set", "path": relative_path, "info": info})
+
+    def _remove_file_info(self, relative_path: str, evict: bool = False):
+        """从索引中删除文件，evict 为True时同时删除该文件的版本链"""
+        with self._lock:
+            self._release_blob(relative_path)
+            self._record({"op": "evict" if evict else "del", "path": relative_path})
+
+    def _release_blob(self, relative_path: str):
+        """路径不再引用原来的缓存文件（引用计数为0的缓存文件暂时保留，仍可按hash找到）"""
+        cached_info = self.cache_index["files"].get(relative_path)
+        if cached_info:
+            cache_file = cached_info.get("cache_file")
+            self._blob_refs[cache_file] -= 1
+            if self._blob_refs[cache_file] <= 0:
+                del self._blob_refs[cache_file]
+
+    def get_reference_count(self, cache_file: Path) -> int:
+        """获取缓存文件被索引中多少个路径引用"""
+        return self._blob_refs.get(str(cache_file), 0)
+
+    @contextmanager
+    def batch(self):
+        """批量修改缓存索引（如一次打包），结束时只提交一次"""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.commit()
+
+    def commit(self):
+        """把日志写入磁盘，日志过长时合并为新的快照"""
+        with self._lock:
+            if self._accessed:
+                accessed, self._accessed = self._accessed, {}
+                self._append_record({"op": "access", "paths": accessed})
+            if self._journal is None:
+                return
+            try:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+            except (IOError, OSError) as e:
+                print(f"保存缓存索引失败: {e}")
+            self._journal = None
+            if self._journal_entries > max(_COMPACT_MIN_ENTRIES, len(self.cache_index["files"])):
+                self._save_cache_index()
 
     def _save_cache_index(self):
-        """保存缓存索引"""
+        """保存缓存索引快照（写入临时文件后替换）并清空日志"""
+        temp_file = self.index_file.with_suffix('.tmp')
         try:
-            with open(self.index_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache_index, f, ensure_ascii=False, indent=2)
-        except IOError as e:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.cache_index, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.index_file)
+            # 快照已包含日志中的所有修改，删除前中断时重放日志结果也不变
+            if self.journal_file.exists():
+                self.journal_file.unlink()
+            self._journal_entries = 0
+        except (IOError, OSError) as e:
             print(f"保存缓存索引失败: {e}")
 
-    def _get_file_hash(self, file_path: Path) -> Optional[str]:
-        """获取文件的SHA256哈希值"""
-        try:
-            with open(file_path, 'rb') as f:
-                file_hash = hashlib.sha256()
-                for chunk in iter(lambda: f.read(4096), b""):
-                    file_hash.update(chunk)
-                return file_hash.hexdigest()
-        except IOError:
+    def _get_file_hash(self, file_path: Path, algorithm: Optional[str] = None) -> Optional[str]:
+        """获取文件的哈希值，默认使用缓存管理器配置的算法"""
+        return content_digest(file_path, algorithm or self.hash_algorithm)[0] or None
+
+    def _migrate_cached_hash(self, relative_path: str, cached_info: Dict) -> Optional[str]:
+        """
+        缓存记录的hash算法与当前算法不同时，用当前算法重新计算缓存文件的hash并更新记录；
+        没有记录算法的旧记录中的大文件是整体计算的hash（分段树形摘要之前），同样重新计算
+        
+        Args:
+            relative_path: 相对路径
+            cached_info: 缓存索引中的文件记录
+            
+        Returns:
+            当前算法下的hash，缓存文件不存在时返回None
+        """
+        flat_digest = "algorithm" not in cached_info and cached_info.get("size", 0) >= TREE_THRESHOLD
+        if cached_info.get("algorithm", LEGACY_ALGORITHM) == self.hash_algorithm and not flat_digest:
+            return cached_info.get("hash")
+
+        cache_file_path = Path(cached_info["cache_file"])
+        if not cache_file_path.exists():
             return None
 
-    def _get_cache_file_path(self, file_path: str, file_hash: str) -> Path:
-        """获取缓存文件路径"""
-        # 使用文件路径的哈希值作为目录结构，避免路径过长
+        if self._get_blob_suffix(cache_file_path):
+            try:
+                data = self._read_blob(cache_file_path)
+            except (OSError, zlib.error, DeltaError):
+                return None
+            content_hasher = ContentHasher(self.hash_algorithm, len(data))
+            content_hasher.update(data)
+            migrated_hash = content_hasher.hexdigest()
+        else:
+            migrated_hash = self._get_file_hash(cache_file_path)
+        if migrated_hash:
+            self._set_file_info(relative_path, dict(cached_info, hash=migrated_hash,
+                                                    algorithm=self.hash_algorithm))
+        return migrated_hash
+
+    def _get_cache_file_path(self, file_hash: str, algorithm: Optional[str] = None) -> Path:
+        """获取内容对应的缓存文件路径（不含存放形式的后缀），默认按当前算法的hash寻址"""
+        return self.cache_dir / "blobs" / (algorithm or self.hash_algorithm) / file_hash[:2] / file_hash
+
+    def _get_legacy_cache_file_path(self, file_path: str, file_hash: str) -> Path:
+        """获取按路径存放的旧版缓存文件路径"""
         path_hash = hashlib.md5(file_path.encode('utf-8')).hexdigest()
-        cache_subdir = self.cache_dir / path_hash[:2] / path_hash[2:4]
-        cache_subdir.mkdir(parents=True, exist_ok=True)
         filename, extension = os.path.splitext(file_path)
-        return cache_subdir / f"{file_hash}.{extension}"
+        return self.cache_dir / path_hash[:2] / path_hash[2:4] / f"{file_hash}.{extension}"
+
+    def _get_blob_suffix(self, cache_file_path: Path) -> str:
+        """获取缓存文件的存放形式（后缀），原始内容和旧版缓存返回空字符串"""
+        if cache_file_path.suffix in (_ZLIB_SUFFIX, _DELTA_SUFFIX) and \
+                self.cache_dir / "blobs" in cache_file_path.parents:
+            return cache_file_path.suffix
+        return ''
+
+    def _find_blob(self, file_hash: str, algorithm: Optional[str] = None) -> Optional[Path]:
+        """查找内容对应的缓存文件（任意存放形式）"""
+        cache_file_path = self._get_cache_file_path(file_hash, algorithm)
+        for suffix in ('', _ZLIB_SUFFIX, _DELTA_SUFFIX):
+            candidate = cache_file_path.with_name(cache_file_path.name + suffix)
+            if candidate.exists():
+                return candidate
+        return None
+
+    def _store_blob(self, file_hash: str, relative_path: str, source_file: Path, move: bool, info: Dict,
+                    encoded: Optional[str] = None) -> Path:
+        """
+        把内容存入缓存文件（内容已经存在时不再写入），并把该路径的索引记录指向它
+        
+        查找或放入缓存文件与登记引用在同一次加锁中完成，清理缓存时在同一把锁下复查引用后才删除文件，
+        不会删除刚被引用的缓存文件
+        
+        Args:
+            file_hash: 内容的hash（当前算法）
+            relative_path: 相对路径（文本文件以该路径当前缓存的版本为补丁基准）
+            source_file: 内容所在的文件
+            move: 原样存放时是否可以直接移动 source_file（打包时写入的临时文件）
+            info: 索引记录（不含 cache_file）
+            encoded: source_file 已经按该后缀的存放形式写好（CacheWriter 边读边决定是否压缩），直接移动不再编码
+        
+        Returns:
+            缓存文件路径
+        """
+        with self._lock:
+            existing = self._find_blob(file_hash)
+            if existing is not None:
+                self._touch_blob(existing)
+                self._set_file_info(relative_path, dict(info, cache_file=str(existing)))
+                return existing
+
+        cache_file_path = self._get_cache_file_path(file_hash)
+        cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = self.cache_dir / "tmp"
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = temp_dir / f"{file_hash}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if encoded is not None:
+                os.replace(source_file, temp_path)
+                suffix = encoded
+            else:
+                suffix = self._encode_blob(relative_path, source_file, temp_path)
+            if suffix is None:
+                # 原样存放（优先 reflink / copy_file_range）
+                if move:
+                    os.replace(source_file, temp_path)
+                else:
+                    self.cloner.clone(source_file, temp_path)
+                suffix = ''
+            cache_file_path = cache_file_path.with_name(cache_file_path.name + suffix)
+            with self._lock:
+                existing = self._find_blob(file_hash)
+                if existing is not None:
+                    # 其他线程已经存入相同内容
+                    temp_path.unlink()
+                    cache_file_path = existing
+                    self._touch_blob(existing)
+                else:
+                    os.replace(temp_path, cache_file_path)
+                self._set_file_info(relative_path, dict(info, cache_file=str(cache_file_path)))
+        except BaseException:
+            try:
+                temp_path.unlink()
+            except OSError:
+                pass
+            raise
+        return cache_file_path
+
+    def _touch_blob(self, cache_file_path: Path):
+        """更新缓存文件及其补丁基准链的修改时间，正在进行的清理不会删除它们（本次标记时可能还未被引用）"""
+        for _ in range(self.max_delta_chain + 1):
+            try:
+                os.utime(cache_file_path)
+                if self._get_blob_suffix(cache_file_path) != _DELTA_SUFFIX:
+                    return
+                with open(cache_file_path, 'rb') as f:
+                    header, _ = self._parse_delta_blob(f.readline() + f.readline())
+            except (OSError, DeltaError):
+                return
+            cache_file_path = self._find_blob(header["base"], cache_file_path.parent.parent.name)
+            if cache_file_path is None:
+                return
+
+    def _encode_blob(self, relative_path: str, source_file: Path, temp_path: Path) -> Optional[str]:
+        """
+        按配置把内容以补丁或压缩形式写入临时文件
+        
+        Returns:
+            存放形式的后缀，应原样存放时返回None
+        """
+        if self.delta_text and os.path.getsize(source_file) <= _DELTA_MAX_SIZE:
+            with open(source_file, 'rb') as f:
+                data = f.read()
+            if self._is_text_data(relative_path, data):
+                blob = self._encode_delta(relative_path, data)
+                if blob is not None:
+                    with open(temp_path, 'wb') as f:
+                        f.write(blob)
+                    return _DELTA_SUFFIX
+
+        if self.compress and self._compress_file(source_file, temp_path):
+            return _ZLIB_SUFFIX
+        return None
+
+    def _encode_delta(self, relative_path: str, data: bytes) -> Optional[bytes]:
+        """生成相对该路径当前缓存版本的补丁缓存文件，没有基准、补丁链过长或补丁不够小时返回None"""
+        cached_info = self.cache_index["files"].get(relative_path)
+        if not cached_info or cached_info.get("algorithm", LEGACY_ALGORITHM) != self.hash_algorithm:
+            return None
+        base_file = Path(cached_info["cache_file"])
+        try:
+            depth = self._get_delta_depth(base_file) + 1
+            if depth > self.max_delta_chain:
+                return None
+            base = self._read_blob(base_file)
+        except (OSError, zlib.error, DeltaError):
+            return None
+
+        patch = create_delta(base, data)
+        if patch is None or len(patch) >= len(zlib.compress(data, _COMPRESS_LEVEL)):
+            return None
+        header = {"base": cached_info["hash"], "depth": depth}
+        return _DELTA_MAGIC + json.dumps(header).encode('utf-8') + b'\n' + patch
+
+    @staticmethod
+    def _compress_file(source_file: Path, temp_path: Path) -> bool:
+        """采样内容值得压缩时把文件压缩写入临时文件，返回是否已写入"""
+        compressor = zlib.compressobj(_COMPRESS_LEVEL)
+        with open(source_file, 'rb') as src:
+            sample = src.read(_COMPRESS_SAMPLE)
+            if not sample or len(zlib.compress(sample, _COMPRESS_LEVEL)) > len(sample) * _COMPRESS_RATIO:
+                return False
+            with open(temp_path, 'wb') as dst:
+                chunk = sample
+                while chunk:
+                    dst.write(compressor.compress(chunk))
+                    chunk = src.read(_COMPRESS_CHUNK)
+                dst.write(compressor.flush())
+        return True
+
+    @staticmethod
+    def _parse_delta_blob(blob: bytes):
+        """解析补丁缓存文件，返回 (头, 补丁)"""
+        header_end = blob.find(b'\n', len(_DELTA_MAGIC))
+        if not blob.startswith(_DELTA_MAGIC) or header_end < 0:
+            raise DeltaError("不是补丁缓存文件")
+        try:
+            header = json.loads(blob[len(_DELTA_MAGIC):header_end].decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise DeltaError(f"补丁缓存文件头错误: {e}")
+        return header, blob[header_end + 1:]
+
+    def _get_delta_depth(self, cache_file_path: Path) -> int:
+        """获取缓存文件的补丁链长度，完整内容为0"""
+        if self._get_blob_suffix(cache_file_path) != _DELTA_SUFFIX:
+            return 0
+        with open(cache_file_path, 'rb') as f:
+            header, _ = self._parse_delta_blob(f.readline() + f.readline())
+        return header.get("depth", 1)
+
+    def _read_blob(self, cache_file_path: Path) -> bytes:
+        """
+        读取缓存文件的原始内容（解压、还原补丁），最近读取的内容保留在内存中
+        
+        Raises:
+            OSError: 读取失败
+            zlib.error: 解压失败
+            DeltaError: 补丁基准缺失或还原校验失败
+        """
+        key = str(cache_file_path)
+        with self._lru_lock:
+            data = self._decoded.get(key)
+            if data is not None:
+                self._decoded.move_to_end(key)
+                return data
+
+        with open(cache_file_path, 'rb') as f:
+            data = f.read()
+        suffix = self._get_blob_suffix(cache_file_path)
+        if suffix == _ZLIB_SUFFIX:
+            data = zlib.decompress(data)
+        elif suffix == _DELTA_SUFFIX:
+            header, patch = self._parse_delta_blob(data)
+            # 基准与补丁在同一算法目录下
+            base_file = self._find_blob(header["base"], cache_file_path.parent.parent.name)
+            if base_file is None:
+                raise DeltaError(f"补丁基准缺失: {header['base']}")
+            data = apply_delta_data(patch, self._read_blob(base_file))
+
+        if len(data) <= self.lru_bytes // 4:
+            with self._lru_lock:
+                if key not in self._decoded:
+                    self._decoded[key] = data
+                    self._decoded_bytes += len(data)
+                while self._decoded_bytes > self.lru_bytes:
+                    _, evicted = self._decoded.popitem(last=False)
+                    self._decoded_bytes -= len(evicted)
+        return data
+
+    def is_cached(self, relative_path: str, file_hash: str) -> bool:
+        """检查文件的指定hash版本是否已经缓存"""
+        cached_info = self.cache_index["files"].get(relative_path)
+        if not cached_info or not file_hash:
+            return False
+        return self._migrate_cached_hash(relative_path, cached_info) == file_hash
+
+    def _locate_cached_file(self, relative_path: str, file_hash: str) -> Optional[Path]:
+        """查找文件指定hash版本的缓存文件（记为读取了该路径），不存在时返回None"""
+        self._touch_path(relative_path)
+        if self.is_cached(relative_path, file_hash):
+            cache_file_path = Path(self.cache_index["files"][relative_path]["cache_file"])
+        elif file_hash:
+            # 索引已经指向更新的版本时，旧版本的内容可能还在（包括其他路径的相同内容）
+            cache_file_path = self._find_blob(file_hash) or \
+                self._get_legacy_cache_file_path(relative_path, file_hash)
+        else:
+            return None
+        return cache_file_path if cache_file_path.exists() else None
+
+    def get_cached_data(self, relative_path: str, file_hash: str) -> Optional[bytes]:
+        """
+        获取文件指定hash版本的缓存内容（整体读入内存，大文件应使用 map_cached_data）
+        
+        Args:
+            relative_path: 相对路径
+            file_hash: 需要的版本的hash（当前算法）
+            
+        Returns:
+            文件内容，没有该版本的缓存或读取失败时返回None
+        """
+        cache_file_path = self._locate_cached_file(relative_path, file_hash)
+        if cache_file_path is None:
+            return None
+        try:
+            return self._read_blob(cache_file_path)
+        except (OSError, zlib.error, DeltaError) as e:
+            print(f"读取缓存文件失败 {relative_path}: {e}")
+            return None
+
+    @contextmanager
+    def map_cached_data(self, relative_path: str, file_hash: str):
+        """
+        只读映射文件指定hash版本的缓存内容，不把大文件整体读入内存：
+        原始内容直接映射缓存文件，压缩内容解压到临时文件后映射，补丁（不超过 _DELTA_MAX_SIZE）在内存中还原
+        
+        Args:
+            relative_path: 相对路径
+            file_hash: 需要的版本的hash（当前算法）
+            
+        Yields:
+            文件内容（bytes 或 mmap），没有该版本的缓存或读取失败时为None
+        """
+        handle = data = temp_path = None
+        cache_file_path = self._locate_cached_file(relative_path, file_hash)
+        if cache_file_path is not None:
+            try:
+                suffix = self._get_blob_suffix(cache_file_path)
+                if suffix == _ZLIB_SUFFIX:
+                    data, temp_path = self._decompress_blob(cache_file_path)
+                    if temp_path is not None:
+                        handle, data = map_file(temp_path)
+                elif suffix == _DELTA_SUFFIX:
+                    data = self._read_blob(cache_file_path)
+                else:
+                    handle, data = map_file(cache_file_path)
+            except (OSError, zlib.error, DeltaError) as e:
+                print(f"读取缓存文件失败 {relative_path}: {e}")
+                data = None
+        try:
+            yield data
+        finally:
+            if handle is not None:
+                close_map(handle, data)
+            if temp_path is not None:
+                try:
+                    temp_path.unlink()
+                except OSError:
+                    pass
+
+    def _decompress_blob(self, cache_file_path: Path) -> Tuple[Optional[bytes], Optional[Path]]:
+        """
+        流式解压缓存文件：内容不超过 _DELTA_MAX_SIZE 时留在内存中，否则写入临时文件
+        
+        Returns:
+            (内容, None) 或 (None, 临时文件路径)，临时文件由调用方删除
+        
+        Raises:
+            OSError: 读写失败
+            zlib.error: 解压失败
+        """
+        decompressor = zlib.decompressobj()
+        chunks = []
+        size = 0
+        temp_file = None
+        try:
+            with open(cache_file_path, 'rb') as src:
+                while not decompressor.eof:
+                    # 限制每次解压的输出大小，高压缩比的内容也不会一次展开到内存中
+                    chunk = decompressor.unconsumed_tail or src.read(_COMPRESS_CHUNK)
+                    if not chunk:
+                        raise zlib.error("压缩数据不完整")
+                    data = decompressor.decompress(chunk, _COMPRESS_CHUNK)
+                    if temp_file is not None:
+                        temp_file.write(data)
+                        continue
+                    chunks.append(data)
+                    size += len(data)
+                    if size > _DELTA_MAX_SIZE:
+                        temp_dir = self.cache_dir / "tmp"
+                        temp_dir.mkdir(parents=True, exist_ok=True)
+                        temp_file = tempfile.NamedTemporaryFile(dir=str(temp_dir), suffix='.tmp', delete=False)
+                        temp_file.writelines(chunks)
+                        chunks = []
+        except BaseException:
+            if temp_file is not None:
+                temp_file.close()
+                os.unlink(temp_file.name)
+            raise
+        if temp_file is None:
+            return b''.join(chunks), None
+        temp_file.close()
+        return None, Path(temp_file.name)
+
+    def open_writer(self, size: Optional[int] = None) -> CacheWriter:
+        """
+        创建缓存文件写入器，写入完成后调用 commit_writer 或 CacheWriter.discard
+        
+        Args:
+            size: 预期的内容大小；可能以补丁存放的文件原样写入，存入缓存时再生成补丁
+        """
+        compress = self.compress and not (self.delta_text and (size is None or size <= _DELTA_MAX_SIZE))
+        return CacheWriter(self.cache_dir / "tmp", compress)
+
+    def commit_writer(self, writer: CacheWriter, file_path: Path, relative_path: str,
+                      file_hash: str, stat: os.stat_result) -> bool:
+        """
+        把写入器写入的内容登记为文件的缓存
+        
+        Args:
+            writer: 已写入完整内容的写入器
+            file_path: 实际文件路径
+            relative_path: 相对路径（用作索引键）
+            file_hash: 写入内容的hash（当前算法）
+            stat: 读取时的stat结果
+            
+        Returns:
+            是否成功缓存
+        """
+        writer.close()
+        try:
+            if self.is_cached(relative_path, file_hash):
+                writer.discard()
+                return True
+
+            self._store_blob(file_hash, relative_path, writer.temp_path, move=True, info={
+                "hash": file_hash,
+                "algorithm": self.hash_algorithm,
+                "size": stat.st_size,
+                "timestamp": datetime.now().isoformat(),
+                "original_path": str(file_path)
+            }, encoded=writer.suffix if writer.compress else None)
+            if writer.temp_path.exists():
+                # 相同内容已经缓存
+                writer.discard()
+            return True
+        except OSError as e:
+            print(f"缓存文件失败 {relative_path}: {e}")
+            writer.discard()
+            return False
 
     def cache_file(self, file_path: Path, relative_path: str) -> bool:
         """
@@ -110,26 +874,18 @@ class FileCacheManager:
             # 检查是否已经缓存
             if relative_path in self.cache_index["files"]:
                 cached_info = self.cache_index["files"][relative_path]
-                if cached_info.get("hash") == file_hash:
+                if self._migrate_cached_hash(relative_path, cached_info) == file_hash:
                     # 文件没有变化，不需要重新缓存
                     return True
 
-            # 获取缓存文件路径
-            cache_file_path = self._get_cache_file_path(relative_path, file_hash)
-
-            # 复制文件到缓存目录
-            shutil.copy2(file_path, cache_file_path)
-
-            # 更新缓存索引
-            self.cache_index["files"][relative_path] = {
+            # 存入缓存（相同内容只保存一份）并更新缓存索引
+            self._store_blob(file_hash, relative_path, file_path, move=False, info={
                 "hash": file_hash,
-                "cache_file": str(cache_file_path),
+                "algorithm": self.hash_algorithm,
                 "size": file_path.stat().st_size,
                 "timestamp": datetime.now().isoformat(),
                 "original_path": str(file_path)
-            }
-
-            self._save_cache_index()
+            })
             return True
 
         except Exception as e:
@@ -155,45 +911,147 @@ class FileCacheManager:
 
             if not cache_file_path.exists():
                 # 缓存文件不存在，清理索引
-                del self.cache_index["files"][relative_path]
-                self._save_cache_index()
+                self._remove_file_info(relative_path)
                 return None
 
+            data = self._read_blob(cache_file_path)
+            self._touch_path(relative_path)
+
             # 检查是否为文本文件
-            if not self._is_text_file(cache_file_path):
+            if not self._is_text_data(relative_path, data):
                 return None
 
-            # 读取文件内容
-            with open(cache_file_path, 'r', encoding='gbk', errors='ignore') as f:
-                return f.read()
+            return self._decode_text(data)
 
         except Exception as e:
             print(f"读取缓存文件失败 {relative_path}: {e}")
             return None
 
-    def _is_text_file(self, file_path: Path) -> bool:
-        """判断是否为文本文件"""
-        text_extensions = {
-            '.txt', '.md', '.py', '.js', '.html', '.css', '.xml', '.json',
-            '.ini', '.cfg', '.conf', '.log', '.csv', '.sql', '.sh', '.bat',
-            '.yml', '.yaml', '.toml', '.properties', '.c', '.cpp', '.h',
-            '.java', '.cs', '.php', '.rb', '.go', '.rs', '.kt', '.swift'
-        }
+    def record_version(self, version: str, relative_paths: Iterable[str], deleted: Iterable[str] = (),
+                       is_full_package: bool = False):
+        """
+        记录版本中各文件的内容（打包完成后调用，内容为缓存索引中各文件当前的hash）
+        
+        Args:
+            version: 版本号
+            relative_paths: 该版本打包的文件
+            deleted: 相对上一版本删除的文件
+            is_full_package: 是否为全量包（之前有记录而本次没有打包的文件视为删除）
+        """
+        files = {}
+        for relative_path in relative_paths:
+            cached_info = self.cache_index["files"].get(relative_path)
+            if cached_info and cached_info.get("algorithm", LEGACY_ALGORITHM) == self.hash_algorithm:
+                files[relative_path] = cached_info["hash"]
+        deleted = set(deleted)
+        if is_full_package:
+            deleted.update(self.cache_index.get("history", {}))
+        self._record({"op": "version", "version": version, "algorithm": self.hash_algorithm,
+                      "timestamp": datetime.now().isoformat(), "files": files,
+                      "deleted": sorted(deleted - set(files))})
+        self._version_positions = self._index_versions()
+
+    def get_recorded_versions(self) -> List[str]:
+        """获取记录了文件内容的版本（按记录顺序）"""
+        return [item["version"] for item in self.cache_index.get("versions", [])]
 
-        if file_path.suffix.lower() in text_extensions:
+    def get_path_versions(self, relative_path: str) -> List[Tuple[str, Optional[str]]]:
+        """
+        获取文件的版本链
+        
+        Returns:
+            [(内容变化的版本, hash)]，hash 为None表示该版本删除了文件
+        """
+        return [tuple(entry) for entry in self.cache_index.get("history", {}).get(relative_path, [])]
+
+    def get_version_data(self, relative_path: str, version: str) -> Optional[bytes]:
+        """
+        获取文件在指定版本的内容
+        
+        Args:
+            relative_path: 相对路径
+            version: 版本号
+            
+        Returns:
+            文件内容，该版本没有该文件、没有记录或缓存文件缺失时返回None
+        """
+        position = self._version_positions.get(version)
+        chain = self.cache_index.get("history", {}).get(relative_path)
+        if position is None or not chain:
+            return None
+
+        # 版本链只记录内容变化的版本，取不晚于该版本的最后一次变化
+        for entry_version, file_hash in reversed(chain):
+            entry_position = self._version_positions.get(entry_version, -1)
+            if entry_position <= position:
+                break
+        else:
+            return None
+        if file_hash is None:
+            return None
+
+        algorithm = self.cache_index["versions"][entry_position]["algorithm"]
+        cache_file_path = self._find_blob(file_hash, algorithm)
+        if cache_file_path is None:
+            return None
+        self._touch_path(relative_path)
+        try:
+            return self._read_blob(cache_file_path)
+        except (OSError, zlib.error, DeltaError) as e:
+            print(f"读取缓存文件失败 {relative_path} ({version}): {e}")
+            return None
+
+    def get_version_content(self, relative_path: str, version: str) -> Optional[str]:
+        """获取文本文件在指定版本的内容，不存在或不是文本文件时返回None"""
+        data = self.get_version_data(relative_path, version)
+        if data is None or not self._is_text_data(relative_path, data):
+            return None
+        return self._decode_text(data)
+
+    def diff_versions(self, relative_path: str, old_version: str, new_version: str,
+                      context_lines: int = 3) -> List[str]:
+        """
+        生成文件在两个版本之间的差异
+        
+        Args:
+            relative_path: 相对路径
+            old_version: 旧版本号
+            new_version: 新版本号
+            context_lines: 上下文行数
+            
+        Returns:
+            统一差异格式的行列表（某一版本没有该文件时按空文件对比）
+        """
+        old_content = self.get_version_content(relative_path, old_version) or ''
+        new_content = self.get_version_content(relative_path, new_version) or ''
+        return list(difflib.unified_diff(
+            old_content.splitlines(keepends=True),
+            new_content.splitlines(keepends=True),
+            fromfile=f"{old_version}/{relative_path}",
+            tofile=f"{new_version}/{relative_path}",
+            n=context_lines
+        ))
+
+    @staticmethod
+    def _decode_text(data: bytes) -> str:
+        """按 GBK 解码，与文本模式读取一致统一换行符"""
+        return data.decode('gbk', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+
+    @staticmethod
+    def _is_text_data(relative_path: str, data: bytes) -> bool:
+        """根据原文件的扩展名和内容开头判断是否为文本文件"""
+        if Path(relative_path).suffix.lower() in _TEXT_EXTENSIONS:
             return True
 
-        # 尝试读取文件开头判断
+        sample = data[:8192]
+        # 检查是否包含null字节
+        if b'\0' in sample:
+            return False
+        # 尝试解码
         try:
-            with open(file_path, 'rb') as f:
-                sample = f.read(8192)
-                # 检查是否包含null字节
-                if b'\0' in sample:
-                    return False
-                # 尝试解码
-                sample.decode('utf-8')
-                return True
-        except (UnicodeDecodeError, IOError):
+            sample.decode('utf-8')
+            return True
+        except UnicodeDecodeError:
             return False
 
     def cache_files_batch(self, files_dict: Dict[str, Path]) -> List[str]:
@@ -207,16 +1065,199 @@ class FileCacheManager:
             成功缓存的文件列表
         """
         cached_files = []
-        for relative_path, file_path in files_dict.items():
-            if self.cache_file(file_path, relative_path):
-                cached_files.append(relative_path)
+        with self.batch():
+            for relative_path, file_path in files_dict.items():
+                if self.cache_file(file_path, relative_path):
+                    cached_files.append(relative_path)
 
-        # 更新最后更新时间
-        self.cache_index["last_update"] = datetime.now().isoformat()
-        self._save_cache_index()
+            # 更新最后更新时间
+            self._record({"op": "last_update", "value": datetime.now().isoformat()})
 
         return cached_files
 
+    def collect_garbage(self, max_bytes: int = 0, keep_versions: int = 0, max_age_days: int = 0,
+                        grace_seconds: float = 60,
+                        should_stop: Optional[Callable[[], bool]] = None) -> CacheGCReport:
+        """
+        清理缓存：按策略裁剪版本链和淘汰文件，再删除不再被引用的缓存文件（标记-清除）
+        
+        1. 只保留最近 keep_versions 个版本、max_age_days 天内记录的版本的内容（最新版本总是保留）；
+        2. 删除索引和保留的版本都不再引用的缓存文件（补丁的基准链视为被引用），以及残留的临时文件；
+        3. 仍超过 max_bytes 时依次丢弃最早的版本，最后按最近读取（或缓存）的时间从早到晚淘汰索引中的文件（LRU）。
+        
+        Args:
+            max_bytes: 缓存文件占用磁盘空间的上限，0 表示不限制
+            keep_versions: 保留内容的版本数，0 表示不限制
+            max_age_days: 保留内容的版本的最长时间（天），0 表示不限制
+            grace_seconds: 不删除最近修改的缓存文件（可能正被打包线程写入）
+            should_stop: 返回True时尽快停止（如即将丢弃该缓存管理器）
+            
+        Returns:
+            清理结果
+        """
+        report = CacheGCReport()
+        with self._gc_lock, self.batch():
+            try:
+                self._collect(max_bytes, keep_versions, max_age_days, time.time() - grace_seconds,
+                              should_stop or (lambda: False), report)
+            except _GCStopped:
+                report.stopped = True
+        return report
+
+    def _collect(self, max_bytes: int, keep_versions: int, max_age_days: int, cutoff: float,
+                 should_stop: Callable[[], bool], report: CacheGCReport):
+        """
+        清理缓存，见 collect_garbage
+        
+        Raises:
+            _GCStopped: 清理被停止
+        """
+        def sweep() -> Dict[Path, int]:
+            if should_stop():
+                raise _GCStopped()
+            return self._sweep(self._mark(), cutoff, report, should_stop)
+
+        versions = self.get_recorded_versions()
+        keep_from = 0
+        if keep_versions:
+            keep_from = max(keep_from, len(versions) - keep_versions)
+        if max_age_days:
+            min_timestamp = datetime.fromtimestamp(time.time() - max_age_days * 86400).isoformat()
+            for position, item in enumerate(self.cache_index.get("versions", [])):
+                if item.get("timestamp") and item["timestamp"] < min_timestamp:
+                    keep_from = max(keep_from, position + 1)
+        self._trim_versions(min(keep_from, len(versions) - 1), report)
+
+        blob_sizes = sweep()
+
+        if max_bytes:
+            # 超出预算：丢弃最早的版本
+            while sum(blob_sizes.values()) > max_bytes and len(self.get_recorded_versions()) > 1:
+                self._trim_versions(1, report)
+                blob_sizes = sweep()
+
+            # 仍超出预算：淘汰最久未读取的文件
+            stored_bytes = sum(blob_sizes.values())
+            if stored_bytes > max_bytes:
+                with self._lock:
+                    entries = sorted(self.cache_index["files"].items(),
+                                     key=lambda item: self._get_access_time(*item))
+                for relative_path, info in entries:
+                    if stored_bytes <= max_bytes:
+                        break
+                    cache_file = info.get("cache_file")
+                    self._remove_file_info(relative_path, evict=True)
+                    report.evicted_files += 1
+                    if not self.get_reference_count(cache_file):
+                        stored_bytes -= blob_sizes.get(Path(cache_file), 0)
+                blob_sizes = sweep()
+
+        report.stored_bytes = sum(blob_sizes.values())
+
+    def _trim_versions(self, count: int, report: CacheGCReport):
+        """丢弃最早的 count 个版本的记录"""
+        versions = self.get_recorded_versions()
+        if count <= 0 or count >= len(versions):
+            return
+        self._record({"op": "trim_history", "keep_from": versions[count]})
+        self._version_positions = self._index_versions()
+        report.dropped_versions.extend(versions[:count])
+
+    def _mark(self) -> Set[Path]:
+        """标记索引和版本链引用的缓存文件，以及补丁缓存文件的基准链"""
+        with self._lock:
+            marked = {Path(cache_file) for cache_file in self._blob_refs if cache_file}
+            algorithms = {item["version"]: item["algorithm"] for item in self.cache_index.get("versions", [])}
+            contents = {(file_hash, algorithms.get(version, self.hash_algorithm))
+                        for chain in self.cache_index.get("history", {}).values()
+                        for version, file_hash in chain if file_hash}
+
+        for file_hash, algorithm in contents:
+            cache_file_path = self._find_blob(file_hash, algorithm)
+            if cache_file_path is not None:
+                marked.add(cache_file_path)
+
+        pending = list(marked)
+        while pending:
+            cache_file_path = pending.pop()
+            if self._get_blob_suffix(cache_file_path) != _DELTA_SUFFIX:
+                continue
+            try:
+                with open(cache_file_path, 'rb') as f:
+                    header, _ = self._parse_delta_blob(f.readline() + f.readline())
+            except (OSError, DeltaError):
+                continue
+            base_file = self._find_blob(header["base"], cache_file_path.parent.parent.name)
+            if base_file is not None and base_file not in marked:
+                marked.add(base_file)
+                pending.append(base_file)
+        return marked
+
+    def _sweep(self, marked: Set[Path], cutoff: float, report: CacheGCReport,
+               should_stop: Callable[[], bool]) -> Dict[Path, int]:
+        """
+        删除未标记且修改时间早于 cutoff 的缓存文件和临时文件
+        
+        Returns:
+            保留的缓存文件 {路径: 大小}
+        
+        Raises:
+            _GCStopped: 清理被停止
+        """
+        roots = [self.cache_dir / "blobs", self.cache_dir / "tmp"]
+        # 旧版按路径存放的缓存文件（两级两位十六进制目录）
+        try:
+            roots += [child for child in self.cache_dir.iterdir() if child.is_dir() and len(child.name) == 2 and
+                      all(c in '0123456789abcdef' for c in child.name)]
+        except OSError:
+            pass
+
+        remaining = {}
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+                if should_stop():
+                    raise _GCStopped()
+                for name in filenames:
+                    path = Path(dirpath) / name
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    if path in marked or stat.st_mtime >= cutoff or not self._unlink_unreferenced(path, cutoff):
+                        if root.name != "tmp":
+                            remaining[path] = stat.st_size
+                        continue
+                    report.removed_blobs += 1
+                    report.reclaimed_bytes += stat.st_size
+                if dirpath != str(root):
+                    try:
+                        os.rmdir(dirpath)
+                    except OSError:
+                        pass
+        return remaining
+
+    def _unlink_unreferenced(self, path: Path, cutoff: float) -> bool:
+        """
+        标记之后打包线程可能已经引用了该缓存文件：加锁复查引用和修改时间，仍未被引用时才删除
+        
+        Returns:
+            是否已删除
+        """
+        with self._lock:
+            if str(path) in self._blob_refs:
+                return False
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    return False
+                path.unlink()
+            except OSError:
+                return False
+        with self._lru_lock:
+            data = self._decoded.pop(str(path), None)
+            if data is not None:
+                self._decoded_bytes -= len(data)
+        return True
+
     def clear_cache(self) -> bool:
         """
         清理所有缓存
@@ -225,11 +1266,17 @@ class FileCacheManager:
             是否成功清理
         """
         try:
+            self.commit()
             if self.cache_dir.exists():
                 shutil.rmtree(self.cache_dir)
                 self.cache_dir.mkdir(parents=True, exist_ok=True)
 
             self.cache_index = {"files": {}, "last_update": None}
+            self._blob_refs.clear()
+            self._version_positions = {}
+            with self._lru_lock:
+                self._decoded.clear()
+                self._decoded_bytes = 0
             self._save_cache_index()
             return True
 
@@ -241,13 +1288,21 @@ class FileCacheManager:
         """获取缓存信息"""
         total_files = len(self.cache_index["files"])
         total_size = 0
+        stored_size = 0
 
         for file_info in self.cache_index["files"].values():
             total_size += file_info.get("size", 0)
+        for cache_file in self._blob_refs:
+            try:
+                stored_size += os.path.getsize(cache_file)
+            except (OSError, TypeError):
+                pass
 
         return {
             "total_files": total_files,
             "total_size": total_size,
+            "blob_count": len(self._blob_refs),
+            "stored_size": stored_size,
             "last_update": self.cache_index.get("last_update"),
             "cache_dir": str(self.cache_dir)
         }
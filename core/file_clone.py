@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+文件克隆模块，按文件系统的支持情况用 reflink（写时复制）、硬链接或复制生成文件副本
+"""
+
+import errno
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Set, Tuple
+
+# Linux FICLONE ioctl（btrfs、XFS 等支持）
+_FICLONE = 0x40049409
+
+# 克隆方式，按优先顺序尝试
+CLONE_METHODS = ('reflink', 'hardlink', 'copy')
+
+# 克隆模式 -> 依次尝试的方式
+#   auto: reflink → 硬链接 → 复制（硬链接的文件共享同一份数据，原地修改会影响所有副本）
+#   reflink: reflink → 复制（副本之间互不影响）
+#   copy: 只复制
+CLONE_MODES: Dict[str, Tuple[str, ...]] = {
+    'auto': ('reflink', 'hardlink', 'copy'),
+    'reflink': ('reflink', 'copy'),
+    'copy': ('copy',),
+}
+
+# 表示文件系统不支持该方式的错误，遇到后同一设备不再尝试
+_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY, errno.EMLINK,
+                       getattr(errno, 'EOPNOTSUPP', errno.EINVAL), getattr(errno, 'ENOTSUP', errno.EINVAL)}
+
+
+def reflink_file(source: Path, target: Path):
+    """
+    以 reflink 方式克隆文件（共享数据块，写入时才复制）
+    
+    Raises:
+        OSError: 系统或文件系统不支持
+    """
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "当前系统不支持 reflink")
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(target)
+            raise
+
+
+def _copy_range(source: Path, target: Path) -> bool:
+    """用 copy_file_range 复制文件内容（在内核中复制，部分文件系统会共享数据块），不支持时返回False"""
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        return False
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        try:
+            while remaining > 0:
+                count = copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if count == 0:
+                    return False
+                remaining -= count
+        except OSError as e:
+            if e.errno in _UNSUPPORTED_ERRORS or e.errno == errno.ENOSYS:
+                return False
+            raise
+    return True
+
+
+def copy_file(source: Path, target: Path):
+    """
+    复制文件内容和权限，优先使用 copy_file_range
+    
+    Raises:
+        OSError: 复制失败
+    """
+    if not _copy_range(source, target):
+        shutil.copyfile(source, target)
+    shutil.copymode(source, target)
+
+
+class FileCloner:
+    """文件克隆器，记住各设备不支持的方式，避免每个文件都重复尝试"""
+
+    def __init__(self, mode: str = 'auto'):
+        """
+        初始化克隆器
+        
+        Args:
+            mode: 克隆模式，见 CLONE_MODES
+        """
+        if mode not in CLONE_MODES:
+            raise ValueError(f"不支持的克隆模式: {mode}")
+        self.mode = mode
+        self._lock = threading.Lock()
+        # {(源设备, 目标设备): 不支持的方式}
+        self._unsupported: Dict[Tuple[int, int], Set[str]] = {}
+
+    def clone(self, source: Path, target: Path) -> str:
+        """
+        生成文件副本（目标文件不能已存在）
+        
+        Args:
+            source: 源文件
+            target: 目标文件
+        
+        Returns:
+            实际使用的方式：reflink / hardlink / copy
+        
+        Raises:
+            OSError: 复制失败
+        """
+        devices = (os.stat(source).st_dev, os.stat(Path(target).parent).st_dev)
+        for method in CLONE_MODES[self.mode]:
+            with self._lock:
+                if method in self._unsupported.get(devices, ()):
+                    continue
+            try:
+                if method == 'reflink':
+                    reflink_file(source, target)
+                elif method == 'hardlink':
+                    os.link(source, target)
+                else:
+                    copy_file(source, target)
+                return method
+            except OSError as e:
+                if method == 'copy' or e.errno not in _UNSUPPORTED_ERRORS:
+                    raise
+                with self._lock:
+                    self._unsupported.setdefault(devices, set()).add(method)
+        raise OSError(errno.EOPNOTSUPP, f"无法克隆文件: {source}")
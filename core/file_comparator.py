@@ -4,11 +4,14 @@
 """
 
 import difflib
+import os
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
 from typing import List, Optional, Dict
 
+from core.merkle_index import MerkleIndex
+
 
 class ChangeType(Enum):
     """变更类型"""
@@ -43,21 +46,31 @@ class FileComparator:
         self.max_file_size_for_diff = max_file_size_for_diff
 
     def compare_file_lists(self, old_files: Dict[str, dict],
-                           new_files: Dict[str, dict]) -> List[FileChange]:
+                           new_files: Dict[str, dict],
+                           old_index: Optional[MerkleIndex] = None,
+                           new_index: Optional[MerkleIndex] = None) -> List[FileChange]:
         """
         比较文件列表
         
         Args:
             old_files: 旧文件信息
             new_files: 新文件信息
+            old_index: 旧文件信息的目录索引
+            new_index: 新文件信息的目录索引，两个索引的hash算法一致时跳过摘要相同的目录子树，
+                只比较有差异的文件
             
         Returns:
             文件变更列表
         """
         changes = []
 
-        old_paths = set(old_files.keys())
-        new_paths = set(new_files.keys())
+        if old_index is not None and old_index.is_comparable(new_index):
+            candidates = old_index.diff_paths(new_index)
+            old_paths = {path for path in candidates if path in old_files}
+            new_paths = {path for path in candidates if path in new_files}
+        else:
+            old_paths = set(old_files.keys())
+            new_paths = set(new_files.keys())
 
         # 新增文件
         for path in new_paths - old_paths:
@@ -86,7 +99,8 @@ class FileComparator:
             old_info = old_files[path]
             new_info = new_files[path]
 
-            if old_info['hash'] != new_info['hash']:
+            # 切换hash算法后的首次扫描会带有旧算法的hash（legacy_hash），用它与旧快照对比
+            if old_info['hash'] != new_info.get('legacy_hash', new_info['hash']):
                 changes.append(FileChange(
                     file_path=path,
                     change_type=ChangeType.MODIFIED,
@@ -100,6 +114,22 @@ class FileComparator:
 
         return sorted(changes, key=lambda x: x.file_path)
 
+    @staticmethod
+    def get_directory_rollup(changes: List[FileChange], depth: int = 2) -> Dict[str, int]:
+        """
+        按目录汇总变更数量
+        
+        Args:
+            changes: 文件变更列表
+            depth: 只返回不超过该层级的目录（1 为顶层目录）
+            
+        Returns:
+            {目录相对路径: 变更文件数}
+        """
+        rollup = MerkleIndex.rollup(change.file_path for change in changes)
+        return {path: count for path, count in rollup.items()
+                if path and path.count(os.sep) < depth}
+
     def get_file_diff(self, old_file_path: Path, new_file_path: Path,
                       context_lines: int = 3) -> Optional[List[str]]:
         """
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+文件读取模块，为hash计算和打包提供尽量少拷贝、少系统调用的读取方式
+"""
+
+import hashlib
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Tuple, Union
+
+# 不小于该大小的文件使用 mmap 读取
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+# 可复用读取缓冲区的最大大小，小于该值的文件一次 readinto 读完
+MAX_BUFFER_SIZE = 4 * 1024 * 1024
+
+# mmap 读取时每次交给摘要对象的大小（两次之间检查是否中止）
+MMAP_STEP = 16 * 1024 * 1024
+
+_O_BINARY = getattr(os, 'O_BINARY', 0)
+
+_local = threading.local()
+
+
+def _get_buffer(size: int) -> memoryview:
+    """获取当前线程可复用的读取缓冲区，大小按文件调整，不超过 MAX_BUFFER_SIZE"""
+    size = max(1, min(size, MAX_BUFFER_SIZE))
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(size)
+        _local.buffer = buffer
+    return memoryview(buffer)[:size]
+
+
+def _open_fd(file_path: Union[str, Path]) -> int:
+    """以只读方式打开文件描述符"""
+    return os.open(file_path, os.O_RDONLY | _O_BINARY)
+
+
+def update_from_fd(fd: int, file_size: int, hashers: Sequence,
+                   should_stop: Optional[Callable[[], bool]] = None) -> bool:
+    """
+    从已打开的文件描述符读取全部内容并更新摘要对象
+    
+    Args:
+        fd: 文件描述符（从文件开头读取）
+        file_size: fstat 得到的文件大小
+        hashers: 摘要对象列表
+        should_stop: 返回True时中止读取
+    
+    Returns:
+        是否完整读取（被中止时返回False）
+    """
+    if file_size >= MMAP_THRESHOLD:
+        # 大文件直接映射，避免从内核缓冲区再拷贝一次
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                for offset in range(0, len(view), MMAP_STEP):
+                    if should_stop and should_stop():
+                        return False
+                    chunk = view[offset:offset + MMAP_STEP]
+                    for hasher in hashers:
+                        hasher.update(chunk)
+                    chunk.release()
+        return True
+
+    # 缓冲区放不下的中等文件，单个摘要且无需中止检查时交给 hashlib.file_digest（Python 3.11+）
+    if file_size > MAX_BUFFER_SIZE and len(hashers) == 1 and should_stop is None and \
+            hasattr(hashlib, 'file_digest'):
+        with open(fd, 'rb', buffering=0, closefd=False) as f:
+            hashlib.file_digest(f, lambda: hashers[0])
+        return True
+
+    buffer = _get_buffer(file_size + 1)  # 多1字节，一次读取就能确认已到文件末尾
+    with open(fd, 'rb', buffering=0, closefd=False) as f:
+        while True:
+            if should_stop and should_stop():
+                return False
+            count = f.readinto(buffer)
+            if not count:
+                return True
+            chunk = buffer[:count]
+            for hasher in hashers:
+                hasher.update(chunk)
+
+
+def digest_file(file_path: Union[str, Path], hashers: Sequence,
+                should_stop: Optional[Callable[[], bool]] = None) -> Optional[os.stat_result]:
+    """
+    读取文件并更新摘要对象
+    
+    Args:
+        file_path: 文件路径
+        hashers: 摘要对象列表
+        should_stop: 返回True时中止读取
+    
+    Returns:
+        打开后的 fstat 结果，被中止时返回None
+    
+    Raises:
+        OSError: 读取失败
+    """
+    fd = _open_fd(file_path)
+    try:
+        stat = os.fstat(fd)
+        if not update_from_fd(fd, stat.st_size, hashers, should_stop):
+            return None
+        return stat
+    finally:
+        os.close(fd)
+
+
+def read_file(file_path: Union[str, Path]) -> Tuple[os.stat_result, bytearray]:
+    """
+    一次性读取整个文件
+    
+    Args:
+        file_path: 文件路径
+    
+    Returns:
+        (fstat 结果, 文件内容)，内容直接返回读取用的 bytearray，不再额外拷贝
+    
+    Raises:
+        OSError: 读取失败
+    """
+    fd = _open_fd(file_path)
+    try:
+        stat = os.fstat(fd)
+        # 按 fstat 的大小预分配，通常一次 readinto 即可读完
+        buffer = bytearray(stat.st_size)
+        offset = 0
+        with open(fd, 'rb', buffering=0, closefd=False) as f, memoryview(buffer) as view:
+            while offset < stat.st_size:
+                count = f.readinto(view[offset:])
+                if not count:
+                    break
+                offset += count
+        if offset < stat.st_size:
+            del buffer[offset:]
+        else:
+            # 文件在 fstat 之后变大
+            rest = os.read(fd, MAX_BUFFER_SIZE)
+            while rest:
+                buffer += rest
+                rest = os.read(fd, MAX_BUFFER_SIZE)
+        return stat, buffer
+    finally:
+        os.close(fd)
@@ -3,12 +3,77 @@
 文件扫描和hash计算模块
 """
 
-import hashlib
 import os
+import queue
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Optional, List, Iterable, Iterator, Tuple, Union
+
+from core.digest import DEFAULT_ALGORITHM, TREE_SEGMENT_SIZE, TREE_THRESHOLD, content_digest, file_digest, \
+    file_digests, tree_digest
+from core.merkle_index import MerkleIndex
+from core.scan_checkpoint import ScanCheckpoint
+from core.scan_walker import ExcludeMatcher, SkipDirCallback, WalkDir, WalkEntry, collapse_paths, is_under, \
+    iter_paths, iter_target_files
+
+
+class ScanError(Exception):
+    """扫描失败（遍历目录或调度计算hash出错），此时已返回的结果不完整，不能用于对比"""
+
+
+def _scan_digests(file_path: str, file_size: int, algorithms: Tuple[str, ...],
+                  should_stop=None) -> Tuple[str, str, Optional[Tuple[str, ...]]]:
+    """
+    计算扫描需要的hash：大文件使用分段树形摘要，旧hash（迁移算法，或旧快照中整体计算的大文件）始终整体计算以便与旧快照对比
+    
+    Args:
+        file_path: 文件绝对路径
+        file_size: 文件大小
+        algorithms: hash算法，有第二项时同时整体计算旧hash
+        should_stop: 返回True时中止读取
+        
+    Returns:
+        (hash, 旧算法hash, 分段摘要)，读取失败时hash为空字符串
+    """
+    if file_size >= TREE_THRESHOLD:
+        hash_value, segments = tree_digest(file_path, algorithms[0], should_stop=should_stop)
+        legacy_hash = file_digest(file_path, algorithms[1], should_stop) if len(algorithms) > 1 else ''
+        return hash_value, legacy_hash, segments
+
+    digests = file_digests(file_path, algorithms, should_stop)
+    return digests[0], digests[1] if len(digests) > 1 else '', None
+
+
+def _hash_batch(files: List[Tuple[str, int, Tuple[str, ...]]]) -> Tuple[tuple, ...]:
+    """
+    进程池中批量计算文件hash，结果按输入顺序以元组返回，减少进程间传输的数据量
+    
+    Args:
+        files: (文件绝对路径, 文件大小, hash算法) 列表，hash算法见 _scan_digests
+        
+    Returns:
+        每个文件的 (hash, 旧算法hash, 分段摘要)，读取失败的文件hash为空字符串
+    """
+    return tuple(_scan_digests(path, size, algorithms) for path, size, algorithms in files)
+
+
+def _has_flat_digest(info: Optional[dict]) -> bool:
+    """
+    记录中的大文件hash是否为整体计算的旧hash
+    
+    分段树形摘要之前的快照对所有文件整体计算hash，算法名称相同但与树形摘要不同；树形摘要的记录总是带有 segments。
+    """
+    return bool(info) and info.get('size', 0) >= TREE_THRESHOLD and not info.get('segments')
+
+
+def _shutdown_now(executor: ProcessPoolExecutor):
+    """立即关闭进程池，取消所有尚未开始的任务"""
+    try:
+        executor.shutdown(wait=False, cancel_futures=True)
+    except TypeError:
+        # Python 3.8 及以下没有 cancel_futures 参数
+        executor.shutdown(wait=False)
 
 
 class FileScanner:
@@ -18,7 +83,11 @@ class FileScanner:
                  target_paths: Optional[List[str]] = None,
                  exclude_files: Optional[List[str]] = None,
                  exclude_folders: Optional[List[str]] = None,
-                 exclude_extensions: Optional[List[str]] = None):
+                 exclude_extensions: Optional[List[str]] = None,
+                 max_workers: int = 32,
+                 queue_size: int = 1024,
+                 hash_backend: str = 'auto',
+                 hash_algorithm: str = DEFAULT_ALGORITHM):
         """
         初始化文件扫描器
         
@@ -27,6 +96,10 @@ class FileScanner:
             exclude_files: 需要排除的具体文件列表 (相对路径)
             exclude_folders: 需要排除的文件夹列表
             exclude_extensions: 需要排除的文件扩展名列表
+            max_workers: hash计算线程数
+            queue_size: 遍历与hash计算之间的队列容量，限制扫描过程中的内存占用
+            hash_backend: hash后端，'thread' 线程池、'process' 进程池、'auto' 根据文件大小分布自动选择
+            hash_algorithm: 变更检测使用的摘要算法，见 core.digest
         """
         # 只扫描指定的路径
         self.target_paths = target_paths or ["Mir200", "DBServer\\dbsrc.ini"]
@@ -40,31 +113,52 @@ class FileScanner:
         # 排除的扩展名
         self.exclude_extensions = set(exclude_extensions or [".log", ".zip", ".dll", ".exe", ".json"])
 
+        self._matcher = self._compile_matcher()
+
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(1, queue_size)
+
+        # hash后端配置
+        self.hash_backend = hash_backend
+        self.hash_algorithm = hash_algorithm
+        self.backend_sample_size = 512  # 自动选择后端前取样的文件数
+        self.small_file_threshold = 64 * 1024  # 取样文件大小中位数不超过该值时使用进程池
+        self.batch_max_files = 128  # 进程后端每批最多文件数
+        self.batch_max_bytes = 8 * 1024 * 1024  # 进程后端每批最多字节数
+
         self._stop_scan = False
         self._lock = threading.Lock()
 
-    def calculate_file_hash(self, file_path: Path, algorithm: str = 'sha256') -> str:
+        # 最近一次扫描的统计信息（重新计算hash / 复用hash / 从断点恢复的文件数 / 按目录mtime跳过的目录数，
+        # 使用的hash后端，是否被停止）
+        self.last_scan_stats = self._new_scan_stats()
+
+        # 最近一次扫描记录的目录修改时间，以及 scan_directory 构建的目录索引
+        self.last_dir_mtimes: Dict[str, int] = {}
+        self.last_scan_index: Optional[MerkleIndex] = None
+
+    @staticmethod
+    def _new_scan_stats() -> dict:
+        """创建空的扫描统计"""
+        return {'hashed': 0, 'reused': 0, 'resumed': 0, 'skipped_dirs': 0, 'backend': '', 'stopped': False}
+
+    def calculate_file_hash(self, file_path: Union[str, Path], algorithm: Optional[str] = None) -> str:
         """
         计算文件hash值
         
         Args:
             file_path: 文件路径
-            algorithm: hash算法，默认sha256
+            algorithm: hash算法，默认使用扫描器配置的算法
             
         Returns:
             文件的hash值
         """
-        hasher = hashlib.new(algorithm)
-        try:
-            with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(8192), b''):
-                    if self._stop_scan:
-                        break
-                    hasher.update(chunk)
-            return hasher.hexdigest()
-        except (OSError, IOError) as e:
-            print(f"读取文件失败 {file_path}: {e}")
-            return ""
+        return content_digest(file_path, algorithm or self.hash_algorithm,
+                              should_stop=lambda: self._stop_scan)[0]
+
+    def _compile_matcher(self) -> ExcludeMatcher:
+        """根据当前的排除配置编译匹配器"""
+        return ExcludeMatcher(self.exclude_files, self.exclude_folders, self.exclude_extensions)
 
     def should_exclude_file(self, file_path: Path, relative_path: str) -> bool:
         """
@@ -77,135 +171,499 @@ class FileScanner:
         Returns:
             是否排除该文件
         """
-        # 检查扩展名
-        if file_path.suffix.lower() in self.exclude_extensions:
-            return True
-
-        # 检查是否在排除文件列表中
-        if relative_path in self.exclude_files:
-            return True
+        return self._matcher.excludes_path(relative_path)
 
-        # 检查父目录是否在排除列表中
-        for part in Path(relative_path).parts:
-            if part in self.exclude_folders:
-                return True
-
-        return False
-
-    def scan_directory(self, directory: Path, progress_callback=None) -> Dict[str, dict]:
+    def _walk_files(self, directory: Path, dirty_paths: Optional[frozenset] = None,
+                    skip_dir: Optional[SkipDirCallback] = None,
+                    track_dirs: bool = False) -> Iterator[Union[WalkEntry, WalkDir]]:
         """
-        扫描目录中的指定文件并计算hash
+        遍历目标路径，逐个产出需要扫描的文件和经过的目录
         
         Args:
             directory: 要扫描的目录
-            progress_callback: 进度回调函数
+            dirty_paths: 只遍历这些相对路径（文件或目录），为None时遍历所有目标路径
+            skip_dir: 目录跳过判断，见 core.scan_walker.walk_target
+            track_dirs: 是否记录目录mtime（产出 WalkDir 目录条目，每个目录多一次stat）
             
-        Returns:
-            文件信息字典，键为相对路径，值包含文件信息
+        Yields:
+            WalkEntry 文件条目（含 DirEntry 的stat结果），track_dirs 为True时还有 WalkDir 目录条目
+        """
+        # 每次扫描重新编译，使对排除集合的修改立即生效
+        self._matcher = self._compile_matcher()
+        if dirty_paths is not None:
+            yield from iter_paths(str(directory), sorted(dirty_paths), self._matcher, lambda: self._stop_scan,
+                                  track_dirs=track_dirs)
+            return
+        yield from iter_target_files(str(directory), self.target_paths, self._matcher,
+                                     lambda: self._stop_scan, track_dirs=track_dirs, skip_dir=skip_dir)
+
+    def iter_scan(self, directory: Path, progress_callback=None,
+                  previous_files: Optional[Dict[str, dict]] = None,
+                  deep_verify: bool = False,
+                  previous_algorithm: Optional[str] = None,
+                  checkpoint_file: Optional[Path] = None,
+                  dirty_paths: Optional[Iterable[str]] = None,
+                  directory_index: Optional[MerkleIndex] = None,
+                  track_dirs: Optional[bool] = None) -> Iterator[Tuple[str, dict]]:
+        """
+        流水线方式扫描目录：遍历线程把文件放入有界队列，hash线程边遍历边计算，结果以生成器方式逐个返回
+        
+        Args:
+            directory: 要扫描的目录
+            progress_callback: 进度回调函数 (已处理数, 当前已发现的文件总数)，总数随遍历逐步修正
+            previous_files: 上一次的扫描结果（增量扫描），size/mtime_ns/inode 均未变化的文件直接复用其hash
+            deep_verify: 深度校验，忽略上一次的扫描结果，强制重新计算所有文件的hash
+            previous_algorithm: 上一次扫描结果使用的hash算法，与当前算法不同时不复用hash，
+                并在同一次读取中额外计算旧算法的hash（legacy_hash），用于与旧快照对比
+            checkpoint_file: 扫描断点文件，扫描过程中持续写入已完成的结果；扫描被停止时保留，
+                下次扫描从断点继续（stat未变化的文件直接使用断点中的结果），完整结束后删除
+            dirty_paths: 自上一次扫描以来发生变化的相对路径（文件或目录，见 core.change_watcher），
+                不为None时 previous_files 必须是上一次完整的扫描结果：只遍历这些路径，其余文件直接沿用
+                previous_files 中的信息，不再stat
+            directory_index: 上一次扫描的目录索引（含目录mtime）。目录mtime未变化、且索引中的文件与 previous_files
+                一致时不再列举该目录，其直接文件沿用 previous_files、不再stat，只继续检查子目录。
+                原地修改文件内容不会改变目录mtime，这类修改会被漏掉，只应在能接受该风险时使用（定期深度校验兜底）
+            track_dirs: 是否记录目录mtime（last_dir_mtimes，写入目录索引供下一次扫描按目录mtime跳过），
+                为None时只在传入 directory_index 时记录
+            
+        Yields:
+            (相对路径, 文件信息)
+        
+        Raises:
+            ScanError: 遍历目录或调度计算hash失败，已产出的结果不完整（扫描断点保留，不视为完成）
         """
         self._stop_scan = False
-        file_info = {}
+        self.last_scan_stats = self._new_scan_stats()
+        self.last_dir_mtimes = {}
+        if track_dirs is None:
+            track_dirs = directory_index is not None
+
+        migrating = bool(previous_files) and bool(previous_algorithm) and previous_algorithm != self.hash_algorithm
+        reuse_hashes = bool(previous_files) and not deep_verify and not migrating
+        algorithms = (self.hash_algorithm, previous_algorithm) if migrating else (self.hash_algorithm,)
+
+        def algorithms_for(entry: WalkEntry) -> Tuple[str, ...]:
+            # 上一次结果中的大文件是整体计算的旧hash时，同时整体计算一次作为 legacy_hash，
+            # 否则升级后所有大文件的hash都与旧快照不同，被当作修改重新打包
+            if not migrating and entry.stat.st_size >= TREE_THRESHOLD and previous_files and \
+                    _has_flat_digest(previous_files.get(entry.relative_path)):
+                return self.hash_algorithm, self.hash_algorithm
+            return algorithms
 
         if not directory.exists() or not directory.is_dir():
-            return file_info
-
-        # 收集目标路径下的文件
-        all_files = []
-
-        for target_path in self.target_paths:
-            if self._stop_scan:
-                break
+            return
+
+        # 只扫描变化的路径时，其余文件直接沿用上一次的结果
+        untouched_files = {}
+        if dirty_paths is not None:
+            dirty_paths = collapse_paths(dirty_paths)
+            untouched_files = {relative_path: info for relative_path, info in (previous_files or {}).items()
+                               if not is_under(relative_path, dirty_paths)}
+
+        # 断点中的结果由被中断的扫描刚刚计算过，深度校验时同样可以使用
+        checkpoint = ScanCheckpoint(checkpoint_file, directory, algorithms) if checkpoint_file else None
+        resumed_files = checkpoint.load() if checkpoint else {}
+        if checkpoint:
+            checkpoint.open(resumed=bool(resumed_files))
+
+        def try_reuse(entry: WalkEntry, previous: Optional[dict]) -> Optional[dict]:
+            resumed = resumed_files.get(entry.relative_path)
+            if resumed and self.is_stat_unchanged(entry.stat, resumed, entry.inode):
+                self._count_stat('resumed')
+                return self._make_file_info(entry, resumed['hash'], resumed.get('legacy_hash'),
+                                            resumed.get('segments'))
+            if reuse_hashes and self.is_stat_unchanged(entry.stat, previous, entry.inode) and \
+                    not _has_flat_digest(previous):
+                self._count_stat('reused')
+                return self._make_file_info(entry, previous['hash'], segments=previous.get('segments'))
+            return None
 
-            target_full_path = directory / target_path
-
-            if not target_full_path.exists():
-                print(f"目标路径不存在: {target_full_path}")
-                continue
-
-            if target_full_path.is_file():
-                # 直接是文件
-                relative_path = target_path
-                if not self.should_exclude_file(target_full_path, relative_path):
-                    all_files.append((target_full_path, relative_path))
-            elif target_full_path.is_dir():
-                # 是目录，遍历其中的文件
-                for root, dirs, files in os.walk(target_full_path):
-                    if self._stop_scan:
-                        break
+        # 按目录mtime跳过未变化的目录（只在可以复用hash时）
+        skip_dir = None
+        if directory_index is not None and reuse_hashes and track_dirs:
+            def skip_dir(relative_dir: str, mtime_ns: int) -> Optional[List[str]]:
+                node = directory_index.get_dir(relative_dir)
+                if not node or node.get('mtime_ns') != mtime_ns:
+                    return None
+                for relative_path, hash_value in zip(directory_index.iter_dir_files(relative_dir),
+                                                     node['files'].values()):
+                    previous = previous_files.get(relative_path)
+                    if not previous or previous.get('hash') != hash_value:
+                        return None
+                return node['dirs']
+
+        work_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue(maxsize=self.queue_size)
+        abort = threading.Event()
+        walk_state = {'discovered': 0, 'done': False}
+        failures: List[str] = []
+
+        def should_abort() -> bool:
+            return abort.is_set() or self._stop_scan
+
+        def fail(message: str):
+            # 记录失败并通知所有线程退出，不发送结束标记，避免把不完整的结果当作完整扫描
+            print(message)
+            failures.append(message)
+            abort.set()
+
+        def put_until_abort(q: queue.Queue, item) -> bool:
+            while not should_abort():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get_until_abort(q: queue.Queue):
+            while not should_abort():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return None
 
-                    # 检查当前目录是否在排除列表中
-                    current_relative = Path(root).relative_to(directory)
-                    if any(part in self.exclude_folders for part in current_relative.parts):
-                        dirs.clear()  # 不再遍历子目录
+        def walker():
+            try:
+                for relative_path, info in untouched_files.items():
+                    if not put_until_abort(result_queue, (relative_path, info)):
+                        return
+                    self._count_stat('reused')
+                    walk_state['discovered'] += 1
+                for entry in self._walk_files(directory, dirty_paths, skip_dir, track_dirs):
+                    if isinstance(entry, WalkDir):
+                        self.last_dir_mtimes[entry.relative_path] = entry.mtime_ns
+                        if entry.skipped:
+                            self._count_stat('skipped_dirs')
+                            for relative_path in directory_index.iter_dir_files(entry.relative_path):
+                                if self._matcher.excludes_path(relative_path):
+                                    continue
+                                if not put_until_abort(result_queue, (relative_path, previous_files[relative_path])):
+                                    return
+                                self._count_stat('reused')
+                                walk_state['discovered'] += 1
                         continue
+                    previous = previous_files.get(entry.relative_path) if previous_files else None
+                    if not put_until_abort(work_queue, (entry, previous)):
+                        break
+                    walk_state['discovered'] += 1
+            except Exception as e:
+                fail(f"遍历目录失败 {directory}: {e}")
+            finally:
+                walk_state['done'] = True
+                put_until_abort(work_queue, None)
+
+        def dispatcher():
+            try:
+                # 先取样一批需要计算hash的文件，根据文件大小分布选择hash后端
+                sample = []
+                walk_finished = False
+                while len(sample) < self.backend_sample_size:
+                    item = get_until_abort(work_queue)
+                    if item is None:
+                        walk_finished = True
+                        break
+                    entry, previous = item
+                    reused = try_reuse(entry, previous)
+                    if reused:
+                        put_until_abort(result_queue, (entry.relative_path, reused))
+                    else:
+                        sample.append(entry)
+
+                backend = self._choose_backend(sample, walk_finished)
+                self.last_scan_stats['backend'] = backend
+
+                def pending_entries():
+                    yield from sample
+                    if walk_finished:
+                        return
+                    while True:
+                        item = get_until_abort(work_queue)
+                        if item is None:
+                            return
+                        entry, previous = item
+                        reused = try_reuse(entry, previous)
+                        if not reused:
+                            yield entry
+                        elif not put_until_abort(result_queue, (entry.relative_path, reused)):
+                            return
+
+                if backend == 'process':
+                    self._hash_with_processes(pending_entries(), algorithms_for, result_queue,
+                                              put_until_abort, should_abort, fail)
+                else:
+                    self._hash_with_threads(pending_entries(), algorithms_for, result_queue,
+                                            put_until_abort, get_until_abort)
+            except Exception as e:
+                fail(f"扫描失败 {directory}: {e}")
+            finally:
+                put_until_abort(result_queue, None)
+
+        for target in (walker, dispatcher):
+            threading.Thread(target=target, daemon=True).start()
 
-                    for file in files:
-                        file_path = Path(root) / file
-                        relative_path = str(file_path.relative_to(directory))
+        processed = 0
+        completed = False
+        try:
+            while not self._stop_scan and not failures:
+                try:
+                    item = result_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    completed = not self._stop_scan and not failures
+                    break
 
-                        if not self.should_exclude_file(file_path, relative_path):
-                            all_files.append((file_path, relative_path))
+                relative_path, result = item
+                processed += 1
+                if progress_callback:
+                    total = walk_state['discovered'] if walk_state['done'] else max(walk_state['discovered'], processed)
+                    progress_callback(processed, total)
+                if result:
+                    # 断点中已有相同的结果时不再追加；stat变化后重新计算的文件需要追加，否则下次仍读到旧结果
+                    if checkpoint and relative_path not in untouched_files and \
+                            result != resumed_files.get(relative_path):
+                        checkpoint.append(relative_path, result)
+                    yield relative_path, result
+            if failures:
+                raise ScanError(failures[0])
+        finally:
+            # 停止扫描或调用方提前结束生成器时，通知所有线程尽快退出
+            abort.set()
+            self.last_scan_stats['stopped'] = not completed
+            if checkpoint:
+                checkpoint.close(completed)
+
+    def _choose_backend(self, sample: List[WalkEntry], walk_finished: bool) -> str:
+        """
+        根据取样文件的大小分布选择hash后端
+        
+        Args:
+            sample: 取样的需要计算hash的文件
+            walk_finished: 取样时目录是否已经遍历完成
+            
+        Returns:
+            'thread' 或 'process'
+        """
+        if self.hash_backend in ('thread', 'process'):
+            return self.hash_backend
 
-        total_files = len(all_files)
-        processed = 0
+        # 文件数太少时启动进程池得不偿失
+        if walk_finished or len(sample) < self.backend_sample_size or (os.cpu_count() or 1) < 2:
+            return 'thread'
 
-        # 使用线程池并行处理
-        max_workers = min(32, len(all_files)) if all_files else 1
+        # 小文件的 hashlib.update 调用太短，无法释放GIL，多线程只能用到一个核心
+        sizes = sorted(entry.stat.st_size for entry in sample)
+        median_size = sizes[len(sizes) // 2]
+        return 'process' if median_size <= self.small_file_threshold else 'thread'
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交任务
-            future_to_file = {
-                executor.submit(self._process_single_file, file_path, relative_path): relative_path
-                for file_path, relative_path in all_files
-            }
+    def _hash_with_threads(self, entries: Iterator[WalkEntry],
+                           algorithms_for: Callable[[WalkEntry], Tuple[str, ...]], result_queue: queue.Queue, put_until_abort, get_until_abort):
+        """
+        线程后端：多个线程逐个计算文件hash
+        
+        Args:
+            entries: 需要计算hash的文件
+            algorithms_for: 返回文件需要计算的hash算法
+            result_queue: 结果队列
+            put_until_abort: 带中止检查的入队函数
+            get_until_abort: 带中止检查的出队函数
+        """
+        hash_queue = queue.Queue(maxsize=self.queue_size)
 
-            # 处理结果
-            for future in as_completed(future_to_file):
-                if self._stop_scan:
+        def hash_worker():
+            while True:
+                entry = get_until_abort(hash_queue)
+                if entry is None:
                     break
+                try:
+                    result = self._hash_entry(entry, algorithms_for(entry))
+                except Exception as e:
+                    print(f"处理文件失败 {entry.relative_path}: {e}")
+                    result = None
+                if not put_until_abort(result_queue, (entry.relative_path, result)):
+                    break
+
+        workers = [threading.Thread(target=hash_worker, daemon=True) for _ in range(self.max_workers)]
+        for worker in workers:
+            worker.start()
 
-                relative_path = future_to_file[future]
+        for entry in entries:
+            if not put_until_abort(hash_queue, entry):
+                break
+        for _ in workers:
+            put_until_abort(hash_queue, None)
+        for worker in workers:
+            worker.join()
+
+    def _hash_with_processes(self, entries: Iterator[WalkEntry],
+                             algorithms_for: Callable[[WalkEntry], Tuple[str, ...]],
+                             result_queue: queue.Queue, put_until_abort, should_abort, fail):
+        """
+        进程后端：按批次把文件交给进程池计算hash，批次按遍历顺序划分（同一目录的文件基本在同一批次）
+        
+        Args:
+            entries: 需要计算hash的文件
+            algorithms_for: 返回文件需要计算的hash算法
+            result_queue: 结果队列
+            put_until_abort: 带中止检查的入队函数
+            should_abort: 返回True时停止提交新批次
+            fail: 整个批次失败（如进程池崩溃）时调用，中止扫描
+        """
+        process_count = os.cpu_count() or 1
+        # 限制在途批次数，保持内存占用平稳
+        in_flight = threading.BoundedSemaphore(process_count * 2)
+
+        def on_batch_done(batch: List[WalkEntry], future):
+            try:
                 try:
-                    result = future.result()
-                    if result:
-                        file_info[relative_path] = result
+                    hashes = future.result()
                 except Exception as e:
-                    print(f"处理文件失败 {relative_path}: {e}")
+                    # 停止扫描时取消的批次直接丢弃；其他情况说明进程池已不可用，不能把整批文件当作读取失败跳过
+                    if not should_abort():
+                        fail(f"批量计算hash失败: {e}")
+                    return
+                for entry, digests in zip(batch, hashes):
+                    result = None
+                    if digests[0]:
+                        self._count_stat('hashed')
+                        result = self._make_file_info(entry, *digests)
+                    if not put_until_abort(result_queue, (entry.relative_path, result)):
+                        break
+            finally:
+                in_flight.release()
+
+        def submit(batch: List[WalkEntry]):
+            while not in_flight.acquire(timeout=0.1):
+                if should_abort():
+                    return False
+            future = executor.submit(_hash_batch, [(entry.path, entry.stat.st_size, algorithms_for(entry))
+                                                   for entry in batch])
+            future.add_done_callback(lambda f, b=batch: on_batch_done(b, f))
+            return True
 
-                processed += 1
-                if progress_callback:
-                    progress_callback(processed, total_files)
+        executor = ProcessPoolExecutor(max_workers=process_count)
+        try:
+            batch = []
+            batch_bytes = 0
+            for entry in entries:
+                batch.append(entry)
+                batch_bytes += entry.stat.st_size
+                if len(batch) >= self.batch_max_files or batch_bytes >= self.batch_max_bytes:
+                    if not submit(batch):
+                        break
+                    batch = []
+                    batch_bytes = 0
+            if batch and not should_abort():
+                submit(batch)
+        finally:
+            if should_abort():
+                # 丢弃尚未开始的批次，不等待进程池把已提交的工作做完
+                _shutdown_now(executor)
+            else:
+                executor.shutdown(wait=True)
+
+    def scan_directory(self, directory: Path, progress_callback=None,
+                       previous_files: Optional[Dict[str, dict]] = None,
+                       deep_verify: bool = False,
+                       previous_algorithm: Optional[str] = None,
+                       checkpoint_file: Optional[Path] = None,
+                       dirty_paths: Optional[Iterable[str]] = None,
+                       directory_index: Optional[MerkleIndex] = None,
+                       track_dirs: Optional[bool] = None) -> Dict[str, dict]:
+        """
+        扫描目录中的指定文件并计算hash
+        
+        Args:
+            directory: 要扫描的目录
+            progress_callback: 进度回调函数
+            previous_files: 上一次的扫描结果（增量扫描），size/mtime_ns/inode 均未变化的文件直接复用其hash
+            deep_verify: 深度校验，忽略上一次的扫描结果，强制重新计算所有文件的hash
+            previous_algorithm: 上一次扫描结果使用的hash算法，见 iter_scan
+            checkpoint_file: 扫描断点文件，见 iter_scan
+            dirty_paths: 自上一次扫描以来发生变化的相对路径，见 iter_scan
+            directory_index: 上一次扫描的目录索引，见 iter_scan
+            track_dirs: 是否记录目录mtime，见 iter_scan
+            
+        Returns:
+            文件信息字典，键为相对路径，值包含文件信息；扫描被停止时返回空字典。
+            扫描完成后 last_scan_index 为本次结果的目录索引
+        
+        Raises:
+            ScanError: 扫描失败，见 iter_scan
+        """
+        self.last_scan_index = None
+        file_info = dict(self.iter_scan(directory, progress_callback, previous_files, deep_verify,
+                                        previous_algorithm, checkpoint_file, dirty_paths, directory_index,
+                                        track_dirs))
+        if self.last_scan_stats['stopped']:
+            return {}
+        self.last_scan_index = MerkleIndex.build(file_info, self.hash_algorithm, self.last_dir_mtimes)
+        return file_info
 
+    @staticmethod
+    def is_stat_unchanged(stat: os.stat_result, previous: Optional[dict],
+                          inode: Optional[int] = None) -> bool:
+        """
+        判断文件的stat信息是否与上一次扫描记录一致
+        
+        Args:
+            stat: 当前的stat结果
+            previous: 上一次扫描记录的文件信息
+            inode: 文件inode，为None时使用 stat.st_ino
+            
+        Returns:
+            size、mtime_ns、inode 是否全部一致（旧记录缺少这些字段时视为不一致）
+        """
+        if not previous or not previous.get('hash'):
+            return False
+        return (previous.get('size') == stat.st_size and
+                previous.get('mtime_ns') == stat.st_mtime_ns and
+                previous.get('inode') == (stat.st_ino if inode is None else inode))
+
+    def _count_stat(self, stat_key: str):
+        """累加扫描统计"""
+        with self._lock:
+            self.last_scan_stats[stat_key] += 1
+
+    @staticmethod
+    def _make_file_info(entry: WalkEntry, hash_value: str, legacy_hash: Optional[str] = None,
+                        segments: Optional[Tuple[str, ...]] = None) -> dict:
+        """根据遍历条目和hash值生成文件信息，大文件额外记录各分段的摘要"""
+        file_info = {
+            'size': entry.stat.st_size,
+            'mtime': entry.stat.st_mtime,
+            'mtime_ns': entry.stat.st_mtime_ns,
+            'inode': entry.inode,
+            'hash': hash_value,
+            'relative_path': entry.relative_path
+        }
+        if legacy_hash:
+            file_info['legacy_hash'] = legacy_hash
+        if segments:
+            file_info['segment_size'] = TREE_SEGMENT_SIZE
+            file_info['segments'] = list(segments)
         return file_info
 
-    def _process_single_file(self, file_path: Path, relative_path: str) -> Optional[dict]:
+    def _hash_entry(self, entry: WalkEntry, algorithms: Tuple[str, ...]) -> Optional[dict]:
         """
-        处理单个文件
+        计算单个文件的hash
         
         Args:
-            file_path: 绝对文件路径
-            relative_path: 相对路径
+            entry: 遍历条目
+            algorithms: hash算法，有第二项时同时整体计算旧hash
             
         Returns:
-            文件信息字典
+            文件信息字典，hash计算失败时返回None
         """
-        try:
-            stat = file_path.stat()
-            hash_value = self.calculate_file_hash(file_path)
-
-            if not hash_value:  # hash计算失败
-                return None
-
-            return {
-                'size': stat.st_size,
-                'mtime': stat.st_mtime,
-                'hash': hash_value,
-                'relative_path': relative_path
-            }
-        except (OSError, IOError) as e:
-            print(f"访问文件失败 {file_path}: {e}")
+        digests = _scan_digests(entry.path, entry.stat.st_size, algorithms, lambda: self._stop_scan)
+        if not digests[0]:  # hash计算失败
             return None
 
+        self._count_stat('hashed')
+        return self._make_file_info(entry, *digests)
+
     def stop_scan(self):
         """停止扫描"""
         with self._lock:
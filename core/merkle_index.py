@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Merkle 目录索引模块，按目录汇总文件hash，用于跳过未变化的目录和子树
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from core.digest import bytes_digest
+
+# 目录摘要使用的算法（只对索引内的文件名和hash做摘要，与文件hash算法无关）
+_DIRECTORY_ALGORITHM = 'blake2b'
+
+# 索引文件格式版本
+_INDEX_FORMAT = 1
+
+
+def split_relative_path(relative_path: str):
+    """把相对路径拆分为 (父目录, 名称)，顶层文件的父目录为空字符串"""
+    parent, _, name = relative_path.rpartition(os.sep)
+    return parent, name
+
+
+class MerkleIndex:
+    """
+    Merkle 目录索引
+    
+    每个目录节点记录：
+        digest: 目录摘要（由直接文件的名称和hash、子目录的名称和摘要计算）
+        mtime_ns: 扫描时目录的修改时间（没有记录时为None）
+        files: {文件名: hash}
+        dirs: 子目录名称列表
+        file_count / total_size: 子树内的文件数和总大小
+    根目录（输入目录本身）的相对路径为空字符串。
+    """
+
+    def __init__(self, dirs: Optional[Dict[str, dict]] = None, algorithm: str = ''):
+        """
+        初始化索引
+        
+        Args:
+            dirs: 目录节点字典，键为目录相对路径
+            algorithm: 文件hash使用的算法，算法不同的索引之间不能直接比较摘要
+        """
+        self.dirs: Dict[str, dict] = dirs or {}
+        self.algorithm = algorithm
+
+    @classmethod
+    def build(cls, file_info: Dict[str, dict], algorithm: str = '',
+              dir_mtimes: Optional[Dict[str, int]] = None) -> 'MerkleIndex':
+        """
+        根据扫描结果构建索引
+        
+        Args:
+            file_info: 扫描结果，键为相对路径
+            algorithm: 文件hash使用的算法
+            dir_mtimes: 扫描时记录的目录修改时间 {目录相对路径: mtime_ns}
+        
+        Returns:
+            目录索引
+        """
+        dir_mtimes = dir_mtimes or {}
+        dirs: Dict[str, dict] = {}
+
+        def get_node(relative_dir: str) -> dict:
+            node = dirs.get(relative_dir)
+            if node is None:
+                node = {'digest': '', 'mtime_ns': dir_mtimes.get(relative_dir),
+                        'files': {}, 'dirs': [], 'file_count': 0, 'total_size': 0}
+                dirs[relative_dir] = node
+                if relative_dir:
+                    parent, name = split_relative_path(relative_dir)
+                    get_node(parent)['dirs'].append(name)
+            return node
+
+        get_node('')
+        for relative_path, info in file_info.items():
+            parent, name = split_relative_path(relative_path)
+            node = get_node(parent)
+            node['files'][name] = info['hash']
+            node['total_size'] += info.get('size', 0)
+
+        # 从最深的目录开始向上计算摘要和汇总
+        for relative_dir in sorted(dirs, key=lambda d: d.count(os.sep) + bool(d), reverse=True):
+            cls._refresh_node(dirs, relative_dir)
+
+        return cls(dirs, algorithm)
+
+    @staticmethod
+    def _refresh_node(dirs: Dict[str, dict], relative_dir: str):
+        """根据直接文件和子目录节点重新计算目录的摘要和汇总（子目录必须已经计算）"""
+        node = dirs[relative_dir]
+        node['dirs'].sort()
+        prefix = relative_dir + os.sep if relative_dir else ''
+        lines = [f"f\0{name}\0{node['files'][name]}\n" for name in sorted(node['files'])]
+        file_count = len(node['files'])
+        total_size = node['total_size']
+        for name in node['dirs']:
+            child = dirs[prefix + name]
+            lines.append(f"d\0{name}\0{child['digest']}\n")
+            file_count += child['file_count']
+            total_size += child['total_size']
+        node['digest'] = bytes_digest(''.join(lines).encode('utf-8'), _DIRECTORY_ALGORITHM)
+        node['file_count'] = file_count
+        node['total_size'] = total_size
+
+    def get_dir(self, relative_dir: str) -> Optional[dict]:
+        """获取目录节点"""
+        return self.dirs.get(relative_dir)
+
+    def iter_dir_files(self, relative_dir: str) -> Iterable[str]:
+        """获取目录下直接文件的相对路径"""
+        node = self.dirs.get(relative_dir)
+        if not node:
+            return []
+        prefix = relative_dir + os.sep if relative_dir else ''
+        return [prefix + name for name in node['files']]
+
+    def is_comparable(self, other: Optional['MerkleIndex']) -> bool:
+        """两个索引的摘要是否可以直接比较（文件hash算法一致）"""
+        return other is not None and bool(self.algorithm) and self.algorithm == other.algorithm
+
+    def diff_paths(self, other: 'MerkleIndex') -> List[str]:
+        """
+        找出与另一个索引不同的文件（新增、删除、修改），摘要相同的子树整体跳过
+        
+        Args:
+            other: 另一个索引（通常是新的扫描结果）
+        
+        Returns:
+            有差异的文件相对路径列表
+        """
+        changed = []
+        stack = ['']
+        while stack:
+            relative_dir = stack.pop()
+            old_node = self.dirs.get(relative_dir)
+            new_node = other.dirs.get(relative_dir)
+            if old_node and new_node and old_node['digest'] == new_node['digest']:
+                continue
+
+            prefix = relative_dir + os.sep if relative_dir else ''
+            old_files = old_node['files'] if old_node else {}
+            new_files = new_node['files'] if new_node else {}
+            for name in old_files.keys() | new_files.keys():
+                if old_files.get(name) != new_files.get(name):
+                    changed.append(prefix + name)
+
+            old_dirs = old_node['dirs'] if old_node else ()
+            new_dirs = new_node['dirs'] if new_node else ()
+            stack.extend(prefix + name for name in set(old_dirs) | set(new_dirs))
+        return changed
+
+    @staticmethod
+    def rollup(relative_paths: Iterable[str]) -> Dict[str, int]:
+        """
+        按目录汇总变化的文件数（每个文件计入其所有上级目录）
+        
+        Args:
+            relative_paths: 变化的文件相对路径
+        
+        Returns:
+            {目录相对路径: 变化文件数}，根目录为空字符串
+        """
+        counts: Dict[str, int] = {}
+        for relative_path in relative_paths:
+            parent = split_relative_path(relative_path)[0]
+            while True:
+                counts[parent] = counts.get(parent, 0) + 1
+                if not parent:
+                    break
+                parent = split_relative_path(parent)[0]
+        return counts
+
+    def save(self, index_file: Path):
+        """保存索引"""
+        try:
+            index_file = Path(index_file)
+            index_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = index_file.with_suffix('.tmp')
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'format': _INDEX_FORMAT, 'separator': os.sep,
+                           'algorithm': self.algorithm, 'dirs': self.dirs}, f, ensure_ascii=False)
+            os.replace(temp_file, index_file)
+        except IOError as e:
+            print(f"保存目录索引失败: {e}")
+
+    @classmethod
+    def load(cls, index_file: Path) -> Optional['MerkleIndex']:
+        """
+        加载索引
+        
+        Args:
+            index_file: 索引文件
+        
+        Returns:
+            目录索引，文件不存在、格式不符或在其它系统上生成时返回None
+        """
+        index_file = Path(index_file)
+        if not index_file.exists():
+            return None
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') != _INDEX_FORMAT or data.get('separator') != os.sep:
+                return None
+            return cls(data.get('dirs', {}), data.get('algorithm', ''))
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"加载目录索引失败: {e}")
+            return None
@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""
+更新包应用模块，根据包内清单把压缩包应用到服务端目录，或校验服务端目录是否与压缩包一致
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path, PureWindowsPath
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from core.delta import DeltaError, apply_delta
+from core.digest import file_digest
+from core.package_manifest import read_package_manifest
+
+# 解压时每次读取的大小
+_EXTRACT_CHUNK = 1024 * 1024
+
+
+class ApplyError(Exception):
+    """压缩包无法应用（没有包内清单或清单与压缩包不一致）"""
+
+
+@dataclass
+class ApplyReport:
+    """应用结果（路径均为清单中的 / 分隔路径），有失败的文件时其它文件也不会写入"""
+    written: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)  # 内容已经一致，没有写入
+    deleted: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)  # {路径: 原因}
+
+
+@dataclass
+class VerifyReport:
+    """校验结果（路径均为清单中的 / 分隔路径）"""
+    matched: int = 0
+    missing: List[str] = field(default_factory=list)
+    mismatched: List[str] = field(default_factory=list)
+    leftover: List[str] = field(default_factory=list)  # 清单中已删除但仍然存在的文件
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.mismatched or self.leftover)
+
+
+class PathPlan(NamedTuple):
+    """一个文件在整个包链中的写入步骤"""
+    item: dict  # 最终内容的清单记录
+    # [(压缩包, 清单记录)]，从最后一个完整成员开始依次应用；第一步为补丁时以服务端现有文件为基准
+    steps: List[Tuple[zipfile.ZipFile, dict]]
+
+    @property
+    def needs_base(self) -> bool:
+        """是否需要服务端现有文件作为补丁基准"""
+        return 'delta' in self.steps[0][1]
+
+
+def check_manifest_path(manifest_path: str):
+    """
+    检查清单路径不会指向服务端目录之外
+    
+    按 Windows 规则解析（同时识别 / 和 \\ 分隔符、盘符和 UNC 前缀），拒绝空路径、绝对路径、带盘符的路径和 .. 。
+    
+    Raises:
+        ApplyError: 路径不安全
+    """
+    pure_path = PureWindowsPath(manifest_path)
+    if not pure_path.parts or pure_path.anchor or '..' in pure_path.parts:
+        raise ApplyError(f"清单中的路径不安全: {manifest_path!r}")
+
+
+def server_path(server_dir: Path, manifest_path: str) -> Path:
+    """
+    获取清单路径在服务端目录中对应的文件
+    
+    Raises:
+        ApplyError: 路径不安全或不在服务端目录之内
+    """
+    check_manifest_path(manifest_path)
+    target_file = Path(server_dir, *manifest_path.split('/'))
+    root = os.path.abspath(server_dir)
+    target = os.path.abspath(target_file)
+    if target == root or os.path.commonpath([root, target]) != root:
+        raise ApplyError(f"清单中的路径不在服务端目录之内: {manifest_path!r}")
+    return target_file
+
+
+def file_matches(file_path: Path, item: dict, deep: bool = False) -> bool:
+    """
+    文件内容是否与清单记录一致
+    
+    默认比较大小和CRC32（比sha256快得多），deep 为True或清单没有CRC时比较sha256。
+    
+    Args:
+        file_path: 文件路径
+        item: 清单记录
+        deep: 是否比较sha256
+    
+    Returns:
+        是否一致，文件不存在时返回False
+    """
+    try:
+        if not file_path.is_file() or file_path.stat().st_size != item['size']:
+            return False
+    except OSError:
+        return False
+    if deep or item.get('crc') is None:
+        return file_digest(file_path, 'sha256') == item['hash']
+    return file_digest(file_path, 'crc32') == f"{item['crc'] & 0xffffffff:08x}-{item['size']:x}"
+
+
+def read_checked_manifest(zf: zipfile.ZipFile) -> dict:
+    """
+    读取并检查包内清单：所有路径都在服务端目录之内，每个文件的成员都存在，完整成员的大小和CRC与清单一致
+    
+    Raises:
+        ApplyError: 没有包内清单、清单中有不安全的路径或清单与压缩包不一致
+    """
+    manifest = read_package_manifest(zf)
+    if manifest is None:
+        raise ApplyError("压缩包中没有包内清单")
+    for path in list(manifest['files']) + list(manifest['deleted']):
+        check_manifest_path(path)
+    for path, item in manifest['files'].items():
+        try:
+            zinfo = zf.getinfo(item['member'])
+        except KeyError:
+            raise ApplyError(f"压缩包中缺少成员: {item['member']}")
+        if 'delta' in item:
+            if zinfo.file_size != item['delta']['patch_size']:
+                raise ApplyError(f"补丁大小与清单不一致: {path}")
+        elif zinfo.file_size != item['size'] or (item.get('crc') is not None and zinfo.CRC != item['crc']):
+            raise ApplyError(f"成员与清单不一致: {path}")
+    return manifest
+
+
+def check_files(files: Dict[str, dict], deleted: Iterable[str], server_dir: Path,
+                deep: bool = False) -> VerifyReport:
+    """
+    校验服务端目录中的文件是否与清单记录一致
+    
+    Args:
+        files: {路径: 清单记录}
+        deleted: 应当不存在的文件
+        server_dir: 服务端目录
+        deep: 是否比较sha256
+    
+    Returns:
+        校验结果
+    """
+    report = VerifyReport()
+    for path, item in sorted(files.items()):
+        target_file = server_path(server_dir, path)
+        if not target_file.is_file():
+            report.missing.append(path)
+        elif file_matches(target_file, item, deep):
+            report.matched += 1
+        else:
+            report.mismatched.append(path)
+    report.leftover = sorted(path for path in deleted if server_path(server_dir, path).exists())
+    return report
+
+
+def _default_file_mode() -> int:
+    """新文件的默认权限（按 umask 计算，进程内只计算一次）"""
+    global _FILE_MODE
+    if _FILE_MODE is None:
+        umask = os.umask(0)
+        os.umask(umask)
+        _FILE_MODE = 0o666 & ~umask
+    return _FILE_MODE
+
+
+_FILE_MODE = None
+
+
+def apply_file_mode(temp_path: str, target_file: Path):
+    """临时文件（mkstemp 创建时为 0600）使用目标文件原来的权限，目标文件不存在时使用默认权限"""
+    try:
+        mode = target_file.stat().st_mode & 0o7777
+    except OSError:
+        mode = _default_file_mode()
+    os.chmod(temp_path, mode)
+
+
+class PackageChain:
+    """
+    按顺序打开的连续多个包（单个包也是包链）
+    
+    打开时检查各包的包内清单和包链是否连续，并合并为每个文件最终内容的写入步骤和最终删除的文件。
+    """
+
+    def __init__(self, package_files: Sequence[Path]):
+        """
+        初始化包链
+        
+        Args:
+            package_files: 压缩包列表，每个增量包的基准版本必须是前一个包的目标版本
+        """
+        self.package_files = [Path(package_file) for package_file in package_files]
+        self.archives: List[zipfile.ZipFile] = []
+        self.manifests: List[dict] = []
+        self.plans: Dict[str, PathPlan] = {}
+        self.deleted: Set[str] = set()
+
+    def __enter__(self) -> 'PackageChain':
+        try:
+            for package_file in self.package_files:
+                self.archives.append(zipfile.ZipFile(package_file, 'r'))
+            self.manifests = [read_checked_manifest(zf) for zf in self.archives]
+            self._check_chain()
+            self._plan()
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for zf in self.archives:
+            zf.close()
+        self.archives = []
+
+    @property
+    def files(self) -> Dict[str, dict]:
+        """{路径: 最终内容的清单记录}"""
+        return {path: plan.item for path, plan in self.plans.items()}
+
+    def _check_chain(self):
+        """检查包链是否连续（全量包不需要基准版本）"""
+        for index in range(1, len(self.manifests)):
+            manifest = self.manifests[index]
+            previous_version = self.manifests[index - 1]['target_version']
+            if not manifest['is_full_package'] and manifest['base_version'] != previous_version:
+                raise ApplyError(f"{self.package_files[index].name} 的基准版本 {manifest['base_version']} "
+                                 f"与前一个包的版本 {previous_version} 不一致")
+
+    def _plan(self):
+        """合并各包的清单"""
+        for zf, manifest in zip(self.archives, self.manifests):
+            for path in manifest['deleted']:
+                self.plans.pop(path, None)
+                self.deleted.add(path)
+            for path, item in manifest['files'].items():
+                self.deleted.discard(path)
+                steps = [(zf, item)]
+                if 'delta' in item and path in self.plans:
+                    steps = self.plans[path].steps + steps
+                self.plans[path] = PathPlan(item, steps)
+
+    @staticmethod
+    def build_content(plan: PathPlan, base_file: Optional[Path], output_path: str):
+        """
+        依次执行写入步骤，把最终内容写入已存在的输出文件
+        
+        完整成员解压时由 zipfile 校验CRC，补丁由 core.delta 校验基准和结果的sha256。
+        
+        Args:
+            plan: 写入步骤
+            base_file: 第一步为补丁时的基准文件
+            output_path: 输出文件
+        """
+        for index, (zf, item) in enumerate(plan.steps):
+            if 'delta' not in item:
+                with zf.open(item['member']) as source, open(output_path, 'wb') as out:
+                    while True:
+                        chunk = source.read(_EXTRACT_CHUNK)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+            elif index == 0:
+                if base_file is None:
+                    raise DeltaError(f"缺少补丁基准文件: {item['member']}")
+                apply_delta(zf.read(item['member']), base_file, Path(output_path))
+            else:
+                apply_delta(zf.read(item['member']), Path(output_path))
+
+
+class PackageApplier:
+    """
+    更新包应用器
+    
+    可以一次应用连续的多个包（包链），每个文件只写入最终内容一次：
+        1. 合并各包清单，得到每个文件最终内容的写入步骤和最终删除的文件；
+        2. 线程池并行准备各文件：内容已经与清单一致时跳过，否则在目标文件同目录的临时文件中
+           解压完整成员（由 zipfile 校验CRC）并依次应用补丁（由 core.delta 校验sha256）；
+        3. 全部文件准备成功后再逐个重命名替换目标文件，最后删除清单中记录的删除文件。
+    任何文件准备失败时删除所有临时文件，服务端目录保持不变。
+    """
+
+    def __init__(self, deep: bool = False, max_workers: Optional[int] = None):
+        """
+        初始化应用器
+        
+        Args:
+            deep: 判断文件是否已经一致时比较sha256（默认比较大小和CRC32）
+            max_workers: 并行准备文件的线程数，默认为 CPU 核心数（最多8）
+        """
+        self.deep = deep
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+
+    def apply(self, package_file: Path, server_dir: Path,
+              progress_callback: Optional[Callable] = None) -> ApplyReport:
+        """
+        把压缩包应用到服务端目录
+        
+        Args:
+            package_file: 压缩包
+            server_dir: 服务端目录（对应压缩包中的 MirServer 目录）
+            progress_callback: 进度回调函数 (已准备文件数, 总文件数)
+        
+        Returns:
+            应用结果
+        
+        Raises:
+            ApplyError: 没有包内清单或清单与压缩包不一致
+        """
+        return self.apply_chain([package_file], server_dir, progress_callback)
+
+    def apply_chain(self, package_files: Sequence[Path], server_dir: Path,
+                    progress_callback: Optional[Callable] = None) -> ApplyReport:
+        """
+        按顺序把连续的多个包一次应用到服务端目录
+        
+        Args:
+            package_files: 压缩包列表，每个增量包的基准版本必须是前一个包的目标版本
+            server_dir: 服务端目录（对应压缩包中的 MirServer 目录）
+            progress_callback: 进度回调函数 (已准备文件数, 总文件数)
+        
+        Returns:
+            应用结果
+        
+        Raises:
+            ApplyError: 没有包内清单、清单与压缩包不一致或包不连续
+        """
+        with PackageChain(package_files) as chain:
+            def stage(path: str) -> Optional[str]:
+                target_file = server_path(server_dir, path)
+                if file_matches(target_file, chain.plans[path].item, self.deep):
+                    return None
+                return stage_file(target_file, lambda temp_path: chain.build_content(
+                    chain.plans[path], target_file, temp_path))
+
+            return run_staged(chain.plans, chain.deleted, server_dir, stage, self.max_workers, progress_callback)
+
+    def verify(self, package_file: Path, server_dir: Path) -> VerifyReport:
+        """
+        校验服务端目录是否已经应用了压缩包
+        
+        Args:
+            package_file: 压缩包
+            server_dir: 服务端目录
+        
+        Returns:
+            校验结果
+        
+        Raises:
+            ApplyError: 没有包内清单或清单与压缩包不一致
+        """
+        with PackageChain([package_file]) as chain:
+            return check_files(chain.files, chain.deleted, server_dir, self.deep)
+
+
+def stage_file(target_file: Path, write: Callable[[str], None]) -> str:
+    """
+    在目标文件同目录创建临时文件并写入内容（权限与目标文件一致）
+    
+    Args:
+        target_file: 目标文件
+        write: 写入函数，参数为已创建的临时文件路径
+    
+    Returns:
+        临时文件路径
+    """
+    target_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=str(target_file.parent), prefix=f".{target_file.name}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        write(temp_path)
+        apply_file_mode(temp_path, target_file)
+    except BaseException:
+        _remove(temp_path)
+        raise
+    return temp_path
+
+
+def run_staged(paths: Iterable[str], deleted: Iterable[str], server_dir: Path,
+               stage: Callable[[str], Optional[str]], max_workers: int,
+               progress_callback: Optional[Callable] = None) -> ApplyReport:
+    """
+    并行准备所有文件，全部成功后再重命名替换并删除文件
+    
+    Args:
+        paths: 要写入的文件
+        deleted: 要删除的文件
+        server_dir: 服务端目录
+        stage: 准备一个文件，返回临时文件路径，内容已经一致时返回None
+        max_workers: 并行线程数
+        progress_callback: 进度回调函数 (已准备文件数, 总文件数)
+    
+    Returns:
+        应用结果，有准备失败的文件时不写入任何文件
+    """
+    report = ApplyReport()
+    staged: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(stage, path): path for path in paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                temp_path = future.result()
+                if temp_path is None:
+                    report.skipped.append(path)
+                else:
+                    staged[path] = temp_path
+            except (ApplyError, OSError, KeyError, DeltaError, zipfile.BadZipFile) as e:
+                report.failed[path] = str(e)
+            if progress_callback:
+                progress_callback(done, len(futures))
+
+    if report.failed:
+        for temp_path in staged.values():
+            _remove(temp_path)
+        return report
+
+    for path in sorted(staged):
+        try:
+            os.replace(staged[path], server_path(server_dir, path))
+            report.written.append(path)
+        except (ApplyError, OSError) as e:
+            _remove(staged[path])
+            report.failed[path] = str(e)
+
+    for path in sorted(deleted):
+        try:
+            target_file = server_path(server_dir, path)
+            if target_file.is_file():
+                target_file.unlink()
+                report.deleted.append(path)
+        except (ApplyError, OSError) as e:
+            report.failed[path] = str(e)
+    report.skipped.sort()
+    return report
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def main(argv=None) -> int:
+    """命令行入口：python -m core.package_applier apply <压缩包...> <服务端目录> | verify <压缩包> <服务端目录>"""
+    parser = argparse.ArgumentParser(prog='python -m core.package_applier', description='应用或校验更新包')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    apply_parser = subparsers.add_parser('apply', help='按顺序把一个或多个连续的压缩包应用到服务端目录'
+                                                       '（每个文件只写入最终内容，跳过内容已经一致的文件）')
+    apply_parser.add_argument('packages', nargs='+', help='压缩包文件（按版本顺序）')
+    apply_parser.add_argument('server_dir', help='服务端目录（MirServer）')
+    apply_parser.add_argument('--workers', type=int, default=None, help='并行线程数')
+
+    verify_parser = subparsers.add_parser('verify', help='校验服务端目录是否与压缩包一致')
+    verify_parser.add_argument('package', help='压缩包文件')
+    verify_parser.add_argument('server_dir', help='服务端目录（MirServer）')
+
+    for command_parser in (apply_parser, verify_parser):
+        command_parser.add_argument('--deep', action='store_true', help='比较sha256（默认比较大小和CRC32）')
+
+    args = parser.parse_args(argv)
+    applier = PackageApplier(args.deep, getattr(args, 'workers', None))
+    try:
+        if args.command == 'apply':
+            report = applier.apply_chain([Path(package) for package in args.packages], Path(args.server_dir))
+            for path, reason in report.failed.items():
+                print(f"应用失败 {path}: {reason}")
+            print(f"应用完成: 写入 {len(report.written)} 个，跳过 {len(report.skipped)} 个，"
+                  f"删除 {len(report.deleted)} 个，失败 {len(report.failed)} 个")
+            return 1 if report.failed else 0
+
+        report = applier.verify(Path(args.package), Path(args.server_dir))
+        for title, paths in (('缺少', report.missing), ('不一致', report.mismatched), ('未删除', report.leftover)):
+            for path in paths:
+                print(f"{title}: {path}")
+        print(f"校验完成: 一致 {report.matched} 个，缺少 {len(report.missing)} 个，"
+              f"不一致 {len(report.mismatched)} 个，未删除 {len(report.leftover)} 个")
+        return 0 if report.ok else 1
+    except (ApplyError, zipfile.BadZipFile, OSError) as e:
+        print(f"处理压缩包失败: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
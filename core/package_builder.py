@@ -3,67 +3,444 @@
 打包模块
 """
 
+import os
+import queue
 import threading
+import time
 import zipfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Callable
+from typing import Dict, List, NamedTuple, Optional, Callable
 
+from core.compression_policy import CompressionPolicy
+from core.delta import DELTA_ROOT, DELTA_SUFFIX, close_map, create_delta, map_file
+from core.digest import MANIFEST_ALGORITHM, ContentHasher, new_hasher
 from core.file_cache_manager import FileCacheManager
+from core.package_manifest import PACKAGE_MANIFEST_NAME, ArchiveMember, PackageInfo, StoredMember, \
+    encode_package_manifest
+from core import zip_writer
+from core.zip_writer import DEFLATE_WINDOW, abort_member, begin_member, deflate_block, finish_member, \
+    iter_raw_data, raw_data_offset, write_member_data, write_raw_member
+
+# 压缩包内的根目录
+ARCHIVE_ROOT = 'MirServer\\'
+
+
+def archive_name(relative_path: str, root: str = ARCHIVE_ROOT) -> str:
+    """获取文件在压缩包中的成员名称（与 ZipInfo.from_file 的规范化一致）"""
+    return zipfile.ZipInfo(os.path.normpath(root + relative_path)).filename
+
+
+def delta_archive_name(relative_path: str) -> str:
+    """获取文件补丁在压缩包中的成员名称"""
+    return archive_name(relative_path + DELTA_SUFFIX, DELTA_ROOT)
+
+
+class _BuildStopped(Exception):
+    """构建被停止"""
+
+
+class _ByteBudget:
+    """限制在途（已读取、尚未写入压缩包）的数据量"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int, should_stop: Callable[[], bool]) -> bool:
+        """申请额度，没有在途数据时总是允许（单块超过上限也能继续），停止时返回False"""
+        with self._condition:
+            while self.used and self.used + size > self.limit:
+                if should_stop():
+                    return False
+                self._condition.wait(0.1)
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class _MemberWriter(threading.Thread):
+    """写入线程：按提交顺序把各文件压缩好的数据块（或历史包中的原始压缩数据）写入压缩包"""
+
+    def __init__(self, zf: zipfile.ZipFile, budget: _ByteBudget):
+        super().__init__(daemon=True)
+        self.zf = zf
+        self.budget = budget
+        self.queue = queue.Queue()
+        self.error: Optional[BaseException] = None
+        self.failed = threading.Event()
+
+        # 复制原始数据时打开的历史包 {包文件: 文件对象}，只在写入线程中使用
+        self._sources: Dict[Path, object] = {}
+
+    def run(self):
+        zinfo = None
+        member = None
+        compress_size = 0
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                kind = item[0]
+                if kind == 'raw':
+                    _, raw_zinfo, package_file, offset, crc, file_size = item
+                    source = self._sources.get(package_file)
+                    if source is None:
+                        source = self._sources[package_file] = open(package_file, 'rb')
+                    write_raw_member(self.zf, raw_zinfo,
+                                     iter_raw_data(source, offset, raw_zinfo.compress_size), crc, file_size)
+                elif kind == 'data':
+                    _, payload, reserved = item
+                    # 存储的文件直接提交原始数据
+                    data = payload.result() if isinstance(payload, Future) else payload
+                    write_member_data(self.zf, member, data)
+                    compress_size += len(data)
+                    self.budget.release(reserved)
+                elif kind == 'begin':
+                    _, zinfo, compress_level = item
+                    member = begin_member(self.zf, zinfo, compress_level)
+                    compress_size = 0
+                elif kind == 'end':
+                    _, crc, file_size, on_finished = item
+                    finish_member(self.zf, zinfo, member, crc, file_size, compress_size)
+                    if on_finished:
+                        # 退回 ZipFile.open 时提交的是未压缩的数据，以写入后的成员信息为准
+                        on_finished(zinfo.compress_size)
+                    zinfo = None
+                elif kind == 'abort' and zinfo is not None:
+                    abort_member(self.zf, zinfo, member)
+                    zinfo = None
+        except BaseException as e:
+            self.error = e
+            self.failed.set()
+            # 放开额度，避免读取线程一直等待
+            self.budget.release(self.budget.used)
+        finally:
+            for source in self._sources.values():
+                source.close()
+
+    def put(self, item):
+        self.queue.put(item)
+
+
+class _StoredMemberSource:
+    """定位历史包中可以直接复制的成员（打开的历史包在构建期间保持打开）"""
+
+    def __init__(self, stored_members: Dict[str, StoredMember], output_file: Path):
+        self.stored_members = stored_members
+        self.output_file = output_file
+        self._archives: Dict[Path, Optional[zipfile.ZipFile]] = {}
+
+    def find(self, file_hash: Optional[str], size: int):
+        """
+        查找内容相同的历史成员
+        
+        Args:
+            file_hash: 文件内容的hash（与历史清单的hash算法一致）
+            size: 文件大小
+        
+        Returns:
+            (StoredMember, 成员信息, 压缩数据偏移)，没有可用的成员时返回None
+        """
+        member = self.stored_members.get(file_hash) if file_hash else None
+        if member is None or member.size != size:
+            return None
+        located = self.locate(member.package_file, archive_name(member.relative_path), size, member.crc)
+        return (member,) + located if located else None
+
+    def locate(self, package_file: Path, member_name: str, size: Optional[int] = None,
+               crc: Optional[int] = None):
+        """
+        定位历史包中的成员
+        
+        Args:
+            package_file: 历史包
+            member_name: 成员名称
+            size: 预期的原始大小，为None时不校验
+            crc: 预期的CRC32，为None时不校验
+        
+        Returns:
+            (成员信息, 压缩数据偏移)，成员不存在或与预期不一致时返回None
+        """
+        if package_file == self.output_file:
+            return None
+        archive = self._open(package_file)
+        if archive is None:
+            return None
+        try:
+            zinfo = archive.getinfo(member_name)
+            # 历史包被替换或成员与清单不一致时不复用
+            if (size is not None and zinfo.file_size != size) or (crc is not None and zinfo.CRC != crc):
+                return None
+            if zinfo.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                return None
+            return zinfo, raw_data_offset(archive, zinfo)
+        except (KeyError, zipfile.BadZipFile, OSError):
+            return None
+
+    def _open(self, package_file: Path) -> Optional[zipfile.ZipFile]:
+        if package_file not in self._archives:
+            try:
+                self._archives[package_file] = zipfile.ZipFile(package_file, 'r')
+            except (zipfile.BadZipFile, OSError) as e:
+                print(f"打开历史包失败 {package_file}: {e}")
+                self._archives[package_file] = None
+        return self._archives[package_file]
+
+    def close(self):
+        for archive in self._archives.values():
+            if archive is not None:
+                archive.close()
+        self._archives.clear()
+
+
+class _BuildContext(NamedTuple):
+    """一次构建中各文件共用的对象"""
+    pool: ThreadPoolExecutor  # 压缩线程池
+    budget: _ByteBudget  # 在途数据额度
+    member_writer: _MemberWriter  # 写入线程
+    member_source: _StoredMemberSource  # 历史成员查找器
+    should_stop: Callable[[], bool]  # 返回True时停止
+
+
+def _deflate_timed(timings: list, data, level: int, zdict: bytes, last: bool) -> bytes:
+    """压缩一块数据并记录耗时（供压缩策略统计）"""
+    start = time.perf_counter()
+    result = deflate_block(data, level, zdict, last)
+    timings.append(time.perf_counter() - start)
+    return result
+
+
+def _read_block(f, size: int) -> bytearray:
+    """读取一块数据，只有到达文件末尾时才会少于 size"""
+    block = bytearray(size)
+    view = memoryview(block)
+    filled = 0
+    while filled < size:
+        count = f.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    view.release()
+    if filled < size:
+        del block[filled:]
+    return block
 
 
 class PackageBuilder:
     """打包构建器"""
 
-    def __init__(self, cache_manager: Optional[FileCacheManager] = None):
+    def __init__(self, cache_manager: Optional[FileCacheManager] = None,
+                 max_workers: Optional[int] = None,
+                 max_in_flight_bytes: int = 64 * 1024 * 1024,
+                 block_size: int = 1024 * 1024,
+                 adaptive_compression: bool = True):
+        """
+        初始化打包构建器
+        
+        Args:
+            cache_manager: 文件缓存管理器
+            max_workers: 压缩线程数，默认为CPU核数
+            max_in_flight_bytes: 已读取但尚未写入压缩包的数据上限，限制打包时的内存占用
+            block_size: 分块压缩的块大小，大文件的各块并行压缩
+            adaptive_compression: 按文件内容和历史统计选择压缩方式（否则全部使用默认级别）
+        """
         self._stop_build = False
         self._lock = threading.Lock()
         self.cache_manager = cache_manager or FileCacheManager()
+        self.compress_level = 6
+        self.compression_policy: Optional[CompressionPolicy] = CompressionPolicy(
+            self.cache_manager.cache_dir / "compression_stats.json", self.compress_level
+        ) if adaptive_compression else None
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.block_size = block_size
+
+        # 最近一次打包的清单 {相对路径: {'sha256', 'size'}}，sha256 只对实际打包的文件计算
+        self.last_manifest: Dict[str, dict] = {}
+
+        # 最近一次打包中扫描后又发生变化的文件 {相对路径: 打包时内容的hash}
+        self.last_changed_files: Dict[str, str] = {}
+
+        # 最近一次打包中直接复制历史包压缩数据的文件数
+        self.last_reused_count = 0
+
+        # 最近一次打包中以补丁形式打包的文件 {相对路径: {'size', 'patch_size'}}
+        self.last_delta_files: Dict[str, dict] = {}
+
+        # 补丁中新数据超过文件大小的该比例时改为打包完整文件
+        self.delta_max_literal_ratio = 0.5
 
     def create_package(self, source_dir: Path, output_file: Path,
                        files_to_include: List[str],
-                       progress_callback: Optional[Callable] = None) -> bool:
+                       progress_callback: Optional[Callable] = None,
+                       file_info: Optional[Dict[str, dict]] = None,
+                       stored_members: Optional[Dict[str, StoredMember]] = None,
+                       delta_bases: Optional[Dict[str, str]] = None,
+                       package_info: Optional[PackageInfo] = None) -> bool:
         """
         创建打包文件
         
+        每个文件只读取一次，同时写入缓存、计算校验hash；文件按块交给压缩线程池并行压缩为原始 deflate 数据，
+        由写入线程按顺序写入压缩包。扫描后未变化（size、mtime_ns一致）且历史包中有相同内容的文件，
+        直接复制历史包中的压缩数据和CRC，不再读取和压缩。delta_bases 中的文件在缓存有旧版本内容时
+        以二进制补丁（_delta 目录下的 .mdelta 成员）代替完整文件，补丁不够小时仍打包完整文件。
+        给出 package_info 时在压缩包末尾写入包内清单（见 core.package_manifest）。
+        
         Args:
             source_dir: 源目录
             output_file: 输出文件路径
             files_to_include: 要包含的文件列表（相对路径）
             progress_callback: 进度回调函数
+            file_info: 扫描结果，用于校验文件在扫描后是否发生变化（hash算法需与缓存管理器一致）
+            stored_members: 历史包中的文件 {内容hash: StoredMember}，见 VersionManager.get_stored_members
+            delta_bases: 以补丁形式打包的文件 {相对路径: 旧版本内容的hash}（hash算法与缓存管理器一致）
+            package_info: 写入包内清单的版本信息
+        
+        Returns:
+            打包是否成功
+        """
+        self._stop_build = False
+        self.last_manifest = {}
+        self.last_changed_files = {}
+        self.last_reused_count = 0
+        self.last_delta_files = {}
+        file_info = file_info or {}
+        delta_bases = delta_bases or {}
+
+        def add_file(relative_path: str, context: _BuildContext) -> bool:
+            source_file = source_dir / relative_path
+            if not (source_file.exists() and source_file.is_file()):
+                return False
+            scan_info = file_info.get(relative_path)
+            # 依次尝试补丁、复用历史包，最后才读取压缩
+            added = relative_path in delta_bases and self._add_delta_file(
+                source_file, relative_path, scan_info, delta_bases[relative_path], context)
+            if not added:
+                added = self._add_stored_file(source_file, relative_path, scan_info, context)
+            if not added:
+                self._add_file(source_file, relative_path, scan_info, context)
+            return True
+
+        # 缓存索引在整个打包结束时只提交一次
+        with self.cache_manager.batch():
+            success = self._write_package(output_file, files_to_include, add_file, progress_callback,
+                                          _StoredMemberSource(stored_members or {}, output_file), package_info)
+            if success and package_info is not None:
+                # 记录该版本各文件的缓存内容，用于读取和对比任意版本
+                self.cache_manager.record_version(
+                    package_info.target_version, [path for path in files_to_include if path in self.last_manifest],
+                    package_info.deleted, package_info.is_full_package)
+            return success
+
+    def create_archive_package(self, output_file: Path, members: List[ArchiveMember],
+                               progress_callback: Optional[Callable] = None,
+                               package_info: Optional[PackageInfo] = None) -> bool:
+        """
+        不读取源目录，由历史包中的成员创建压缩包（合并增量包、重建历史版本的全量包）
+        
+        历史包中的成员直接复制原始压缩数据；任何一个成员无法写入时整个打包失败。
+        
+        Args:
+            output_file: 输出文件路径
+            members: 要包含的文件
+            progress_callback: 进度回调函数
+            package_info: 写入包内清单的版本信息
             
         Returns:
             打包是否成功
         """
         self._stop_build = False
+        self.last_manifest = {}
+        self.last_changed_files = {}
+        self.last_reused_count = 0
+        self.last_delta_files = {}
+
+        def add_member(member: ArchiveMember, context: _BuildContext) -> bool:
+            self._add_archive_member(member, context)
+            return True
+
+        return self._write_package(output_file, members, add_member, progress_callback,
+                                   _StoredMemberSource({}, output_file), package_info, strict=True)
 
+    def _write_package(self, output_file: Path, items: list,
+                       add_item: Callable[[object, _BuildContext], bool],
+                       progress_callback: Optional[Callable],
+                       member_source: _StoredMemberSource, package_info: Optional[PackageInfo] = None,
+                       strict: bool = False) -> bool:
+        """
+        创建压缩包并逐项写入
+        
+        Args:
+            output_file: 输出文件路径
+            items: 要写入的项目
+            add_item: 写入一项，返回是否已写入（跳过时返回False）
+            progress_callback: 进度回调函数
+            member_source: 历史成员查找器
+            package_info: 写入包内清单的版本信息，为None时不写入
+            strict: 某一项写入失败时整个打包失败（否则跳过该项）
+            
+        Returns:
+            打包是否成功
+        """
         try:
             # 确保输出目录存在
             output_file.parent.mkdir(parents=True, exist_ok=True)
 
-            total_files = len(files_to_include)
+            total_files = len(items)
             processed = 0
 
-            with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
-                for relative_path in files_to_include:
-                    if self._stop_build:
-                        return False
+            with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=self.compress_level) as zf:
+                budget = _ByteBudget(self.max_in_flight_bytes)
+                member_writer = _MemberWriter(zf, budget)
+                member_writer.start()
+                should_stop = lambda: self._stop_build or member_writer.failed.is_set()
+
+                try:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                        context = _BuildContext(pool, budget, member_writer, member_source, should_stop)
+                        for item in items:
+                            if should_stop():
+                                break
+
+                            try:
+                                if not add_item(item, context):
+                                    continue
 
-                    source_file = source_dir / relative_path
-                    if source_file.exists() and source_file.is_file():
-                        try:
-                            # 使用相对路径保持目录结构
-                            zf.write(source_file, 'MirServer\\' + relative_path)
+                                processed += 1
 
-                            # 缓存文件内容用于后续差异对比
-                            self.cache_manager.cache_file(source_file, relative_path)
+                                if progress_callback:
+                                    progress_callback(processed, total_files)
+                            except _BuildStopped:
+                                break
+                            except Exception as e:
+                                if strict:
+                                    raise
+                                print(f"添加文件到压缩包失败 {item}: {e}")
+                                continue
 
-                            processed += 1
+                        if package_info is not None and not should_stop():
+                            try:
+                                self._add_bytes(PACKAGE_MANIFEST_NAME, self._encode_package_manifest(package_info),
+                                                context)
+                            except _BuildStopped:
+                                pass
+                finally:
+                    member_writer.put(None)
+                    member_writer.join()
+                    member_source.close()
+                    if self.compression_policy:
+                        self.compression_policy.save()
 
-                            if progress_callback:
-                                progress_callback(processed, total_files)
-                        except Exception as e:
-                            print(f"添加文件到压缩包失败 {relative_path}: {e}")
-                            continue
+                if member_writer.error is not None:
+                    raise member_writer.error
 
             return not self._stop_build
 
@@ -77,9 +454,326 @@ class PackageBuilder:
                     pass
             return False
 
+    def _encode_package_manifest(self, package_info: PackageInfo) -> bytes:
+        """根据本次打包的清单生成包内清单"""
+        member_names = {
+            relative_path: delta_archive_name(relative_path) if 'delta' in entry else archive_name(relative_path)
+            for relative_path, entry in self.last_manifest.items()
+        }
+        return encode_package_manifest(package_info, self.last_manifest, member_names)
+
+    def _add_file(self, source_file: Path, relative_path: str, scan_info: Optional[dict],
+                  context: _BuildContext, cache_content: bool = True):
+        """
+        读取一次文件：数据块交给压缩线程池并按顺序提交给写入线程，同时写入缓存文件、计算校验hash和清单hash
+        
+        Args:
+            source_file: 源文件
+            relative_path: 相对路径
+            scan_info: 扫描时的文件信息，没有时不校验
+            context: 构建上下文
+            cache_content: 是否缓存文件内容（还原出的临时文件不缓存）
+        
+        Raises:
+            _BuildStopped: 构建被停止
+        """
+        pool, budget, member_writer, should_stop = \
+            context.pool, context.budget, context.member_writer, context.should_stop
+        # 使用相对路径保持目录结构
+        zinfo = zipfile.ZipInfo.from_file(source_file, ARCHIVE_ROOT + relative_path)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+
+        expected_hash = scan_info.get('hash') if scan_info else None
+        content_hasher = ContentHasher(self.cache_manager.hash_algorithm, zinfo.file_size)
+        manifest_hasher = new_hasher(MANIFEST_ALGORITHM)
+
+        # 缓存中已有扫描时的版本时不再写缓存
+        writer = None if not cache_content or self.cache_manager.is_cached(relative_path, expected_hash) else \
+            self.cache_manager.open_writer(zinfo.file_size)
+        sinks = [content_hasher, manifest_hasher] + ([writer] if writer else [])
+
+        crc = 0
+        zdict = b''
+        level = self.compress_level
+        timings = []
+        parallel = zip_writer.RAW_WRITE_SUPPORTED
+        try:
+            with open(source_file, 'rb', buffering=0) as f:
+                stat = os.fstat(f.fileno())
+                begun = False
+                try:
+                    while True:
+                        if not budget.acquire(self.block_size, should_stop):
+                            raise _BuildStopped()
+                        block = _read_block(f, self.block_size)
+                        last = len(block) < self.block_size
+                        if not begun:
+                            # 根据第一块数据选择压缩方式后再写入文件头
+                            if self.compression_policy:
+                                choice = self.compression_policy.choose(relative_path, block)
+                                level = 0 if choice.stored else choice.level
+                                if choice.stored:
+                                    zinfo.compress_type = zipfile.ZIP_STORED
+                            # 不能直接写入压缩数据时提交未压缩的数据，由写入线程按选择的级别压缩
+                            member_writer.put(('begin', zinfo, None if parallel else level))
+                            begun = True
+                        for sink in sinks:
+                            sink.update(block)
+                        crc = zlib.crc32(block, crc)
+                        if zinfo.compress_type == zipfile.ZIP_STORED or not parallel:
+                            member_writer.put(('data', block, self.block_size))
+                        else:
+                            future = pool.submit(_deflate_timed, timings, block, level, zdict, last)
+                            member_writer.put(('data', future, self.block_size))
+                        if last:
+                            break
+                        # 下一块以本块末尾的数据作为预设字典
+                        zdict = bytes(block[-DEFLATE_WINDOW:]) if len(block) >= DEFLATE_WINDOW else \
+                            (zdict + block)[-DEFLATE_WINDOW:]
+                except BaseException:
+                    if begun:
+                        member_writer.put(('abort',))
+                    raise
+                on_finished = None
+                if self.compression_policy:
+                    policy = self.compression_policy
+                    extension = policy.get_extension(relative_path)
+                    file_size = content_hasher.size
+                    on_finished = lambda compress_size: policy.record(
+                        extension, level, file_size, compress_size, sum(timings)
+                    )
+                member_writer.put(('end', crc, content_hasher.size, on_finished))
+        except BaseException:
+            if writer:
+                writer.discard()
+            raise
+
+        # 记录打包清单
+        file_hash = content_hasher.hexdigest()
+        self.last_manifest[relative_path] = {
+            MANIFEST_ALGORITHM: manifest_hasher.hexdigest(),
+            'size': content_hasher.size,
+            'crc': crc
+        }
+
+        # 与扫描时的hash对比，发现扫描后又被修改的文件
+        if expected_hash and file_hash != expected_hash:
+            print(f"文件在扫描后发生变化 {relative_path}")
+            self.last_changed_files[relative_path] = file_hash
+
+        # 缓存文件内容用于后续差异对比
+        if writer:
+            self.cache_manager.commit_writer(writer, source_file, relative_path, file_hash, stat)
+        elif cache_content and file_hash != expected_hash:
+            self.cache_manager.cache_file(source_file, relative_path)
+
+    def _add_stored_file(self, source_file: Path, relative_path: str, scan_info: Optional[dict],
+                         context: _BuildContext) -> bool:
+        """
+        文件自扫描后未变化且历史包中有相同内容时，提交写入线程直接复制历史包中的压缩数据
+        
+        Args:
+            source_file: 源文件
+            relative_path: 相对路径
+            scan_info: 扫描时的文件信息
+            context: 构建上下文
+        
+        Returns:
+            是否已复用历史成员（False 时需要正常读取压缩）
+        """
+        if not scan_info or 'mtime_ns' not in scan_info:
+            return False
+        stat = source_file.stat()
+        if stat.st_size != scan_info.get('size') or stat.st_mtime_ns != scan_info['mtime_ns']:
+            return False
+        found = context.member_source.find(scan_info.get('hash'), stat.st_size)
+        if found is None:
+            return False
+        member, stored_zinfo, offset = found
+
+        zinfo = zipfile.ZipInfo.from_file(source_file, ARCHIVE_ROOT + relative_path)
+        zinfo.compress_type = stored_zinfo.compress_type
+        zinfo.compress_size = stored_zinfo.compress_size
+        context.member_writer.put(('raw', zinfo, member.package_file, offset,
+                                   stored_zinfo.CRC, stored_zinfo.file_size))
+
+        self.last_manifest[relative_path] = {
+            MANIFEST_ALGORITHM: member.sha256,
+            'size': member.size,
+            'crc': stored_zinfo.CRC
+        }
+        self.last_reused_count += 1
+
+        # 没有缓存时补写缓存（只复制文件，不压缩）
+        if not self.cache_manager.is_cached(relative_path, scan_info['hash']):
+            self.cache_manager.cache_file(source_file, relative_path)
+        return True
+
+    def _add_delta_file(self, source_file: Path, relative_path: str, scan_info: Optional[dict],
+                        base_hash: str, context: _BuildContext) -> bool:
+        """
+        根据缓存中的旧版本内容生成补丁并写入压缩包，同时更新缓存、计算校验hash
+        
+        Args:
+            source_file: 源文件
+            relative_path: 相对路径
+            scan_info: 扫描时的文件信息，没有时不校验
+            base_hash: 旧版本内容的hash
+            context: 构建上下文
+            
+        Returns:
+            是否已写入补丁（False 时需要打包完整文件）
+            
+        Raises:
+            _BuildStopped: 构建被停止
+        """
+        with self.cache_manager.map_cached_data(relative_path, base_hash) as base:
+            if base is None:
+                return False
+            return self._write_delta(source_file, relative_path, scan_info, base, context)
+
+    def _write_delta(self, source_file: Path, relative_path: str, scan_info: Optional[dict],
+                     base, context: _BuildContext) -> bool:
+        """
+        生成相对 base 的补丁并写入压缩包，见 _add_delta_file
+        
+        Args:
+            source_file: 源文件
+            relative_path: 相对路径
+            scan_info: 扫描时的文件信息，没有时不校验
+            base: 旧版本内容（bytes 或 mmap）
+            context: 构建上下文
+            
+        Returns:
+            是否已写入补丁
+            
+        Raises:
+            _BuildStopped: 构建被停止
+        """
+        handle, target = map_file(source_file)
+        try:
+            stat = os.fstat(handle.fileno())
+            base_sha256 = new_hasher(MANIFEST_ALGORITHM)
+            base_sha256.update(base)
+            target_sha256 = new_hasher(MANIFEST_ALGORITHM)
+            target_sha256.update(target)
+            patch = create_delta(base, target, base_sha256.hexdigest(), target_sha256.hexdigest(),
+                                 self.delta_max_literal_ratio, context.should_stop)
+            if context.should_stop():
+                raise _BuildStopped()
+            if patch is None or len(patch) >= len(target):
+                return False
+
+            content_hasher = ContentHasher(self.cache_manager.hash_algorithm, len(target))
+            content_hasher.update(target)
+            file_hash = content_hasher.hexdigest()
+            crc = zlib.crc32(target)
+
+            self._add_bytes(delta_archive_name(relative_path), patch, context,
+                            time.localtime(stat.st_mtime)[:6])
+
+            # 缓存新版本内容，作为下一次补丁的基准
+            if not self.cache_manager.is_cached(relative_path, file_hash):
+                writer = self.cache_manager.open_writer(len(target))
+                try:
+                    writer.update(target)
+                except BaseException:
+                    writer.discard()
+                    raise
+                self.cache_manager.commit_writer(writer, source_file, relative_path, file_hash, stat)
+        finally:
+            close_map(handle, target)
+
+        self.last_manifest[relative_path] = {
+            MANIFEST_ALGORITHM: target_sha256.hexdigest(),
+            'size': content_hasher.size,
+            'crc': crc,
+            'delta': {'base_' + MANIFEST_ALGORITHM: base_sha256.hexdigest(), 'patch_size': len(patch)}
+        }
+        self.last_delta_files[relative_path] = {'size': content_hasher.size, 'patch_size': len(patch)}
+
+        expected_hash = scan_info.get('hash') if scan_info else None
+        if expected_hash and file_hash != expected_hash:
+            print(f"文件在扫描后发生变化 {relative_path}")
+            self.last_changed_files[relative_path] = file_hash
+        return True
+
+    def _add_bytes(self, member_name: str, data: bytes, context: _BuildContext,
+                   date_time: Optional[tuple] = None):
+        """
+        写入一个内容已在内存中的成员（补丁、说明文件等，不再压缩）
+        
+        Args:
+            member_name: 成员名称
+            data: 内容
+            context: 构建上下文
+            date_time: 修改时间，默认为当前时间
+        
+        Raises:
+            _BuildStopped: 构建被停止
+        """
+        if not context.budget.acquire(len(data), context.should_stop):
+            raise _BuildStopped()
+        zinfo = zipfile.ZipInfo(member_name, date_time or time.localtime()[:6])
+        zinfo.compress_type = zipfile.ZIP_STORED
+        zinfo.external_attr = 0o644 << 16
+        context.member_writer.put(('begin', zinfo, None))
+        context.member_writer.put(('data', data, len(data)))
+        context.member_writer.put(('end', zlib.crc32(data), len(data), None))
+
+    def _add_archive_member(self, member: ArchiveMember, context: _BuildContext):
+        """
+        写入由历史包生成压缩包时的一个文件
+        
+        Args:
+            member: 文件及其来源
+            context: 构建上下文
+        """
+        relative_path = member.relative_path
+        entry = dict(member.entry)
+        is_delta = 'delta' in entry
+
+        def get_member_name(path: str) -> str:
+            return delta_archive_name(path) if is_delta else archive_name(path)
+
+        if member.package_file is not None:
+            member_name = get_member_name(member.package_path or relative_path)
+            located = context.member_source.locate(
+                member.package_file, member_name,
+                None if is_delta else entry.get('size'), None if is_delta else entry.get('crc')
+            )
+            if located is None:
+                raise ValueError(f"历史包 {member.package_file.name} 中没有可用的成员 {member_name}")
+            stored_zinfo, offset = located
+
+            zinfo = zipfile.ZipInfo(get_member_name(relative_path), stored_zinfo.date_time)
+            zinfo.external_attr = stored_zinfo.external_attr
+            zinfo.compress_type = stored_zinfo.compress_type
+            zinfo.compress_size = stored_zinfo.compress_size
+            context.member_writer.put(('raw', zinfo, member.package_file, offset,
+                                       stored_zinfo.CRC, stored_zinfo.file_size))
+            if not is_delta:
+                entry['crc'] = stored_zinfo.CRC
+            self.last_reused_count += 1
+        elif member.patch is not None:
+            self._add_bytes(delta_archive_name(relative_path), member.patch, context)
+        else:
+            self._add_file(member.source_file, relative_path, None, context, cache_content=False)
+            # 清单记录还原前的内容（_add_file 记录的是实际写入的内容，两者应一致）
+            written = self.last_manifest[relative_path]
+            if written[MANIFEST_ALGORITHM] != entry[MANIFEST_ALGORITHM]:
+                raise ValueError(f"还原的文件内容与清单不一致: {relative_path}")
+            entry['crc'] = written['crc']
+
+        if is_delta:
+            self.last_delta_files[relative_path] = {'size': entry['size'], 'patch_size': entry['delta']['patch_size']}
+        self.last_manifest[relative_path] = entry
+
     def create_full_package(self, source_dir: Path, output_file: Path,
                             file_info: Dict[str, dict],
-                            progress_callback: Optional[Callable] = None) -> bool:
+                            progress_callback: Optional[Callable] = None,
+                            stored_members: Optional[Dict[str, StoredMember]] = None,
+                            package_info: Optional[PackageInfo] = None) -> bool:
         """
         创建全量包
         
@@ -88,16 +782,23 @@ class PackageBuilder:
             output_file: 输出文件路径
             file_info: 文件信息字典
             progress_callback: 进度回调函数
-            
+            stored_members: 历史包中的文件，未变化的文件直接复制压缩数据
+            package_info: 写入包内清单的版本信息
+        
         Returns:
             打包是否成功
         """
         files_to_include = list(file_info.keys())
-        return self.create_package(source_dir, output_file, files_to_include, progress_callback)
+        return self.create_package(source_dir, output_file, files_to_include, progress_callback, file_info,
+                                   stored_members, package_info=package_info)
 
     def create_incremental_package(self, source_dir: Path, output_file: Path,
                                    changed_files: List[str],
-                                   progress_callback: Optional[Callable] = None) -> bool:
+                                   progress_callback: Optional[Callable] = None,
+                                   file_info: Optional[Dict[str, dict]] = None,
+                                   stored_members: Optional[Dict[str, StoredMember]] = None,
+                                   delta_bases: Optional[Dict[str, str]] = None,
+                                   package_info: Optional[PackageInfo] = None) -> bool:
         """
         创建增量包
         
@@ -106,11 +807,16 @@ class PackageBuilder:
             output_file: 输出文件路径
             changed_files: 变更的文件列表
             progress_callback: 进度回调函数
-            
+            file_info: 扫描结果，用于校验文件在扫描后是否发生变化
+            stored_members: 历史包中的文件（还原为旧内容的文件可以直接复制）
+            delta_bases: 修改的文件 {相对路径: 旧版本内容的hash}，以补丁形式打包
+            package_info: 写入包内清单的版本信息
+        
         Returns:
             打包是否成功
         """
-        return self.create_package(source_dir, output_file, changed_files, progress_callback)
+        return self.create_package(source_dir, output_file, changed_files, progress_callback, file_info,
+                                   stored_members, delta_bases, package_info)
 
     def stop_build(self):
         """停止构建"""
@@ -123,13 +829,13 @@ class PackageBuilder:
         
         Args:
             package_file: 包文件路径
-            
+        
         Returns:
             包信息字典
         """
         try:
             with zipfile.ZipFile(package_file, 'r') as zf:
-                file_list = zf.namelist()
+                file_list = [name for name in zf.namelist() if name != PACKAGE_MANIFEST_NAME]
                 total_size = sum(zf.getinfo(name).file_size for name in file_list)
                 compressed_size = sum(zf.getinfo(name).compress_size for name in file_list)
 
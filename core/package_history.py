@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+版本历史模块，根据各版本的打包清单还原任意版本的文件状态，并由历史包合并增量包、重建全量包
+"""
+
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from packaging import version as version_parser
+
+from core.delta import DeltaError, apply_delta, close_map, create_delta, map_file
+from core.digest import MANIFEST_ALGORITHM, new_hasher
+from core.package_builder import PackageBuilder, archive_name, delta_archive_name
+from core.package_manifest import ArchiveMember, PackageInfo
+
+
+class HistoryError(Exception):
+    """版本历史不完整，无法还原"""
+
+
+class HistoryEntry(NamedTuple):
+    """文件在某个版本中的记录"""
+    version: str  # 最后一次打包该文件的版本
+    package_file: Path  # 该版本的包
+    relative_path: str
+    entry: dict  # 打包清单记录（sha256、size、crc，补丁为 delta）
+
+
+class SquashPlan(NamedTuple):
+    """合并增量包的内容"""
+    base_version: str
+    target_version: str
+    members: List[ArchiveMember]
+    deleted: List[str]  # 相对基准版本删除的文件
+
+
+class PackageHistory:
+    """
+    版本历史
+    
+    从不晚于指定版本的最近一个全量版本开始，依次应用各版本清单中打包的文件和删除的文件，
+    得到该版本每个文件的内容（sha256）及其所在的包。
+    """
+
+    def __init__(self, version_manager, output_dir: Path):
+        """
+        初始化版本历史
+        
+        Args:
+            version_manager: 版本管理器
+            output_dir: 输出目录（各版本的包为其中的 版本号.zip）
+        """
+        self.version_manager = version_manager
+        self.output_dir = Path(output_dir)
+        # 没有删除记录的增量版本（该功能之前生成的清单），还原结果可能包含已删除的文件
+        self.incomplete_versions: List[str] = []
+
+    def get_versions(self):
+        """获取按版本号排序的版本信息"""
+        return sorted(self.version_manager.get_versions(),
+                      key=lambda v: version_parser.parse(v.version.lstrip('v')))
+
+    def get_package_file(self, version_str: str) -> Path:
+        """获取版本的包文件"""
+        return self.output_dir / f"{version_str}.zip"
+
+    def resolve(self, version_str: str) -> Dict[str, HistoryEntry]:
+        """
+        还原版本的文件状态
+        
+        Args:
+            version_str: 版本号
+        
+        Returns:
+            {相对路径: HistoryEntry}
+        
+        Raises:
+            HistoryError: 版本不存在、之前没有全量版本或清单缺失
+        """
+        versions = self.get_versions()
+        index = next((i for i, v in enumerate(versions) if v.version == version_str), None)
+        if index is None:
+            raise HistoryError(f"版本不存在: {version_str}")
+        start = next((i for i in range(index, -1, -1) if versions[i].is_full_package), None)
+        if start is None:
+            raise HistoryError(f"{version_str} 之前没有全量版本")
+
+        state: Dict[str, HistoryEntry] = {}
+        self.incomplete_versions = []
+        for version_info in versions[start:index + 1]:
+            manifest = self.version_manager.get_manifest(version_info.version)
+            if manifest is None:
+                raise HistoryError(f"缺少版本 {version_info.version} 的打包清单")
+            if manifest.get('is_full_package', version_info.is_full_package):
+                state = {}
+            elif 'deleted' not in manifest:
+                self.incomplete_versions.append(version_info.version)
+            for path in manifest.get('deleted', []):
+                state.pop(path, None)
+
+            package_file = self.get_package_file(version_info.version)
+            for path, entry in manifest.get('files', {}).items():
+                if MANIFEST_ALGORITHM not in entry:
+                    raise HistoryError(f"版本 {version_info.version} 的清单没有记录文件内容: {path}")
+                state[path] = HistoryEntry(version_info.version, package_file, path, entry)
+        return state
+
+    def plan_squash(self, base_version: str, target_version: str, work_dir: Path,
+                    delta_patches: bool = True) -> SquashPlan:
+        """
+        计算从基准版本升级到目标版本所需的内容（每个文件只包含最终内容）
+        
+        最终内容为完整文件的直接复制历史包中的压缩数据；最终内容为补丁且补丁基准正是基准版本内容的
+        直接复制补丁成员；其余文件在 work_dir 中还原后重新生成补丁或打包完整文件。
+        
+        Args:
+            base_version: 基准版本（服务端当前的版本）
+            target_version: 目标版本
+            work_dir: 还原文件使用的临时目录
+            delta_patches: 修改的文件是否以补丁形式打包
+        
+        Returns:
+            合并计划
+        
+        Raises:
+            HistoryError: 版本历史不完整或历史包缺失
+        """
+        versions = [v.version for v in self.get_versions()]
+        if base_version not in versions or target_version not in versions:
+            raise HistoryError(f"版本不存在: {base_version} / {target_version}")
+        if versions.index(base_version) >= versions.index(target_version):
+            raise HistoryError("目标版本必须晚于基准版本")
+
+        base_state = self.resolve(base_version)
+        incomplete_versions = list(self.incomplete_versions)
+        target_state = self.resolve(target_version)
+        self.incomplete_versions = sorted(set(incomplete_versions + self.incomplete_versions))
+
+        materializer = _Materializer(self, work_dir)
+        members = []
+        for path in sorted(target_state):
+            item = target_state[path]
+            base_item = base_state.get(path)
+            base_sha256 = base_item.entry[MANIFEST_ALGORITHM] if base_item else None
+            if item.entry[MANIFEST_ALGORITHM] == base_sha256:
+                continue
+
+            delta = item.entry.get('delta')
+            if delta is None:
+                members.append(ArchiveMember(path, item.entry, package_file=item.package_file))
+                continue
+            if delta_patches and delta.get('base_' + MANIFEST_ALGORITHM) == base_sha256:
+                members.append(ArchiveMember(path, item.entry, package_file=item.package_file))
+                continue
+
+            # 补丁基准不是基准版本的内容，还原后重新生成补丁
+            patch = None
+            if delta_patches and base_item is not None:
+                patch = self._create_patch(materializer.materialize(base_sha256),
+                                           materializer.materialize(item.entry[MANIFEST_ALGORITHM]),
+                                           base_sha256, item.entry[MANIFEST_ALGORITHM])
+            if patch is not None:
+                entry = {key: value for key, value in item.entry.items() if key != 'delta'}
+                entry['delta'] = {'base_' + MANIFEST_ALGORITHM: base_sha256, 'patch_size': len(patch)}
+                members.append(ArchiveMember(path, entry, patch=patch))
+            else:
+                members.append(self._full_member(item, materializer))
+
+        for member in members:
+            if member.package_file is not None and not member.package_file.exists():
+                raise HistoryError(f"历史包不存在: {member.package_file.name}")
+
+        deleted = sorted(path for path in base_state if path not in target_state)
+        return SquashPlan(base_version, target_version, members, deleted)
+
+    def plan_full(self, version_str: str, work_dir: Path) -> List[ArchiveMember]:
+        """
+        计算重建版本全量包所需的内容
+        
+        Args:
+            version_str: 版本号
+            work_dir: 还原文件使用的临时目录
+        
+        Returns:
+            全量包中的文件
+        
+        Raises:
+            HistoryError: 版本历史不完整或历史包缺失
+        """
+        state = self.resolve(version_str)
+        materializer = _Materializer(self, work_dir)
+        members = [self._full_member(state[path], materializer) for path in sorted(state)]
+        for member in members:
+            if member.package_file is not None and not member.package_file.exists():
+                raise HistoryError(f"历史包不存在: {member.package_file.name}")
+        return members
+
+    @staticmethod
+    def _full_member(item: HistoryEntry, materializer: '_Materializer') -> ArchiveMember:
+        """
+        文件的完整内容：直接复制历史包中内容相同的完整成员（可以是其它路径、其它版本），
+        只有补丁形式的内容才还原后重新压缩
+        """
+        if 'delta' not in item.entry:
+            return ArchiveMember(item.relative_path, item.entry, package_file=item.package_file)
+
+        entry = {key: value for key, value in item.entry.items() if key != 'delta'}
+        stored = materializer.find_full(entry[MANIFEST_ALGORITHM])
+        if stored is not None:
+            if 'crc' in stored.entry:
+                entry['crc'] = stored.entry['crc']
+            return ArchiveMember(item.relative_path, entry, package_file=stored.package_file,
+                                 package_path=stored.relative_path)
+        return ArchiveMember(item.relative_path, entry,
+                             source_file=materializer.materialize(entry[MANIFEST_ALGORITHM]))
+
+    @staticmethod
+    def _create_patch(base_file: Path, target_file: Path, base_sha256: str, target_sha256: str,
+                      max_literal_ratio: float = 0.5) -> Optional[bytes]:
+        """生成补丁，补丁不比完整文件小时返回None"""
+        base_handle, base = map_file(base_file)
+        try:
+            target_handle, target = map_file(target_file)
+            try:
+                patch = create_delta(base, target, base_sha256, target_sha256, max_literal_ratio)
+                if patch is None or len(patch) >= len(target):
+                    return None
+                return patch
+            finally:
+                close_map(target_handle, target)
+        finally:
+            close_map(base_handle, base)
+
+    def squash(self, base_version: str, target_version: str, package_builder: PackageBuilder,
+               progress_callback: Optional[Callable] = None, delta_patches: bool = True) -> Optional[Path]:
+        """
+        把基准版本之后到目标版本的所有增量包合并为一个包
+        
+        合并包中只包含每个文件的最终内容，删除的文件记录在包内清单中。
+        
+        Args:
+            base_version: 基准版本（服务端当前的版本）
+            target_version: 目标版本
+            package_builder: 打包器
+            progress_callback: 进度回调函数
+            delta_patches: 修改的文件是否以补丁形式打包
+        
+        Returns:
+            合并包文件，打包失败或被停止时返回None
+        
+        Raises:
+            HistoryError: 版本历史不完整或历史包缺失
+        """
+        output_file = self.output_dir / f"{base_version}-{target_version}.zip"
+        with self._work_dir() as work_dir:
+            plan = self.plan_squash(base_version, target_version, Path(work_dir), delta_patches)
+            package_info = PackageInfo(target_version, base_version, False, plan.deleted)
+            if not package_builder.create_archive_package(output_file, plan.members, progress_callback,
+                                                          package_info):
+                return None
+        return output_file
+
+    def rebuild_full(self, version_str: str, package_builder: PackageBuilder,
+                     progress_callback: Optional[Callable] = None) -> Optional[Path]:
+        """
+        不读取源目录，由历史包重建版本的全量包
+        
+        历史包中有完整内容的文件直接复制压缩数据，不重新压缩。
+        
+        Args:
+            version_str: 版本号
+            package_builder: 打包器
+            progress_callback: 进度回调函数
+        
+        Returns:
+            全量包文件（版本号-full.zip），打包失败或被停止时返回None
+        
+        Raises:
+            HistoryError: 版本历史不完整或历史包缺失
+        """
+        output_file = self.output_dir / f"{version_str}-full.zip"
+        with self._work_dir() as work_dir:
+            members = self.plan_full(version_str, Path(work_dir))
+            if not package_builder.create_archive_package(output_file, members, progress_callback,
+                                                          PackageInfo(version_str, None, True)):
+                return None
+        return output_file
+
+    def _work_dir(self) -> tempfile.TemporaryDirectory:
+        """创建还原文件使用的临时目录（位于缓存目录下）"""
+        work_root = self.version_manager.cache_dir / "history_tmp"
+        work_root.mkdir(parents=True, exist_ok=True)
+        return tempfile.TemporaryDirectory(dir=str(work_root))
+
+
+class _Materializer:
+    """在临时目录中按内容还原历史文件（完整成员直接解压，补丁先还原基准再应用）"""
+
+    def __init__(self, history: PackageHistory, work_dir: Path):
+        self.work_dir = Path(work_dir)
+        self._files: Dict[str, Path] = {}
+        # {sha256: HistoryEntry}，完整内容和补丁分开记录，同一内容取最新版本
+        self._full: Dict[str, HistoryEntry] = {}
+        self._delta: Dict[str, HistoryEntry] = {}
+        for version_info in reversed(history.get_versions()):
+            manifest = history.version_manager.get_manifest(version_info.version)
+            if not manifest:
+                continue
+            package_file = history.get_package_file(version_info.version)
+            for path, entry in manifest.get('files', {}).items():
+                sha256 = entry.get(MANIFEST_ALGORITHM)
+                if sha256:
+                    index = self._delta if 'delta' in entry else self._full
+                    index.setdefault(sha256, HistoryEntry(version_info.version, package_file, path, entry))
+
+    def find_full(self, sha256: str) -> Optional[HistoryEntry]:
+        """查找内容为 sha256 的完整成员"""
+        return self._full.get(sha256)
+
+    def materialize(self, sha256: str, depth: int = 0) -> Path:
+        """
+        还原内容为 sha256 的文件
+        
+        Args:
+            sha256: 文件内容的sha256
+            depth: 补丁链深度（防止清单错误时无限递归）
+        
+        Returns:
+            还原出的文件（同一内容只还原一次）
+        
+        Raises:
+            HistoryError: 历史包中没有该内容或还原结果校验失败
+        """
+        if sha256 in self._files:
+            return self._files[sha256]
+        output_file = self.work_dir / sha256
+
+        item = self._full.get(sha256)
+        try:
+            if item is not None:
+                self._extract(item, output_file)
+            elif sha256 in self._delta and depth < 256:
+                item = self._delta[sha256]
+                base_file = self.materialize(item.entry['delta']['base_' + MANIFEST_ALGORITHM], depth + 1)
+                with zipfile.ZipFile(item.package_file, 'r') as zf:
+                    patch = zf.read(delta_archive_name(item.relative_path))
+                apply_delta(patch, base_file, output_file)
+            else:
+                raise HistoryError(f"历史包中没有文件内容 {sha256}")
+        except (OSError, KeyError, zipfile.BadZipFile, DeltaError) as e:
+            raise HistoryError(f"还原文件失败 {item.relative_path if item else sha256}: {e}")
+
+        self._files[sha256] = output_file
+        return output_file
+
+    @staticmethod
+    def _extract(item: HistoryEntry, output_file: Path):
+        """解压历史包中的完整成员并校验内容"""
+        hasher = new_hasher(MANIFEST_ALGORITHM)
+        with zipfile.ZipFile(item.package_file, 'r') as zf, \
+                zf.open(archive_name(item.relative_path)) as source, open(output_file, 'wb') as target:
+            while True:
+                chunk = source.read(1024 * 1024)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                target.write(chunk)
+        if hasher.hexdigest() != item.entry[MANIFEST_ALGORITHM]:
+            output_file.unlink()
+            raise HistoryError(f"历史包中的文件与清单不一致: {item.relative_path}")
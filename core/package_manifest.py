@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+包内清单模块，每个压缩包末尾写入一份清单，记录各文件的内容hash、大小、CRC、删除的文件和版本信息
+
+清单格式（UTF-8 JSON）：
+    format: 格式版本
+    base_version: 基准版本（全量包为 null）
+    target_version: 目标版本
+    is_full_package: 是否为全量包
+    algorithm: 文件内容hash的算法
+    files: {相对路径（/ 分隔）: {member, hash, size, crc, delta}}
+        member: 压缩包中的成员名称
+        crc: 文件内容的CRC32（旧清单可能没有）
+        delta: 以补丁形式打包时为 {base_hash, patch_size}
+    deleted: 相对基准版本删除的文件（/ 分隔）
+清单描述的包成员（StoredMember、ArchiveMember）也定义在这里，版本管理和打包模块都依赖本模块，互不依赖
+"""
+
+import json
+import os
+import zipfile
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Sequence
+
+from core.digest import MANIFEST_ALGORITHM
+
+# 清单在压缩包中的成员名称
+PACKAGE_MANIFEST_NAME = '_package_manifest.json'
+
+PACKAGE_MANIFEST_FORMAT = 1
+
+
+class PackageInfo(NamedTuple):
+    """写入包内清单的版本信息"""
+    target_version: str
+    base_version: Optional[str] = None
+    is_full_package: bool = False
+    deleted: Sequence[str] = ()  # 相对基准版本删除的文件（相对路径）
+
+
+class StoredMember(NamedTuple):
+    """历史包中已经压缩好的文件"""
+    package_file: Path
+    relative_path: str
+    sha256: str
+    size: int
+    crc: Optional[int] = None  # 打包时记录的CRC32（旧清单没有该字段）
+
+
+class ArchiveMember(NamedTuple):
+    """
+    不读取源目录、由历史包生成压缩包时的一个文件，三种来源之一：
+        package_file: 直接复制该历史包中的成员（entry 带 delta 时为补丁成员，package_path 为成员对应的相对路径）
+        source_file: 压缩该文件（历史包中没有完整内容时还原出的临时文件）
+        patch: 写入重新生成的补丁
+    """
+    relative_path: str
+    entry: dict  # 打包清单记录（sha256、size、crc，补丁为 delta）
+    package_file: Optional[Path] = None
+    source_file: Optional[Path] = None
+    patch: Optional[bytes] = None
+    package_path: Optional[str] = None  # 成员在历史包中的相对路径，默认与 relative_path 相同
+
+
+def to_manifest_path(relative_path: str) -> str:
+    """把本机的相对路径转换为清单中的路径（/ 分隔）"""
+    return relative_path.replace(os.sep, '/')
+
+
+def encode_package_manifest(package_info: PackageInfo, files: Dict[str, dict],
+                            member_names: Dict[str, str]) -> bytes:
+    """
+    生成包内清单
+    
+    Args:
+        package_info: 版本信息
+        files: 打包清单 {相对路径: {'sha256', 'size', 'crc', 'delta'}}
+        member_names: {相对路径: 成员名称}
+    
+    Returns:
+        清单内容
+    """
+    manifest_files = {}
+    for relative_path in sorted(files):
+        entry = files[relative_path]
+        item = {'member': member_names[relative_path], 'hash': entry[MANIFEST_ALGORITHM], 'size': entry['size']}
+        if entry.get('crc') is not None:
+            item['crc'] = entry['crc']
+        if 'delta' in entry:
+            item['delta'] = {'base_hash': entry['delta']['base_' + MANIFEST_ALGORITHM],
+                             'patch_size': entry['delta']['patch_size']}
+        manifest_files[to_manifest_path(relative_path)] = item
+
+    manifest = {
+        'format': PACKAGE_MANIFEST_FORMAT,
+        'base_version': package_info.base_version,
+        'target_version': package_info.target_version,
+        'is_full_package': package_info.is_full_package,
+        'algorithm': MANIFEST_ALGORITHM,
+        'files': manifest_files,
+        'deleted': sorted(to_manifest_path(path) for path in package_info.deleted)
+    }
+    return json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def read_package_manifest(zf: zipfile.ZipFile) -> Optional[dict]:
+    """
+    读取包内清单
+    
+    Args:
+        zf: 以读取模式打开的压缩包
+    
+    Returns:
+        清单字典，没有清单（该功能之前生成的包）或格式不支持时返回None
+    """
+    try:
+        manifest = json.loads(zf.read(PACKAGE_MANIFEST_NAME).decode('utf-8'))
+    except KeyError:
+        return None
+    except (ValueError, zipfile.BadZipFile) as e:
+        print(f"读取包内清单失败: {e}")
+        return None
+    if manifest.get('format') != PACKAGE_MANIFEST_FORMAT:
+        return None
+    return manifest
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+扫描断点模块，保存未完成扫描的部分结果，下次扫描从断点继续
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class ScanCheckpoint:
+    """扫描断点文件（JSON Lines，首行为扫描参数，之后每行一个文件结果，只追加写入）"""
+
+    def __init__(self, checkpoint_file: Path, directory: Path, algorithms: tuple,
+                 flush_interval: float = 2.0):
+        """
+        初始化扫描断点
+        
+        Args:
+            checkpoint_file: 断点文件路径
+            directory: 扫描的目录
+            algorithms: 扫描使用的hash算法，参数不一致的断点不会被使用
+            flush_interval: 写入磁盘的间隔（秒）
+        """
+        self.checkpoint_file = Path(checkpoint_file)
+        self.header = {"directory": str(directory), "algorithms": list(algorithms)}
+        self.flush_interval = flush_interval
+
+        self._file = None
+        self._last_flush = 0.0
+
+    def load(self) -> Dict[str, dict]:
+        """
+        加载上一次未完成扫描的结果
+        
+        Returns:
+            文件信息字典，断点不存在或参数不一致时返回空字典
+        """
+        file_info = {}
+        if not self.checkpoint_file.exists():
+            return file_info
+
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or 'null')
+                if header != self.header:
+                    return file_info
+                for line in f:
+                    try:
+                        relative_path, info = json.loads(line)
+                    except (json.JSONDecodeError, ValueError):
+                        # 中断时可能留下不完整的最后一行
+                        continue
+                    file_info[relative_path] = info
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"加载扫描断点失败: {e}")
+            return {}
+
+        return file_info
+
+    def open(self, resumed: bool):
+        """
+        打开断点文件准备写入
+        
+        Args:
+            resumed: 是否从已有断点继续（继续时追加写入，否则重新创建）
+        """
+        try:
+            self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.checkpoint_file, 'a' if resumed else 'w', encoding='utf-8')
+            if resumed:
+                # 结束上次中断时可能残留的不完整行
+                self._file.write('\n')
+            else:
+                self._file.write(json.dumps(self.header, ensure_ascii=False) + '\n')
+            self._last_flush = time.monotonic()
+        except IOError as e:
+            print(f"创建扫描断点失败: {e}")
+            self._file = None
+
+    def append(self, relative_path: str, info: dict):
+        """追加一个文件结果，按间隔写入磁盘"""
+        if self._file is None:
+            return
+        try:
+            self._file.write(json.dumps([relative_path, info], ensure_ascii=False) + '\n')
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+        except IOError as e:
+            print(f"写入扫描断点失败: {e}")
+
+    def close(self, completed: bool):
+        """
+        关闭断点文件
+        
+        Args:
+            completed: 扫描是否完整结束（完整结束时删除断点）
+        """
+        if self._file is not None:
+            try:
+                self._file.close()
+            except IOError:
+                pass
+            self._file = None
+
+        if completed:
+            self.discard()
+
+    def discard(self):
+        """删除断点文件"""
+        try:
+            if self.checkpoint_file.exists():
+                self.checkpoint_file.unlink()
+        except OSError as e:
+            print(f"删除扫描断点失败: {e}")
+
+
+def has_checkpoint(checkpoint_file: Optional[Path]) -> bool:
+    """判断是否存在未完成扫描的断点"""
+    return bool(checkpoint_file) and Path(checkpoint_file).exists()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+基于 os.scandir 的目录遍历模块
+"""
+
+import os
+from typing import Callable, Iterable, Iterator, Optional, NamedTuple, Union
+
+
+def normalize_relative_path(relative_path: str) -> str:
+    """将配置中的相对路径统一为当前系统的路径分隔符"""
+    return relative_path.replace('\\', os.sep).replace('/', os.sep)
+
+
+class ExcludeMatcher:
+    """预编译的排除规则匹配器，统一处理排除文件、排除文件夹和排除扩展名"""
+
+    def __init__(self,
+                 exclude_files: Iterable[str] = (),
+                 exclude_folders: Iterable[str] = (),
+                 exclude_extensions: Iterable[str] = ()):
+        """
+        初始化匹配器
+        
+        Args:
+            exclude_files: 需要排除的具体文件列表 (相对路径，分隔符不限)
+            exclude_folders: 需要排除的文件夹名称列表
+            exclude_extensions: 需要排除的文件扩展名列表
+        """
+        self.exclude_files = frozenset(normalize_relative_path(path) for path in exclude_files)
+        self.exclude_folders = frozenset(exclude_folders)
+        self.exclude_extensions = frozenset(ext.lower() for ext in exclude_extensions)
+
+    def excludes_dir(self, name: str) -> bool:
+        """目录名是否被排除（被排除的目录不再向下遍历）"""
+        return name in self.exclude_folders
+
+    def excludes_file(self, name: str, relative_path: str) -> bool:
+        """
+        文件是否被排除（不检查父目录，父目录已在遍历时剪枝）
+        
+        Args:
+            name: 文件名
+            relative_path: 文件相对路径
+        """
+        # 与 Path.suffix 一致：以点开头且没有其它点的文件名没有扩展名
+        dot = name.rfind('.')
+        if 0 < dot < len(name) - 1 and name[dot:].lower() in self.exclude_extensions:
+            return True
+        return relative_path in self.exclude_files
+
+    def excludes_path(self, relative_path: str) -> bool:
+        """
+        完整检查一个相对路径（包括各级父目录）
+        
+        Args:
+            relative_path: 文件相对路径
+        """
+        relative_path = normalize_relative_path(relative_path)
+        parts = relative_path.split(os.sep)
+        if any(part in self.exclude_folders for part in parts[:-1]):
+            return True
+        return self.excludes_file(parts[-1], relative_path)
+
+
+class WalkEntry(NamedTuple):
+    """遍历产出的文件条目"""
+    path: str  # 文件绝对路径
+    relative_path: str  # 相对于输入目录的路径
+    stat: os.stat_result  # 复用 DirEntry 的stat结果
+    inode: int  # DirEntry.inode()，Windows下 DirEntry.stat() 的 st_ino 恒为0
+
+
+class WalkDir(NamedTuple):
+    """遍历产出的目录条目（track_dirs 为True时产出）"""
+    relative_path: str  # 目录相对路径
+    mtime_ns: int  # 目录修改时间
+    skipped: bool  # 是否被 skip_dir 跳过（没有列举该目录，其直接文件由调用方沿用旧结果）
+
+
+# skip_dir(目录相对路径, 目录mtime_ns) -> 可以跳过时返回该目录的子目录名称列表，否则返回None
+SkipDirCallback = Callable[[str, int], Optional[Iterable[str]]]
+
+
+def walk_target(directory: str, target_path: str, matcher: ExcludeMatcher,
+                should_stop: Optional[Callable[[], bool]] = None,
+                track_dirs: bool = False,
+                skip_dir: Optional[SkipDirCallback] = None) -> Iterator[Union[WalkEntry, WalkDir]]:
+    """
+    遍历一个目标路径（文件或目录），被排除的目录在进入前剪枝
+    
+    Args:
+        directory: 输入目录
+        target_path: 目标路径 (相对于输入目录)
+        matcher: 排除规则匹配器
+        should_stop: 返回True时立即停止遍历
+        track_dirs: 是否同时产出 WalkDir 目录条目
+        skip_dir: 目录跳过判断（需要 track_dirs），返回子目录列表的目录不再列举，只继续进入其子目录
+    
+    Yields:
+        WalkEntry 文件条目，track_dirs 为True时还有 WalkDir 目录条目
+    """
+    target_path = normalize_relative_path(target_path).strip(os.sep)
+    full_path = os.path.join(directory, target_path)
+
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        print(f"目标路径不存在: {full_path}")
+        return
+
+    parts = target_path.split(os.sep)
+    if os.path.isfile(full_path):
+        if not any(matcher.excludes_dir(part) for part in parts[:-1]) and \
+                not matcher.excludes_file(parts[-1], target_path):
+            yield WalkEntry(full_path, target_path, stat, stat.st_ino)
+        return
+
+    if any(matcher.excludes_dir(part) for part in parts):
+        return
+
+    # 使用显式栈做深度优先遍历，避免递归和 Path 对象分配
+    stack = [(full_path, target_path + os.sep)]
+    while stack:
+        if should_stop and should_stop():
+            return
+
+        current_dir, relative_prefix = stack.pop()
+        try:
+            if track_dirs:
+                relative_dir = relative_prefix[:-1]
+                mtime_ns = os.stat(current_dir).st_mtime_ns
+                sub_names = skip_dir(relative_dir, mtime_ns) if skip_dir else None
+                yield WalkDir(relative_dir, mtime_ns, sub_names is not None)
+                if sub_names is not None:
+                    # 目录mtime未变化，目录项没有增删，只需继续检查子目录
+                    stack.extend((os.path.join(current_dir, name), relative_prefix + name + os.sep)
+                                 for name in sorted(sub_names, reverse=True) if not matcher.excludes_dir(name))
+                    continue
+            with os.scandir(current_dir) as it:
+                sub_dirs = []
+                for entry in it:
+                    name = entry.name
+                    try:
+                        if entry.is_dir():
+                            # 与 os.walk 一致，不进入符号链接目录
+                            if not entry.is_symlink() and not matcher.excludes_dir(name):
+                                sub_dirs.append((entry.path, relative_prefix + name + os.sep))
+                            continue
+                        if not entry.is_file():
+                            continue
+
+                        relative_path = relative_prefix + name
+                        if matcher.excludes_file(name, relative_path):
+                            continue
+                        yield WalkEntry(entry.path, relative_path, entry.stat(), entry.inode())
+                    except OSError as e:
+                        print(f"访问文件失败 {entry.path}: {e}")
+                # 逆序压栈，使子目录按列举顺序遍历
+                stack.extend(reversed(sub_dirs))
+        except OSError as e:
+            print(f"遍历目录失败 {current_dir}: {e}")
+
+
+def iter_target_files(directory: str, target_paths: Iterable[str], matcher: ExcludeMatcher,
+                      should_stop: Optional[Callable[[], bool]] = None,
+                      track_dirs: bool = False,
+                      skip_dir: Optional[SkipDirCallback] = None) -> Iterator[Union[WalkEntry, WalkDir]]:
+    """
+    依次遍历所有目标路径
+    
+    Args:
+        directory: 输入目录
+        target_paths: 目标路径列表 (相对于输入目录)
+        matcher: 排除规则匹配器
+        should_stop: 返回True时立即停止遍历
+        track_dirs: 是否同时产出 WalkDir 目录条目
+        skip_dir: 目录跳过判断，见 walk_target
+    
+    Yields:
+        WalkEntry 文件条目，track_dirs 为True时还有 WalkDir 目录条目
+    """
+    for target_path in target_paths:
+        if should_stop and should_stop():
+            return
+        yield from walk_target(directory, target_path, matcher, should_stop, track_dirs, skip_dir)
+
+
+def collapse_paths(relative_paths: Iterable[str]) -> frozenset:
+    """
+    规范化相对路径集合，并去掉已被其它目录路径包含的路径
+    
+    Args:
+        relative_paths: 相对路径（文件或目录）
+    
+    Returns:
+        互不包含的相对路径集合
+    """
+    paths = {normalize_relative_path(path).strip(os.sep) for path in relative_paths}
+    paths.discard('')
+    return frozenset(path for path in paths if not is_under(path, paths, include_self=False))
+
+
+def is_under(relative_path: str, roots, include_self: bool = True) -> bool:
+    """
+    判断相对路径是否等于或位于某个根路径之下
+    
+    Args:
+        relative_path: 相对路径
+        roots: 根路径集合
+        include_self: 路径本身在集合中时是否算作包含
+    """
+    if include_self and relative_path in roots:
+        return True
+    index = relative_path.find(os.sep)
+    while index != -1:
+        if relative_path[:index] in roots:
+            return True
+        index = relative_path.find(os.sep, index + 1)
+    return False
+
+
+def iter_paths(directory: str, relative_paths: Iterable[str], matcher: ExcludeMatcher,
+               should_stop: Optional[Callable[[], bool]] = None,
+               track_dirs: bool = False) -> Iterator[Union[WalkEntry, WalkDir]]:
+    """
+    只遍历给定的相对路径（文件或目录），已不存在的路径直接跳过
+    
+    Args:
+        directory: 输入目录
+        relative_paths: 相对路径列表，应先经过 collapse_paths 去重
+        matcher: 排除规则匹配器
+        should_stop: 返回True时立即停止遍历
+        track_dirs: 是否同时产出 WalkDir 目录条目
+    
+    Yields:
+        WalkEntry 文件条目，track_dirs 为True时还有 WalkDir 目录条目
+    """
+    for relative_path in relative_paths:
+        if should_stop and should_stop():
+            return
+        if os.path.lexists(os.path.join(directory, relative_path)):
+            yield from walk_target(directory, relative_path, matcher, should_stop, track_dirs)
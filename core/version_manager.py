@@ -8,10 +8,14 @@ import shutil
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from packaging import version
 
+from core.digest import LEGACY_ALGORITHM, MANIFEST_ALGORITHM
+from core.merkle_index import MerkleIndex
+from core.package_manifest import StoredMember
+
 
 @dataclass
 class VersionInfo:
@@ -22,6 +26,7 @@ class VersionInfo:
     total_size: int
     is_full_package: bool
     description: str = ""
+    hash_algorithm: str = LEGACY_ALGORITHM  # 该版本快照使用的hash算法（旧版本记录没有该字段）
 
 
 class VersionManager:
@@ -39,9 +44,12 @@ class VersionManager:
 
         self.versions_file = self.cache_dir / "versions.json"
         self.latest_scan_file = self.cache_dir / "latest_scan.json"
+        self.manifests_dir = self.cache_dir / "manifests"
+        self.latest_index_file = self.cache_dir / "latest_index.json"
 
         self._versions: List[VersionInfo] = []
         self._latest_file_info: Dict[str, dict] = {}
+        self._latest_index: Optional[MerkleIndex] = None
 
         self._load_data()
 
@@ -108,7 +116,9 @@ class VersionManager:
         return f"v{next_version}"
 
     def add_version(self, version_str: str, file_info: Dict[str, dict], new_file_info: Dict[str, dict],
-                    is_full_package: bool = False, description: str = "") -> VersionInfo:
+                    is_full_package: bool = False, description: str = "",
+                    hash_algorithm: str = LEGACY_ALGORITHM,
+                    package_manifest: Optional[Dict[str, dict]] = None) -> VersionInfo:
         """
         添加新版本
         
@@ -118,6 +128,8 @@ class VersionManager:
             new_file_info: 本次版本包含文件信息
             is_full_package: 是否为全量包
             description: 版本描述
+            hash_algorithm: file_info 中hash使用的算法
+            package_manifest: 打包时记录的清单 {相对路径: {'sha256', 'size'}}
             
         Returns:
             版本信息对象
@@ -130,15 +142,139 @@ class VersionManager:
             file_count=len(new_file_info),
             total_size=total_size,
             is_full_package=is_full_package,
-            description=description
+            description=description,
+            hash_algorithm=hash_algorithm
         )
 
         self._versions.append(version_info)
-        self._latest_file_info = file_info.copy()
+        # 相对上一版本删除的文件
+        deleted_files = sorted(set(self._latest_file_info) - set(file_info))
+        # 算法迁移完成后不再需要旧算法的hash
+        self._latest_file_info = {
+            path: {key: value for key, value in info.items() if key != 'legacy_hash'}
+            for path, info in file_info.items()
+        }
+        if package_manifest is not None:
+            self._save_manifest(version_info, new_file_info, package_manifest, deleted_files)
         self._save_data()
 
+        self._latest_index = MerkleIndex.build(self._latest_file_info, hash_algorithm)
+        self._latest_index.save(self.latest_index_file)
+
         return version_info
 
+    def _save_manifest(self, version_info: VersionInfo, new_file_info: Dict[str, dict],
+                       package_manifest: Dict[str, dict], deleted_files: List[str]):
+        """
+        保存版本的打包清单
+        
+        Args:
+            version_info: 版本信息
+            new_file_info: 本次版本包含文件信息
+            package_manifest: 打包时记录的清单
+            deleted_files: 相对上一版本删除的文件
+        """
+        files = {}
+        for path, entry in package_manifest.items():
+            files[path] = dict(entry)
+            if path in new_file_info:
+                files[path]['hash'] = new_file_info[path]['hash']
+
+        manifest = {
+            "version": version_info.version,
+            "hash_algorithm": version_info.hash_algorithm,
+            "is_full_package": version_info.is_full_package,
+            "files": files,
+            "deleted": deleted_files
+        }
+        try:
+            self.manifests_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.get_manifest_file(version_info.version), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+        except IOError as e:
+            print(f"保存打包清单失败: {e}")
+
+    def get_manifest_file(self, version_str: str) -> Path:
+        """获取版本打包清单的文件路径"""
+        return self.manifests_dir / f"{version_str}.json"
+
+    def get_manifest(self, version_str: str) -> Optional[dict]:
+        """
+        获取版本的打包清单
+        
+        Args:
+            version_str: 版本号
+            
+        Returns:
+            清单字典，没有记录时返回None
+        """
+        manifest_file = self.get_manifest_file(version_str)
+        if not manifest_file.exists():
+            return None
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"加载打包清单失败 {version_str}: {e}")
+            return None
+
+    def get_stored_members(self, output_dir: Path, hash_algorithm: str) -> Dict[str, StoredMember]:
+        """
+        根据各版本的打包清单，按内容hash找出历史包中已经压缩好的文件
+        
+        Args:
+            output_dir: 输出目录（历史包为其中的 版本号.zip）
+            hash_algorithm: 当前扫描使用的hash算法，算法不同的清单不会被使用
+            
+        Returns:
+            {内容hash: StoredMember}，相同内容取最新版本的包
+        """
+        stored_members: Dict[str, StoredMember] = {}
+        for version_info in self.get_versions():
+            if version_info.hash_algorithm != hash_algorithm:
+                continue
+            package_file = Path(output_dir) / f"{version_info.version}.zip"
+            if not package_file.exists():
+                continue
+            manifest = self.get_manifest(version_info.version)
+            if not manifest or manifest.get('hash_algorithm') != hash_algorithm:
+                continue
+            for path, entry in manifest.get('files', {}).items():
+                file_hash = entry.get('hash')
+                # 以补丁形式打包的文件在包中没有完整内容
+                if not file_hash or file_hash in stored_members or MANIFEST_ALGORITHM not in entry or \
+                        'delta' in entry:
+                    continue
+                stored_members[file_hash] = StoredMember(
+                    package_file, path, entry[MANIFEST_ALGORITHM], entry['size'], entry.get('crc')
+                )
+        return stored_members
+
+    def get_snapshot_algorithm(self) -> Optional[str]:
+        """获取最新扫描快照使用的hash算法，没有快照时返回None"""
+        if not self._versions or not self._latest_file_info:
+            return None
+        return self._versions[-1].hash_algorithm
+
+    def get_latest_index(self) -> Optional[MerkleIndex]:
+        """
+        获取最新快照的目录索引（旧的缓存没有索引文件时根据快照构建）
+        
+        Returns:
+            目录索引，没有快照时返回None
+        """
+        algorithm = self.get_snapshot_algorithm()
+        if algorithm is None:
+            return None
+        if self._latest_index is None:
+            index = MerkleIndex.load(self.latest_index_file)
+            root = index.get_dir('') if index else None
+            if not root or index.algorithm != algorithm or root['file_count'] != len(self._latest_file_info):
+                index = MerkleIndex.build(self._latest_file_info, algorithm)
+                index.save(self.latest_index_file)
+            self._latest_index = index
+        return self._latest_index
+
     def get_versions(self) -> List[VersionInfo]:
         """获取所有版本"""
         return sorted(self._versions, key=lambda v: version.parse(v.version.lstrip('v')), reverse=True)
@@ -173,7 +309,8 @@ class VersionManager:
         # 修改文件（hash值不同）
         modified = []
         for file_path in new_files_set & old_files:
-            if current_files[file_path]['hash'] != self._latest_file_info[file_path]['hash']:
+            current_info = current_files[file_path]
+            if current_info.get('legacy_hash', current_info['hash']) != self._latest_file_info[file_path]['hash']:
                 modified.append(file_path)
 
         return list(added), modified, list(deleted)
@@ -182,12 +319,17 @@ class VersionManager:
         """重置为全量包模式（清除所有版本信息）"""
         self._versions.clear()
         self._latest_file_info.clear()
+        self._latest_index = None
 
         # 删除缓存文件
         if self.versions_file.exists():
             self.versions_file.unlink()
         if self.latest_scan_file.exists():
             self.latest_scan_file.unlink()
+        if self.latest_index_file.exists():
+            self.latest_index_file.unlink()
+        if self.manifests_dir.exists():
+            shutil.rmtree(self.manifests_dir)
 
     def clear_cache(self):
         """清理缓存目录"""
@@ -196,3 +338,4 @@ class VersionManager:
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self._versions.clear()
         self._latest_file_info.clear()
+        self._latest_index = None
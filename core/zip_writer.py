@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+ZIP 原始成员写入模块，把已经压缩好的 deflate 数据直接写入 zipfile.ZipFile
+"""
+
+import io
+import struct
+import zipfile
+import zlib
+from typing import BinaryIO, Iterable, Optional, Union
+
+# deflate 窗口大小，分块压缩时用前一块末尾的数据作为预设字典
+DEFLATE_WINDOW = 32 * 1024
+
+# 本地文件头（zipfile.structFileHeader）中文件名长度和扩展字段长度的位置
+_FH_FILENAME_LENGTH = 10
+_FH_EXTRA_FIELD_LENGTH = 11
+
+
+def deflate_block(data: bytes, level: int, zdict: bytes = b'', last: bool = True) -> bytes:
+    """
+    把一块数据压缩为原始 deflate 流的一段
+    
+    非最后一块以 Z_SYNC_FLUSH 结束（按字节对齐），最后一块以 Z_FINISH 结束，
+    各块按顺序拼接即为完整的 deflate 流。zdict 为该块之前最多 32KB 的原始数据，使分块压缩率接近整体压缩。
+    
+    Args:
+        data: 原始数据
+        level: 压缩级别
+        zdict: 预设字典（前一块末尾的原始数据）
+        last: 是否为最后一块
+    
+    Returns:
+        压缩后的数据
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _set_compress_level(zinfo: zipfile.ZipInfo, level: int):
+    """设置 ZipFile.open(mode='w') 使用的压缩级别（Python 3.13 起为 compress_level，之前为 _compresslevel）"""
+    for name in ('compress_level', '_compresslevel'):
+        try:
+            setattr(zinfo, name, level)
+            return
+        except AttributeError:
+            continue
+
+
+class _OpenedMember:
+    """
+    通过 ZipFile.open(mode='w') 写入的成员（当前 Python 版本不能直接写入原始数据时使用），由 zipfile 在写入线程中压缩
+    
+    compress_level 不为None时提交的是未压缩的数据；否则提交的是已压缩的 deflate 数据（复制历史包中的成员），
+    先解压再由 zipfile 以默认级别重新压缩。
+    """
+
+    def __init__(self, zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, zip64: bool, compress_level: Optional[int]):
+        if compress_level is not None:
+            _set_compress_level(zinfo, compress_level)
+        self.handle = zf.open(zinfo, 'w', force_zip64=zip64)
+        self.decompressor = zlib.decompressobj(-15) if compress_level is None and \
+            zinfo.compress_type == zipfile.ZIP_DEFLATED else None
+
+    def write(self, data: bytes):
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.handle.write(data)
+
+    def close(self):
+        if self.decompressor is not None:
+            self.handle.write(self.decompressor.flush())
+            if not self.decompressor.eof:
+                raise zipfile.BadZipFile("deflate 数据不完整")
+        self.handle.close()
+
+
+def begin_member(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo,
+                 compress_level: Optional[int] = None) -> Union[bool, _OpenedMember]:
+    """
+    在压缩包末尾写入成员的本地文件头（CRC和大小先写0，finish_member 时回填），与 ZipFile.open(mode='w') 一致
+    
+    RAW_WRITE_SUPPORTED 为False时退回 ZipFile.open(mode='w')。
+    
+    Args:
+        zf: 以写入模式打开的压缩包（输出文件必须可定位）
+        zinfo: 成员信息，file_size 为预期大小，用于决定是否使用 ZIP64
+        compress_level: 不为None时提交未压缩的数据，由 zipfile 以该级别压缩（只能在 RAW_WRITE_SUPPORTED 为False时使用）
+    
+    Returns:
+        成员的写入状态，传给 write_member_data / finish_member / abort_member
+    """
+    # 压缩后可能比原始数据略大
+    zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+    if not RAW_WRITE_SUPPORTED:
+        return _OpenedMember(zf, zinfo, zip64, compress_level)
+    if compress_level is not None:
+        raise ValueError("可以直接写入时应提交已压缩的数据")
+    return _begin_raw_member(zf, zinfo, zip64)
+
+
+def write_member_data(zf: zipfile.ZipFile, member: Union[bool, _OpenedMember], data: bytes):
+    """写入当前成员的一段压缩数据"""
+    if isinstance(member, _OpenedMember):
+        member.write(data)
+    else:
+        zf.fp.write(data)
+
+
+def finish_member(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, member: Union[bool, _OpenedMember],
+                  crc: int, file_size: int, compress_size: int):
+    """
+    结束当前成员：回填本地文件头中的CRC和大小，并登记到中央目录
+    
+    Args:
+        zf: 压缩包
+        zinfo: begin_member 使用的成员信息
+        member: begin_member 的返回值
+        crc: 原始数据的CRC32
+        file_size: 原始数据大小
+        compress_size: 压缩数据大小（退回 ZipFile.open 时以实际写入的大小为准）
+    """
+    if isinstance(member, _OpenedMember):
+        member.close()
+        if zinfo.CRC != crc or zinfo.file_size != file_size:
+            raise zipfile.BadZipFile(f"成员数据与CRC或大小不一致: {zinfo.filename}")
+        return
+
+    zip64 = member
+    try:
+        zinfo.CRC = crc
+        zinfo.file_size = file_size
+        zinfo.compress_size = compress_size
+        if not zip64 and (file_size > zipfile.ZIP64_LIMIT or compress_size > zipfile.ZIP64_LIMIT):
+            raise RuntimeError(f"文件大小超过限制且未使用 ZIP64: {zinfo.filename}")
+
+        zf.start_dir = zf.fp.tell()
+        zf.fp.seek(zinfo.header_offset)
+        zf.fp.write(zinfo.FileHeader(zip64))
+        zf.fp.seek(zf.start_dir)
+
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+    finally:
+        zf._writing = False
+
+
+def abort_member(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, member: Union[bool, _OpenedMember]):
+    """
+    放弃当前成员，截断已写入的数据
+    
+    退回 ZipFile.open 时无法截断，只从中央目录中去掉该成员，已写入的数据留在压缩包中不被引用。
+    """
+    if isinstance(member, _OpenedMember):
+        try:
+            member.handle.close()
+        finally:
+            if zinfo in zf.filelist:
+                zf.filelist.remove(zinfo)
+                zf.NameToInfo.pop(zinfo.filename, None)
+        return
+
+    try:
+        zf.fp.seek(zinfo.header_offset)
+        zf.fp.truncate()
+        zf.start_dir = zinfo.header_offset
+    finally:
+        zf._writing = False
+
+
+def write_raw_member(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, chunks: Iterable[bytes],
+                     crc: int, file_size: int):
+    """
+    写入一个已经完整压缩好的成员
+    
+    Args:
+        zf: 压缩包
+        zinfo: 成员信息（compress_type 必须与数据一致）
+        chunks: 压缩数据
+        crc: 原始数据的CRC32
+        file_size: 原始数据大小
+    """
+    zinfo.file_size = file_size
+    member = begin_member(zf, zinfo)
+    compress_size = 0
+    try:
+        for chunk in chunks:
+            write_member_data(zf, member, chunk)
+            compress_size += len(chunk)
+    except BaseException:
+        abort_member(zf, zinfo, member)
+        raise
+    finish_member(zf, zinfo, member, crc, file_size, compress_size)
+
+
+def _begin_raw_member(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, zip64: bool) -> bool:
+    """直接写入本地文件头（依赖 ZipFile 的内部属性，由 _check_raw_write 确认可用）"""
+    if zf._writing:
+        raise ValueError("压缩包正在写入其它成员")
+
+    zinfo.compress_size = 0
+    zinfo.CRC = 0
+    zinfo.flag_bits = 0x00
+    if not zinfo.external_attr:
+        zinfo.external_attr = 0o600 << 16
+
+    if zip64 and not zf._allowZip64:
+        raise zipfile.LargeZipFile("文件大小需要 ZIP64 扩展")
+
+    zf.fp.seek(zf.start_dir)
+    zinfo.header_offset = zf.fp.tell()
+    zf._writecheck(zinfo)
+    zf._didModify = True
+    zf.fp.write(zinfo.FileHeader(zip64))
+    zf._writing = True
+    return zip64
+
+
+def _check_raw_write() -> bool:
+    """
+    检查当前 Python 版本的 zipfile 是否支持直接写入原始数据
+    
+    直接写入依赖 ZipFile 的内部属性（_writing、_writecheck、_didModify、start_dir、_allowZip64），
+    这里在内存中写入一个分块压缩的成员，读回校验通过才使用，否则退回 ZipFile.open(mode='w')。
+    """
+    data = b'zip writer check ' * 4096
+    half = len(data) // 2
+    chunks = [deflate_block(data[:half], 6, last=False),
+              deflate_block(data[half:], 6, data[half - DEFLATE_WINDOW:half])]
+    buffer = io.BytesIO()
+    try:
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            if not all(hasattr(zf, name) for name in ('_writing', '_writecheck', '_didModify', 'start_dir',
+                                                      '_allowZip64')):
+                return False
+            zinfo = zipfile.ZipInfo('check.txt')
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo.file_size = len(data)
+            zip64 = _begin_raw_member(zf, zinfo, False)
+            for chunk in chunks:
+                write_member_data(zf, zip64, chunk)
+            finish_member(zf, zinfo, zip64, zlib.crc32(data), len(data), sum(len(chunk) for chunk in chunks))
+        with zipfile.ZipFile(buffer) as zf:
+            return zf.testzip() is None and zf.read('check.txt') == data
+    except Exception:
+        return False
+
+
+# 当前 Python 版本能否直接写入已压缩的数据，否则 begin_member 退回 ZipFile.open(mode='w')
+RAW_WRITE_SUPPORTED = _check_raw_write()
+if not RAW_WRITE_SUPPORTED:
+    print("当前 Python 版本的 zipfile 不支持直接写入压缩数据，打包时改为在写入线程中压缩（不再并行）")
+
+
+def raw_data_offset(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo) -> int:
+    """
+    获取成员压缩数据在压缩包文件中的起始位置（校验本地文件头）
+    
+    Args:
+        zf: 以读取模式打开的压缩包
+        zinfo: 成员信息
+    
+    Returns:
+        压缩数据的起始偏移
+    """
+    if zinfo.flag_bits & 0x1:
+        raise zipfile.BadZipFile(f"不支持加密的成员: {zinfo.filename}")
+    zf.fp.seek(zinfo.header_offset)
+    header = zf.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"本地文件头错误: {zinfo.filename}")
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    return (zinfo.header_offset + zipfile.sizeFileHeader +
+            fields[_FH_FILENAME_LENGTH] + fields[_FH_EXTRA_FIELD_LENGTH])
+
+
+def iter_raw_data(fp: BinaryIO, offset: int, size: int, chunk_size: int = 1024 * 1024) -> Iterable[bytes]:
+    """
+    按块读取成员的原始压缩数据（不解压）
+    
+    Args:
+        fp: 压缩包文件对象
+        offset: raw_data_offset 的返回值
+        size: 压缩数据大小（compress_size）
+        chunk_size: 每次读取的大小
+    """
+    fp.seek(offset)
+    remaining = size
+    while remaining:
+        chunk = fp.read(min(chunk_size, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile("成员数据不完整")
+        remaining -= len(chunk)
+        yield chunk
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+多区部署模块，把更新包一次解压到按内容寻址的暂存区，再克隆（reflink / 硬链接 / 复制）到同一台机器上的多个区目录
+"""
+
+import argparse
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from core.delta import DeltaError
+from core.file_clone import CLONE_MODES, FileCloner
+from core.package_applier import ApplyError, ApplyReport, PackageChain, VerifyReport, check_files, \
+    file_matches, run_staged, server_path, stage_file
+
+
+@dataclass
+class ZoneReport:
+    """一个区的部署结果"""
+    zone_dir: Path
+    apply: ApplyReport = field(default_factory=ApplyReport)
+    verify: Optional[VerifyReport] = None  # 部署后的校验结果，不校验时为None
+    methods: Dict[str, int] = field(default_factory=dict)  # {克隆方式: 文件数}
+
+    @property
+    def ok(self) -> bool:
+        return not self.apply.failed and (self.verify is None or self.verify.ok)
+
+
+class ZoneDeployer:
+    """
+    多区部署器
+    
+    1. 并行比较各区文件，找出每个区需要更新的文件；
+    2. 需要的每种内容（按sha256）只生成一次，写入暂存区 objects/<hash前2位>/<hash>：
+       完整成员解压，补丁以任一需要更新的区中的现有文件为基准还原；
+    3. 各区并行把暂存区的文件克隆到区目录下的临时文件，全部成功后重命名替换并删除文件（每个区单独保证完整性）；
+    4. 可选地按清单校验每个区。
+    暂存区必须与区目录在同一文件系统上才能使用 reflink 和硬链接。
+    默认只使用 reflink（不支持时复制），各区的文件互不影响；auto 模式还会尝试硬链接，
+    硬链接的文件在各区之间共享同一份数据，服务端原地修改一个区的文件会影响所有区，只应在确认不会原地修改时显式指定。
+    """
+
+    def __init__(self, link_mode: str = 'reflink', deep: bool = False, max_workers: Optional[int] = None):
+        """
+        初始化部署器
+        
+        Args:
+            link_mode: 克隆模式，见 core.file_clone.CLONE_MODES；默认不使用硬链接
+            deep: 比较文件时使用sha256（默认比较大小和CRC32）
+            max_workers: 并行线程数，默认为 CPU 核心数（最多8）
+        """
+        self.cloner = FileCloner(link_mode)
+        self.deep = deep
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_object_file(staging_dir: Path, file_hash: str) -> Path:
+        """获取内容在暂存区中的文件"""
+        return Path(staging_dir) / 'objects' / file_hash[:2] / file_hash
+
+    def deploy(self, package_files: Sequence[Path], zone_dirs: Sequence[Path], staging_dir: Path,
+               progress_callback: Optional[Callable] = None, verify: bool = True,
+               keep_staging: bool = False) -> List[ZoneReport]:
+        """
+        把连续的一个或多个包部署到多个区目录
+        
+        Args:
+            package_files: 压缩包列表（按版本顺序）
+            zone_dirs: 区目录列表（各区的 MirServer 目录）
+            staging_dir: 暂存区目录
+            progress_callback: 进度回调函数 (区目录, 已完成文件数, 总文件数)
+            verify: 部署后是否按清单校验每个区
+            keep_staging: 是否保留本次生成的暂存文件（默认部署后删除）
+        
+        Returns:
+            与 zone_dirs 顺序一致的部署结果
+        
+        Raises:
+            ApplyError: 没有包内清单、清单与压缩包不一致或包不连续
+        """
+        zone_dirs = [Path(zone_dir) for zone_dir in zone_dirs]
+        reports = [ZoneReport(zone_dir) for zone_dir in zone_dirs]
+        created: List[Path] = []
+        sources: Dict[str, tuple] = {}
+
+        with PackageChain(package_files) as chain:
+            # 各区需要更新的文件
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                needs = list(pool.map(lambda zone_dir: [
+                    path for path in chain.plans
+                    if not file_matches(server_path(zone_dir, path), chain.plans[path].item, self.deep)
+                ], zone_dirs))
+            for report, zone_needs in zip(reports, needs):
+                report.apply.skipped = sorted(set(chain.plans) - set(zone_needs))
+
+            # 每种内容只生成一次，补丁的基准可以取任一需要更新该文件的区
+            for zone_dir, zone_needs in zip(zone_dirs, needs):
+                for path in zone_needs:
+                    file_hash = chain.plans[path].item['hash']
+                    source_path, bases = sources.setdefault(file_hash, (path, []))
+                    if path == source_path:
+                        bases.append(server_path(zone_dir, path))
+
+            stage_errors: Dict[str, str] = {}
+
+            def stage_object(file_hash: str):
+                path, bases = sources[file_hash]
+                try:
+                    if self._stage_object(chain, path, bases, self.get_object_file(staging_dir, file_hash)):
+                        with self._lock:
+                            created.append(self.get_object_file(staging_dir, file_hash))
+                except (OSError, KeyError, DeltaError) as e:
+                    stage_errors[file_hash] = str(e)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                list(pool.map(stage_object, sources))
+
+            # 各区并行克隆
+            def deploy_zone(index: int):
+                zone_dir, report = zone_dirs[index], reports[index]
+
+                def stage(path: str) -> str:
+                    file_hash = chain.plans[path].item['hash']
+                    if file_hash in stage_errors:
+                        raise OSError(f"暂存失败: {stage_errors[file_hash]}")
+                    return self._clone(self.get_object_file(staging_dir, file_hash),
+                                       server_path(zone_dir, path), report)
+
+                zone_progress = (lambda done, total: progress_callback(zone_dir, done, total)) \
+                    if progress_callback else None
+                result = run_staged(needs[index], chain.deleted, zone_dir, stage, self.max_workers, zone_progress)
+                report.apply.written = result.written
+                report.apply.deleted = result.deleted
+                report.apply.failed = result.failed
+                if verify:
+                    report.verify = check_files(chain.files, chain.deleted, zone_dir, self.deep)
+
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(zone_dirs)))) as pool:
+                list(pool.map(deploy_zone, range(len(zone_dirs))))
+
+        if not keep_staging:
+            for object_file in created:
+                try:
+                    object_file.unlink()
+                except OSError:
+                    pass
+            # 目录为空时一并删除
+            object_dirs = {self.get_object_file(staging_dir, file_hash).parent for file_hash in sources}
+            for directory in sorted(object_dirs) + [Path(staging_dir) / 'objects', Path(staging_dir)]:
+                try:
+                    directory.rmdir()
+                except OSError:
+                    pass
+        return reports
+
+    def _stage_object(self, chain: PackageChain, path: str, bases: List[Path], object_file: Path) -> bool:
+        """
+        生成暂存区中的文件
+        
+        Returns:
+            是否新生成（暂存区中已有一致的文件时返回False）
+        """
+        plan = chain.plans[path]
+        if file_matches(object_file, plan.item, self.deep):
+            return False
+        object_file.parent.mkdir(parents=True, exist_ok=True)
+
+        error = None
+        for base_file in (bases if plan.needs_base else [None]):
+            try:
+                temp_path = stage_file(object_file, lambda temp: chain.build_content(plan, base_file, temp))
+                os.replace(temp_path, object_file)
+                return True
+            except DeltaError as e:
+                # 该区的文件不是补丁的基准，换下一个区
+                error = e
+        raise error
+
+    def _clone(self, object_file: Path, target_file: Path, report: ZoneReport) -> str:
+        """把暂存区的文件克隆到目标文件同目录的临时文件，返回临时文件路径"""
+        target_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = target_file.parent / f".{target_file.name}.{uuid.uuid4().hex}.tmp"
+        method = self.cloner.clone(object_file, temp_path)
+        with self._lock:
+            report.methods[method] = report.methods.get(method, 0) + 1
+        return str(temp_path)
+
+
+def main(argv=None) -> int:
+    """命令行入口：python -m core.zone_deployer <压缩包...> --zones <区目录...>"""
+    parser = argparse.ArgumentParser(prog='python -m core.zone_deployer', description='把更新包部署到多个区目录')
+    parser.add_argument('packages', nargs='+', help='压缩包文件（按版本顺序）')
+    parser.add_argument('--zones', nargs='+', required=True, help='区目录（各区的 MirServer 目录）')
+    parser.add_argument('--staging', help='暂存区目录，需与区目录在同一文件系统（默认为第一个区的上级目录下的 .mir_staging）')
+    parser.add_argument('--link', choices=list(CLONE_MODES), default='reflink',
+                        help='克隆模式：reflink（默认）不支持时复制，各区互不影响；auto 依次尝试 reflink、硬链接、复制，'
+                             '硬链接的文件各区共享数据，原地修改会影响所有区；copy 只复制')
+    parser.add_argument('--keep-staging', action='store_true', help='保留暂存区中的文件')
+    parser.add_argument('--no-verify', action='store_true', help='部署后不校验')
+    parser.add_argument('--deep', action='store_true', help='比较sha256（默认比较大小和CRC32）')
+    parser.add_argument('--workers', type=int, default=None, help='并行线程数')
+
+    args = parser.parse_args(argv)
+    staging_dir = Path(args.staging) if args.staging else Path(args.zones[0]).resolve().parent / '.mir_staging'
+    deployer = ZoneDeployer(args.link, args.deep, args.workers)
+    try:
+        reports = deployer.deploy([Path(package) for package in args.packages], [Path(zone) for zone in args.zones],
+                                  staging_dir, verify=not args.no_verify, keep_staging=args.keep_staging)
+    except (ApplyError, OSError) as e:
+        print(f"处理压缩包失败: {e}")
+        return 1
+
+    method_names = {'reflink': 'reflink', 'hardlink': '硬链接', 'copy': '复制'}
+    for report in reports:
+        for path, reason in report.apply.failed.items():
+            print(f"[{report.zone_dir}] 部署失败 {path}: {reason}")
+        methods = '，'.join(f"{method_names[method]} {count} 个" for method, count in sorted(report.methods.items()))
+        verify_text = '未校验' if report.verify is None else \
+            ('校验通过' if report.verify.ok else
+             f"校验失败（缺少 {len(report.verify.missing)} 个，不一致 {len(report.verify.mismatched)} 个，"
+             f"未删除 {len(report.verify.leftover)} 个）")
+        print(f"[{report.zone_dir}] 写入 {len(report.apply.written)} 个，跳过 {len(report.apply.skipped)} 个，"
+              f"删除 {len(report.apply.deleted)} 个，失败 {len(report.apply.failed)} 个"
+              f"{'（' + methods + '）' if methods else ''}，{verify_text}")
+    return 0 if all(report.ok for report in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,17 +4,25 @@
 """
 import threading
 import tkinter as tk
+from datetime import datetime
 from pathlib import Path
 from tkinter import ttk, filedialog, messagebox
 from typing import Optional
 
 import customtkinter as ctk
 
+from core.change_watcher import ChangeWatcher
 from core.config_manager import ConfigManager
+from core.digest import DEFAULT_ALGORITHM
 from core.file_comparator import FileComparator, ChangeType
 from core.file_scanner import FileScanner
+from core.merkle_index import MerkleIndex
 from core.make_win_center import center_on_screen, set_win_icon, get_windows_scaling_simple
 from core.package_builder import PackageBuilder
+from core.package_history import PackageHistory
+from core.package_manifest import PackageInfo
+from core.scan_checkpoint import has_checkpoint
+from core.scan_walker import ExcludeMatcher
 from core.version_manager import VersionManager
 from gui.file_list_window import FileListWindow
 
@@ -61,17 +69,26 @@ class IncrementalPackerApp:
         self.current_version = tk.StringVar(value="v1.0.0")
         self.status_text = tk.StringVar(value="就绪")
         self.version_choice = tk.StringVar()  # 版本选择下拉框的值
+        self.deep_verify = tk.BooleanVar(value=False)  # 深度校验（强制重新计算所有hash）
 
         # 核心组件
-        self.file_scanner = FileScanner()
+        scan_options = self.config.get_scan_options()
+        self.file_scanner = FileScanner(
+            hash_backend=scan_options.get("hash_backend", "auto"),
+            hash_algorithm=scan_options.get("hash_algorithm", DEFAULT_ALGORITHM)
+        )
         self.version_manager: Optional[VersionManager] = None
+        self.change_watcher: Optional[ChangeWatcher] = None
         self.package_builder = PackageBuilder()
         self.file_comparator = FileComparator()
+        self._cache_gc_thread: Optional[threading.Thread] = None  # 后台清理缓存的线程
+        self._cache_gc_stop = threading.Event()
 
         # 工作状态
         self.is_scanning = False
         self.is_building = False
         self.current_file_info = {}
+        self.scan_index: Optional[MerkleIndex] = None  # 最近一次扫描结果的目录索引
         self.file_changes = []
 
         # 子窗口
@@ -217,6 +234,13 @@ class IncrementalPackerApp:
         )
         self.view_changes_btn.pack(side="left", padx=5)
 
+        self.deep_verify_checkbox = ctk.CTkCheckBox(
+            row1_frame,
+            text="深度校验",
+            variable=self.deep_verify
+        )
+        self.deep_verify_checkbox.pack(side="left", padx=5)
+
         # 第二行按钮
         row2_frame = ctk.CTkFrame(action_frame)
         row2_frame.pack(fill="x", padx=5, pady=5)
@@ -350,6 +374,8 @@ class IncrementalPackerApp:
         """目录变更事件处理"""
         # 保存配置
         self._save_current_config()
+        self.current_file_info = {}
+        self.scan_index = None
         self.view_changes_btn.configure(state="disabled")
         self.package_btn.configure(state="disabled")
 
@@ -358,12 +384,28 @@ class IncrementalPackerApp:
             cache_dir = Path(self.output_dir.get()) / "cache"
             self.version_manager = VersionManager(cache_dir)
 
-            # 初始化文件缓存管理器（使用输出目录下的cache）
+            # 初始化文件缓存管理器（使用输出目录下的cache），先停止旧管理器的后台清理，同一缓存目录只有一个管理器在写
+            self._stop_cache_gc()
             from core.file_cache_manager import FileCacheManager
-            cache_manager = FileCacheManager.create_for_output_dir(Path(self.output_dir.get()))
+            cache_options = self.config.get_cache_options()
+            cache_manager = FileCacheManager.create_for_output_dir(
+                Path(self.output_dir.get()), self.file_scanner.hash_algorithm,
+                compress=cache_options.get("compress", True),
+                delta_text=cache_options.get("delta_text", False),
+                max_delta_chain=cache_options.get("max_delta_chain", 8)
+            )
 
             # 重新初始化打包构建器，传入新的缓存管理器
-            self.package_builder = PackageBuilder(cache_manager)
+            self.package_builder = PackageBuilder(
+                cache_manager,
+                adaptive_compression=self.config.get_package_options().get("adaptive_compression", True)
+            )
+
+            self._start_change_watcher()
+
+            # 上一次扫描的目录索引（按目录mtime跳过未变化的目录）
+            if self.config.get_scan_options().get("trust_directory_mtime", False):
+                self.scan_index = MerkleIndex.load(cache_dir / "scan_index.json")
 
             # 更新版本显示
             next_version = self.version_manager.get_next_version()
@@ -374,11 +416,38 @@ class IncrementalPackerApp:
             self.reset_btn.configure(state="normal")
             self.status_text.set("就绪，请点击'扫描文件'开始")
         else:
+            self._stop_change_watcher()
             self.current_version.set("v1.0.0")
             self.scan_btn.configure(state="disabled")
             self.reset_btn.configure(state="disabled")
             self.status_text.set("请选择输入和输出目录")
 
+    def _start_change_watcher(self):
+        """按配置启动输入目录的变更监控"""
+        self._stop_change_watcher()
+        scan_options = self.config.get_scan_options()
+        if not scan_options.get("change_tracking", False):
+            return
+
+        input_path = Path(self.input_dir.get())
+        if not input_path.is_dir():
+            return
+        self.change_watcher = ChangeWatcher(
+            input_path,
+            self.file_scanner.target_paths,
+            ExcludeMatcher(self.file_scanner.exclude_files, self.file_scanner.exclude_folders,
+                           self.file_scanner.exclude_extensions),
+            state_file=Path(self.output_dir.get()) / "cache" / "change_watcher.json",
+            backend=scan_options.get("watch_backend", "auto")
+        )
+        self.change_watcher.start()
+
+    def _stop_change_watcher(self):
+        """停止变更监控"""
+        if self.change_watcher:
+            self.change_watcher.stop()
+            self.change_watcher = None
+
     def _start_scan(self):
         """开始扫描文件"""
         if self.is_scanning:
@@ -416,18 +485,79 @@ class IncrementalPackerApp:
                     text=f"正在扫描: {current}/{total} 个文件"
                 ))
 
-            self.root.after(0, lambda: self.status_text.set("正在扫描文件..."))
+            # 增量扫描：复用上次打包快照和本次会话中最近一次扫描的hash
+            current_index = self.config.get_current_version_index()
+            deep_verify = self.deep_verify.get() or self.config.is_deep_verify_due(current_index)
+            # 快照使用的hash算法与当前不同时，扫描器会同时计算旧算法的hash用于对比（迁移）
+            previous_algorithm = self.version_manager.get_snapshot_algorithm()
+            previous_files = self.version_manager.get_latest_file_info()
+            if previous_algorithm in (None, self.file_scanner.hash_algorithm):
+                previous_files.update(self.current_file_info)
+            scan_options = self.config.get_scan_options()
+            reuse_hashes = scan_options.get("incremental_scan", True) and not deep_verify
+
+            # 变更监控：监控可信且未到定期完整遍历时，只扫描变化的文件，其余沿用本次会话最近一次的扫描结果
+            watcher = self.change_watcher
+            dirty_paths = None
+            watch_token = None
+            if watcher:
+                full_scan_interval = scan_options.get("full_scan_interval_minutes", 60) * 60
+                use_dirty = reuse_hashes and bool(self.current_file_info) and watcher.is_trusted() and \
+                    not watcher.needs_full_scan(full_scan_interval)
+                taken_paths, watch_token = watcher.take_dirty()
+                if use_dirty:
+                    dirty_paths = taken_paths
+                    previous_files = dict(self.current_file_info)
+
+            # 按目录mtime跳过未变化的目录
+            directory_index = None
+            if scan_options.get("trust_directory_mtime", False) and dirty_paths is None:
+                directory_index = self.scan_index
+
+            # 扫描断点：停止扫描时保留已完成的结果，下次扫描从断点继续
+            checkpoint_file = Path(self.output_dir.get()) / "cache" / "scan_checkpoint.jsonl"
+            scan_text = "正在深度校验文件..." if deep_verify else "正在扫描文件..."
+            if dirty_paths is not None:
+                scan_text = f"正在扫描变化的文件（{len(dirty_paths)} 处变化）..."
+            if has_checkpoint(checkpoint_file):
+                scan_text = "正在从断点继续扫描..."
+            self.root.after(0, lambda: self.status_text.set(scan_text))
 
             # 扫描文件
-            file_info = self.file_scanner.scan_directory(input_path, progress_callback)
+            try:
+                file_info = self.file_scanner.scan_directory(
+                    input_path, progress_callback,
+                    previous_files=previous_files, deep_verify=not reuse_hashes,
+                    previous_algorithm=previous_algorithm, checkpoint_file=checkpoint_file,
+                    dirty_paths=dirty_paths, directory_index=directory_index,
+                    track_dirs=scan_options.get("trust_directory_mtime", False)
+                )
+            except Exception:
+                if watcher:
+                    watcher.restore(taken_paths)
+                raise
 
             if not file_info:  # 扫描被取消或失败
+                if watcher:
+                    watcher.restore(taken_paths)
                 self.root.after(0, self._on_scan_cancelled)
                 return
 
-            # 对比文件变化
+            if watcher and dirty_paths is None:
+                watcher.mark_baseline(watch_token)
+
+            if deep_verify:
+                self.config.set_last_deep_verify(datetime.now().isoformat(), current_index)
+
+            self.scan_index = self.file_scanner.last_scan_index
+            if scan_options.get("trust_directory_mtime", False) and self.scan_index:
+                self.scan_index.save(Path(self.output_dir.get()) / "cache" / "scan_index.json")
+
+            # 对比文件变化（目录索引一致的子树直接跳过）
             old_files = self.version_manager.get_latest_file_info()
-            changes = self.file_comparator.compare_file_lists(old_files, file_info)
+            changes = self.file_comparator.compare_file_lists(
+                old_files, file_info, self.version_manager.get_latest_index(), self.scan_index
+            )
 
             # 更新UI
             self.root.after(0, lambda: self._on_scan_completed(file_info, changes))
@@ -449,12 +579,22 @@ class IncrementalPackerApp:
 
         # 更新状态
         change_count = len(changes)
+        hashed_count = self.file_scanner.last_scan_stats['hashed']
         if change_count == 0:
             self.status_text.set("扫描完成，没有发现文件变化")
-            self.progress_label.configure(text=f"扫描完成: 总计 {len(file_info)} 个文件，无变化")
+            self.progress_label.configure(
+                text=f"扫描完成: 总计 {len(file_info)} 个文件，重新计算 {hashed_count} 个，无变化"
+            )
         else:
-            self.status_text.set(f"扫描完成，发现 {change_count} 个文件变化")
-            self.progress_label.configure(text=f"扫描完成: 总计 {len(file_info)} 个文件，{change_count} 个变化")
+            # 按目录汇总变化，显示变化最多的几个目录
+            rollup = self.file_comparator.get_directory_rollup(changes)
+            top_dirs = sorted(rollup.items(), key=lambda item: (-item[1], item[0]))[:3]
+            dir_summary = "，".join(f"{path} {count} 个" for path, count in top_dirs)
+            self.status_text.set(f"扫描完成，发现 {change_count} 个文件变化" +
+                                 (f"（{dir_summary}）" if dir_summary else ""))
+            self.progress_label.configure(
+                text=f"扫描完成: 总计 {len(file_info)} 个文件，重新计算 {hashed_count} 个，{change_count} 个变化"
+            )
             self.view_changes_btn.configure(state="normal")
 
     def _on_scan_cancelled(self):
@@ -465,7 +605,7 @@ class IncrementalPackerApp:
 
         self.progress_bar.set(0)
         self.progress_label.configure(text="")
-        self.status_text.set("扫描已取消")
+        self.status_text.set("扫描已取消，已保存断点，下次扫描将从断点继续")
 
     def _on_scan_error(self, error_msg):
         """扫描错误回调"""
@@ -577,12 +717,39 @@ class IncrementalPackerApp:
 
             self.root.after(0, lambda: self.status_text.set(f"正在创建{package_type}包..."))
 
-            # 创建包
+            # 创建包（未变化的文件直接复制历史包中的压缩数据）
+            stored_members = self.version_manager.get_stored_members(output_path, self.file_scanner.hash_algorithm)
+
+            # 增量包中修改的文件以补丁形式打包（基准为上一版本的内容）
+            delta_bases = {}
+            if not is_full and self.config.get_package_options().get("delta_patches", False):
+                latest_file_info = self.version_manager.get_latest_file_info()
+                delta_bases = {
+                    key: latest_file_info[key]['hash'] for key in files_to_package if key in latest_file_info
+                }
+
+            # 包内清单记录基准版本和删除的文件，服务端据此校验和应用
+            versions = self.version_manager.get_versions()
+            deleted_files = [] if is_full else [
+                change.file_path for change in self.file_changes if change.change_type == ChangeType.DELETED
+            ]
+            package_info = PackageInfo(version, None if is_full or not versions else versions[0].version,
+                                       is_full, deleted_files)
+
             success = self.package_builder.create_package(
-                input_path, package_file, files_to_package, progress_callback
+                input_path, package_file, files_to_package, progress_callback, self.current_file_info,
+                stored_members, delta_bases, package_info
             )
 
             if success:
+                # 扫描后又被修改的文件按打包时的内容记录，并清除stat信息，下次扫描时重新计算hash
+                for key, packaged_hash in self.package_builder.last_changed_files.items():
+                    info = dict(self.current_file_info[key])
+                    info['hash'] = packaged_hash
+                    info.pop('legacy_hash', None)
+                    info.pop('mtime_ns', None)
+                    self.current_file_info[key] = info
+
                 new_file_info = {}
                 for key in self.current_file_info:
                     if key in files_to_package:
@@ -590,8 +757,10 @@ class IncrementalPackerApp:
                 # 保存版本信息
                 self.version_manager.add_version(
                     version, self.current_file_info, new_file_info,is_full,
-                    f"{package_type}包"
+                    f"{package_type}包", self.file_scanner.hash_algorithm,
+                    self.package_builder.last_manifest
                 )
+                self._start_cache_gc()
 
                 # 更新UI
                 self.root.after(0, lambda: self._on_package_completed(package_file, package_type))
@@ -601,6 +770,41 @@ class IncrementalPackerApp:
         except Exception as e:
             self.root.after(0, lambda: self._on_package_error(str(e), package_type))
 
+    def _start_cache_gc(self):
+        """打包完成后在后台清理缓存（删除不再引用的缓存文件，按配置裁剪版本和预算）"""
+        self._stop_cache_gc()
+        cache_options = self.config.get_cache_options()
+        cache_manager = self.package_builder.cache_manager
+        stop_event = threading.Event()
+
+        def collect():
+            try:
+                report = cache_manager.collect_garbage(
+                    cache_options.get("max_size_mb", 0) * 1024 * 1024,
+                    cache_options.get("keep_versions", 0),
+                    cache_options.get("max_age_days", 0),
+                    should_stop=stop_event.is_set
+                )
+            except Exception as e:
+                print(f"清理缓存失败: {e}")
+                return
+            if report.removed_blobs:
+                print(f"清理缓存: 删除 {report.removed_blobs} 个缓存文件，"
+                      f"释放 {report.reclaimed_bytes / 1024 / 1024:.2f} MB，"
+                      f"剩余 {report.stored_bytes / 1024 / 1024:.2f} MB")
+
+        self._cache_gc_stop = stop_event
+        self._cache_gc_thread = threading.Thread(target=collect, daemon=True)
+        self._cache_gc_thread.start()
+
+    def _stop_cache_gc(self):
+        """停止后台清理缓存并等待其结束（替换或清空缓存管理器、退出前调用）"""
+        thread = self._cache_gc_thread
+        if thread and thread.is_alive():
+            self._cache_gc_stop.set()
+            thread.join()
+        self._cache_gc_thread = None
+
     def _on_package_completed(self, package_file, package_type):
         """打包完成回调"""
         self.is_building = False
@@ -632,6 +836,18 @@ class IncrementalPackerApp:
                       f"文件: {package_file.name}\n" \
                       f"大小: {size_info}\n" \
                       f"文件数: {package_info['file_count']}"
+            delta_files = self.package_builder.last_delta_files
+            if delta_files:
+                patch_kb = sum(item['patch_size'] for item in delta_files.values()) / 1024
+                full_kb = sum(item['size'] for item in delta_files.values()) / 1024
+                message += f"\n其中 {len(delta_files)} 个文件以补丁形式打包（{patch_kb:.2f} KB，原文件 {full_kb:.2f} KB），" \
+                           f"服务端需执行 python -m core.package_applier apply {package_file.name} <MirServer目录> 更新"
+            reused_count = self.package_builder.last_reused_count
+            if reused_count:
+                message += f"\n其中 {reused_count} 个文件直接复用历史包的压缩数据"
+            changed_count = len(self.package_builder.last_changed_files)
+            if changed_count:
+                message += f"\n注意: {changed_count} 个文件在扫描后发生变化，已按打包时的内容记录"
             messagebox.showinfo("成功", message)
             self.status_text.set(f"{package_type}包创建成功: {package_file.name}")
         else:
@@ -663,6 +879,7 @@ class IncrementalPackerApp:
         if messagebox.askyesno("确认", "是否重置所有版本信息？\n这将清除所有版本历史和缓存数据。"):
             if self.version_manager:
                 self.version_manager.reset_to_full_package()
+                self._stop_cache_gc()
                 self.package_builder.cache_manager.clear_cache()
                 self.current_version.set("v1.0.0")
                 self.file_changes = []
@@ -715,8 +932,142 @@ class IncrementalPackerApp:
                 f"{size_info}"
             ))
 
+        # 合并增量包：从选中的版本升级到最新版本；重建全量包：不读取源目录生成选中版本的全量包
+        button_frame = ctk.CTkFrame(history_window)
+        button_frame.pack(fill="x", side="bottom", padx=10, pady=(0, 10))
+        ctk.CTkButton(
+            button_frame,
+            text="重建全量包",
+            width=120,
+            command=lambda: self._start_rebuild_full(tree, history_window)
+        ).pack(side="right", padx=5, pady=5)
+        ctk.CTkButton(
+            button_frame,
+            text="合并增量包",
+            width=120,
+            command=lambda: self._start_squash(tree, history_window)
+        ).pack(side="right", padx=5, pady=5)
+        ctk.CTkLabel(
+            button_frame,
+            text="选择版本后合并之后的增量包，或重建该版本的全量包"
+        ).pack(side="left", padx=5, pady=5)
+
         tree.pack(fill="both", expand=True, padx=10, pady=10)
 
+    def _get_selected_version(self, tree, history_window) -> Optional[str]:
+        """获取版本历史中选中的版本，正在扫描或打包时返回None"""
+        if self.is_building or self.is_scanning:
+            messagebox.showinfo("信息", "请等待当前操作完成", parent=history_window)
+            return None
+
+        selection = tree.selection()
+        if not selection:
+            messagebox.showinfo("信息", "请先选择版本", parent=history_window)
+            return None
+        return str(tree.item(selection[0], "values")[0])
+
+    def _start_squash(self, tree, history_window):
+        """开始合并增量包"""
+        base_version = self._get_selected_version(tree, history_window)
+        if not base_version:
+            return
+
+        history = PackageHistory(self.version_manager, Path(self.output_dir.get()))
+        target_version = history.get_versions()[-1].version
+        if base_version == target_version:
+            messagebox.showinfo("信息", "选中的已经是最新版本", parent=history_window)
+            return
+        if not messagebox.askyesno("确认", f"是否合并 {base_version} 之后的增量包，生成 {base_version} 升级到 "
+                                         f"{target_version} 的合并包？", parent=history_window):
+            return
+
+        delta_patches = self.config.get_package_options().get("delta_patches", False)
+        history_window.destroy()
+        self._start_history_package(
+            "合并", f"正在合并 {base_version} ~ {target_version} 的增量包...", history,
+            lambda progress_callback: history.squash(base_version, target_version, self.package_builder,
+                                                     progress_callback, delta_patches)
+        )
+
+    def _start_rebuild_full(self, tree, history_window):
+        """开始重建全量包"""
+        version_str = self._get_selected_version(tree, history_window)
+        if not version_str:
+            return
+        if not messagebox.askyesno("确认", f"是否由历史包重建 {version_str} 的全量包？", parent=history_window):
+            return
+
+        history = PackageHistory(self.version_manager, Path(self.output_dir.get()))
+        history_window.destroy()
+        self._start_history_package(
+            "重建全量", f"正在重建 {version_str} 的全量包...", history,
+            lambda progress_callback: history.rebuild_full(version_str, self.package_builder, progress_callback)
+        )
+
+    def _start_history_package(self, package_type, status, history, build):
+        """开始由历史包生成压缩包"""
+        self.is_building = True
+        self._disable_actions()
+        self.scan_btn.configure(state="disabled")
+
+        threading.Thread(
+            target=self._build_history_package,
+            args=(package_type, status, history, build),
+            daemon=True
+        ).start()
+
+    def _build_history_package(self, package_type, status, history, build):
+        """由历史包生成压缩包（在子线程中执行）"""
+        try:
+            def progress_callback(current, total):
+                progress = current / total if total > 0 else 0
+                self.root.after(0, lambda: self.progress_bar.set(progress))
+                self.root.after(0, lambda: self.progress_label.configure(
+                    text=f"正在打包: {current}/{total} 个文件"
+                ))
+
+            self.root.after(0, lambda: self.status_text.set(status))
+            package_file = build(progress_callback)
+            if package_file:
+                self.root.after(0, lambda: self._on_history_package_completed(
+                    package_file, package_type, history.incomplete_versions))
+            else:
+                self.root.after(0, lambda: self._on_package_cancelled(package_type))
+        except Exception as e:
+            self.root.after(0, lambda: self._on_package_error(str(e), package_type))
+
+    def _on_history_package_completed(self, package_file, package_type, incomplete_versions):
+        """由历史包生成压缩包完成回调"""
+        self.is_building = False
+        self._enable_actions()
+        self.scan_btn.configure(state="normal")
+        if self.file_changes:
+            self.view_changes_btn.configure(state="normal")
+
+        self.progress_bar.set(1.0)
+        self.progress_label.configure(text="")
+
+        size_kb = package_file.stat().st_size / 1024
+        size_info = f'{size_kb:.2f} KB'
+        if size_kb > 1024:
+            size_mb = size_kb / 1024
+            size_info = f'{size_mb:.2f} MB'
+
+        message = f"{package_type}包创建成功!\n" \
+                  f"文件: {package_file.name}\n" \
+                  f"大小: {size_info}\n" \
+                  f"文件数: {len(self.package_builder.last_manifest)}"
+        reused_count = self.package_builder.last_reused_count
+        if reused_count:
+            message += f"\n其中 {reused_count} 个文件直接复用历史包的压缩数据"
+        if self.package_builder.last_delta_files:
+            message += f"\n其中 {len(self.package_builder.last_delta_files)} 个文件以补丁形式打包，" \
+                       f"服务端需执行 python -m core.package_applier apply {package_file.name} <MirServer目录> 更新"
+        if incomplete_versions:
+            message += f"\n注意: {', '.join(incomplete_versions)} 没有删除记录，这些版本中删除的文件无法识别"
+        messagebox.showinfo("成功", message)
+        self.status_text.set(f"{package_type}包创建成功: {package_file.name}")
+
     def _on_window_close(self):
         """窗口关闭事件"""
         # 在退出前保存配置
@@ -725,8 +1076,10 @@ class IncrementalPackerApp:
         # 停止所有正在进行的操作
         if self.is_scanning:
             self.file_scanner.stop_scan()
+        self._stop_change_watcher()
         if self.is_building:
             self.package_builder.stop_build()
+        self._stop_cache_gc()
 
         # 关闭子窗口
         if self.file_list_window and self.file_list_window.window.winfo_exists():
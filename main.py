@@ -5,6 +5,7 @@
 作者: MiniMax Agent
 """
 
+import multiprocessing
 import sys
 from pathlib import Path
 
@@ -24,4 +25,6 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # 打包成exe后，扫描使用的进程池需要在子进程中跳过GUI启动
+    multiprocessing.freeze_support()
     main()
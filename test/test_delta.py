@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+core.delta 补丁生成与还原测试
+使用命令: python -m pytest test/test_delta.py 或 python test/test_delta.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core import delta  # noqa: E402
+from core.delta import DeltaError, apply_delta, apply_delta_data, close_map, create_delta, map_file  # noqa: E402
+
+
+def _records(count: int, size: int = 64) -> list:
+    """生成固定长度、大部分为0的记录（类似服务端的 .DB 文件）"""
+    records = []
+    for index in range(count):
+        record = bytearray(size)
+        record[0:4] = index.to_bytes(4, 'little')
+        records.append(record)
+    return records
+
+
+class DeltaRoundTripTest(unittest.TestCase):
+    """各种修改方式生成的补丁都能还原出目标数据"""
+
+    def setUp(self):
+        self.random = random.Random(1)
+        self.base = self.random.randbytes(512 * 1024)
+
+    def assert_round_trip(self, base: bytes, target: bytes) -> bytes:
+        patch = create_delta(base, target)
+        self.assertIsNotNone(patch)
+        self.assertEqual(apply_delta_data(patch, base), target)
+        return patch
+
+    def test_identical(self):
+        patch = self.assert_round_trip(self.base, self.base)
+        self.assertLess(len(patch), 1024)
+
+    def test_inplace_edit(self):
+        target = bytearray(self.base)
+        target[1000:1100] = self.random.randbytes(100)
+        patch = self.assert_round_trip(self.base, bytes(target))
+        self.assertLess(len(patch), 1024)
+
+    def test_insert_and_delete(self):
+        target = self.base[:1000] + self.random.randbytes(300) + self.base[1000:200000] + self.base[200500:]
+        patch = self.assert_round_trip(self.base, target)
+        self.assertLess(len(patch), 2048)
+
+    def test_append_and_truncate(self):
+        self.assert_round_trip(self.base, self.base + self.random.randbytes(5000))
+        self.assert_round_trip(self.base, self.base[:1000])
+
+    def test_moved_blocks(self):
+        target = self.base[300000:] + self.base[:300000]
+        patch = self.assert_round_trip(self.base, target)
+        self.assertLess(len(patch), 1024)
+
+    def test_empty(self):
+        self.assert_round_trip(self.base, b'')
+        self.assert_round_trip(b'', b'')
+
+    def test_unrelated_data_gives_up(self):
+        self.assertIsNone(create_delta(self.base, self.random.randbytes(len(self.base))))
+
+    def test_mapped_files(self):
+        target = self.base[:2000] + b'changed' + self.base[2000:]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            base_file = Path(temp_dir) / 'base.bin'
+            base_file.write_bytes(self.base)
+            handle, base = map_file(base_file)
+            try:
+                patch = create_delta(base, target)
+            finally:
+                close_map(handle, base)
+            output_file = Path(temp_dir) / 'target.bin'
+            apply_delta(patch, base_file, output_file)
+            self.assertEqual(output_file.read_bytes(), target)
+
+    def test_wrong_base(self):
+        target = self.base[:1000] + b'x' + self.base[1000:]
+        patch = create_delta(self.base, target)
+        other = bytearray(self.base)
+        other[0] ^= 1
+        with self.assertRaises(DeltaError):
+            apply_delta_data(patch, bytes(other))
+
+    def test_corrupt_patch(self):
+        target = self.base[:1000] + b'x' + self.base[1000:]
+        patch = bytearray(create_delta(self.base, target))
+        patch[-10] ^= 0xff
+        with self.assertRaises(DeltaError):
+            apply_delta_data(bytes(patch), self.base)
+        with self.assertRaises(DeltaError):
+            apply_delta_data(b'not a patch', self.base)
+
+
+class DeltaEncoderBudgetTest(unittest.TestCase):
+    """重复数据中的重新对齐不能退化为反复扫描基准"""
+
+    def test_fixed_size_records(self):
+        # 4MB 的64字节记录，每7条修改一条：修复前约需13秒
+        generator = random.Random(1)
+        records = _records(4 * 1024 * 1024 // 64)
+        base = b''.join(bytes(record) for record in records)
+        for index in range(0, len(records), 7):
+            records[index][20:28] = generator.randbytes(8)
+        target = b''.join(bytes(record) for record in records)
+
+        started = time.perf_counter()
+        patch = create_delta(base, target)
+        elapsed = time.perf_counter() - started
+        self.assertIsNotNone(patch)
+        self.assertEqual(apply_delta_data(patch, base), target)
+        self.assertLess(elapsed, 5.0)
+
+    def test_search_budget_falls_back(self):
+        # 插入数据后需要查找才能重新对齐，查找额度用完时放弃补丁（打包完整文件）
+        generator = random.Random(1)
+        base = generator.randbytes(512 * 1024)
+        target = base[:100000] + generator.randbytes(3) + base[100000:300000] + generator.randbytes(5) + base[300000:]
+        self.assertIsNotNone(create_delta(base, target))
+        with mock.patch.object(delta, '_SEARCH_BUDGET_MIN', 0), mock.patch.object(delta, '_SEARCH_BUDGET_RATIO', 0):
+            self.assertIsNone(create_delta(base, target))
+
+    def test_should_stop(self):
+        base = os.urandom(256 * 1024)
+        target = base[:1000] + b'x' + base[1000:]
+        self.assertIsNone(create_delta(base, target, should_stop=lambda: True))
+        self.assertIsNotNone(create_delta(base, target, should_stop=lambda: False))
+
+
+if __name__ == '__main__':
+    unittest.main()
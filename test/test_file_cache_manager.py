@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+core.file_cache_manager 打包时写入缓存的测试
+使用命令: python -m pytest test/test_file_cache_manager.py 或 python test/test_file_cache_manager.py
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.digest import bytes_digest  # noqa: E402
+from core.file_cache_manager import FileCacheManager  # noqa: E402
+
+
+class CacheWriterTest(unittest.TestCase):
+    """CacheWriter 在打包的同一次读取中决定存放形式，存入缓存时不再重新读取文件"""
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+        self.cache_manager = FileCacheManager(self.root / "cache")
+
+    def commit(self, relative_path: str, data: bytes, block_size: int = 64 * 1024) -> Path:
+        source_file = self.root / relative_path
+        source_file.write_bytes(data)
+        writer = self.cache_manager.open_writer(len(data))
+        for start in range(0, len(data), block_size):
+            writer.update(data[start:start + block_size])
+        file_hash = bytes_digest(data, self.cache_manager.hash_algorithm)
+        with mock.patch.object(FileCacheManager, '_encode_blob', side_effect=AssertionError('重新读取了文件')):
+            self.assertTrue(self.cache_manager.commit_writer(writer, source_file, relative_path, file_hash,
+                                                             source_file.stat()))
+        self.assertFalse(writer.temp_path.exists())
+        cache_file = Path(self.cache_manager.cache_index["files"][relative_path]["cache_file"])
+        self.assertEqual(self.cache_manager._read_blob(cache_file), data)
+        return cache_file
+
+    def test_compressible(self):
+        self.assertEqual(self.commit("text.txt", b'hello world ' * 100000).suffix, '.z')
+
+    def test_incompressible(self):
+        self.assertEqual(self.commit("random.bin", os.urandom(1024 * 1024)).suffix, '')
+
+    def test_small_and_empty(self):
+        self.commit("small.txt", b'small ' * 100)
+        self.commit("empty.txt", b'')
+
+    def test_discard(self):
+        writer = self.cache_manager.open_writer()
+        writer.update(b'data' * 1000)
+        writer.discard()
+        self.assertFalse(writer.temp_path.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
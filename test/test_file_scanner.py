@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+core.file_scanner 大文件树形摘要与旧快照对比测试
+使用命令: python -m pytest test/test_file_scanner.py 或 python test/test_file_scanner.py
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core import digest, file_scanner  # noqa: E402
+from core.file_comparator import ChangeType, FileComparator  # noqa: E402
+from core.file_scanner import FileScanner  # noqa: E402
+
+# 测试中使用的树形摘要阈值
+_THRESHOLD = 64 * 1024
+
+
+class TreeDigestMigrationTest(unittest.TestCase):
+    """旧快照中整体计算的大文件hash不能让升级后的扫描把大文件当作修改"""
+
+    def setUp(self):
+        for module in (digest, file_scanner):
+            patcher = mock.patch.object(module, 'TREE_THRESHOLD', _THRESHOLD)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+        (self.root / "Mir200" / "Envir").mkdir(parents=True)
+        self.write("Mir200/Envir/small.txt", b'small file')
+        self.write("Mir200/Envir/large.map", os.urandom(_THRESHOLD * 3))
+
+    def write(self, relative_path: str, data: bytes):
+        (self.root / relative_path).write_bytes(data)
+
+    def flat_snapshot(self) -> dict:
+        """按旧版本的方式生成快照：所有文件整体计算 sha256，没有 inode / mtime_ns"""
+        snapshot = {}
+        for relative_path in ("Mir200/Envir/small.txt", "Mir200/Envir/large.map"):
+            file_path = self.root / relative_path
+            key = os.path.normpath(relative_path)
+            snapshot[key] = {
+                'size': file_path.stat().st_size,
+                'mtime': file_path.stat().st_mtime,
+                'hash': hashlib.sha256(file_path.read_bytes()).hexdigest(),
+                'relative_path': key
+            }
+        return snapshot
+
+    def scan(self, previous_files: dict) -> dict:
+        scanner = FileScanner(target_paths=["Mir200"], hash_backend='thread')
+        return scanner.scan_directory(self.root, previous_files=previous_files, previous_algorithm='sha256')
+
+    def test_unchanged_large_file(self):
+        snapshot = self.flat_snapshot()
+        result = self.scan(snapshot)
+
+        large = result[os.path.normpath("Mir200/Envir/large.map")]
+        self.assertTrue(large['segments'])
+        self.assertNotEqual(large['hash'], snapshot[os.path.normpath("Mir200/Envir/large.map")]['hash'])
+        self.assertEqual(large['legacy_hash'], snapshot[os.path.normpath("Mir200/Envir/large.map")]['hash'])
+        self.assertNotIn('legacy_hash', result[os.path.normpath("Mir200/Envir/small.txt")])
+        self.assertEqual(FileComparator().compare_file_lists(snapshot, result), [])
+
+        # 新快照带有分段摘要，之后的扫描不再额外计算整体hash
+        rescanned = self.scan(result)
+        self.assertNotIn('legacy_hash', rescanned[os.path.normpath("Mir200/Envir/large.map")])
+        self.assertEqual(FileComparator().compare_file_lists(result, rescanned), [])
+
+    def test_modified_large_file(self):
+        snapshot = self.flat_snapshot()
+        self.write("Mir200/Envir/large.map", os.urandom(_THRESHOLD * 3))
+        changes = FileComparator().compare_file_lists(snapshot, self.scan(snapshot))
+        self.assertEqual([(change.file_path, change.change_type) for change in changes],
+                         [(os.path.normpath("Mir200/Envir/large.map"), ChangeType.MODIFIED)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+core.package_applier 清单路径检查测试
+使用命令: python -m pytest test/test_package_applier.py 或 python test/test_package_applier.py
+"""
+
+import hashlib
+import json
+import sys
+import tempfile
+import unittest
+import zipfile
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.package_applier import ApplyError, PackageApplier, server_path  # noqa: E402
+from core.package_manifest import PACKAGE_MANIFEST_FORMAT, PACKAGE_MANIFEST_NAME  # noqa: E402
+
+
+def _write_package(package_file: Path, files: dict, deleted: list = ()):
+    """生成带包内清单的全量包，files 为 {清单路径: 内容}"""
+    manifest_files = {}
+    with zipfile.ZipFile(package_file, 'w') as zf:
+        for index, (path, data) in enumerate(files.items()):
+            member = f"MirServer\\member{index}"
+            zf.writestr(member, data)
+            manifest_files[path] = {'member': member, 'hash': hashlib.sha256(data).hexdigest(),
+                                    'size': len(data), 'crc': zlib.crc32(data)}
+        zf.writestr(PACKAGE_MANIFEST_NAME, json.dumps({
+            'format': PACKAGE_MANIFEST_FORMAT, 'base_version': None, 'target_version': 'v1.0.0',
+            'is_full_package': True, 'algorithm': 'sha256', 'files': manifest_files, 'deleted': list(deleted)
+        }))
+
+
+class ManifestPathTest(unittest.TestCase):
+    """清单中的路径不能写入或删除服务端目录之外的文件"""
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+        self.server_dir = self.root / "MirServer"
+        (self.server_dir / "Mir200").mkdir(parents=True)
+        self.package_file = self.root / "v1.0.0-full.zip"
+
+    def test_server_path(self):
+        self.assertEqual(server_path(self.server_dir, "Mir200/Envir/a.txt"),
+                         self.server_dir / "Mir200" / "Envir" / "a.txt")
+        for path in ("../evil.txt", "Mir200/../../evil.txt", "Mir200\\..\\..\\evil.txt", "/etc/passwd",
+                     "C:/Windows/evil.dll", "C:evil.txt", "\\\\server\\share\\evil.txt", "", "."):
+            with self.assertRaises(ApplyError, msg=path):
+                server_path(self.server_dir, path)
+
+    def test_apply(self):
+        _write_package(self.package_file, {"Mir200/a.txt": b'a'})
+        report = PackageApplier().apply(self.package_file, self.server_dir)
+        self.assertEqual(report.written, ["Mir200/a.txt"])
+        self.assertEqual((self.server_dir / "Mir200" / "a.txt").read_bytes(), b'a')
+
+    def test_reject_file_outside(self):
+        _write_package(self.package_file, {"Mir200/a.txt": b'a', "../evil.txt": b'evil'})
+        with self.assertRaises(ApplyError):
+            PackageApplier().apply(self.package_file, self.server_dir)
+        self.assertFalse((self.root / "evil.txt").exists())
+        self.assertFalse((self.server_dir / "Mir200" / "a.txt").exists())
+
+    def test_reject_deleted_outside(self):
+        victim = self.root / "victim.txt"
+        victim.write_bytes(b'keep')
+        _write_package(self.package_file, {"Mir200/a.txt": b'a'}, ["../victim.txt"])
+        with self.assertRaises(ApplyError):
+            PackageApplier().apply(self.package_file, self.server_dir)
+        with self.assertRaises(ApplyError):
+            PackageApplier().verify(self.package_file, self.server_dir)
+        self.assertTrue(victim.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+core.zip_writer 原始成员写入测试（直接写入和退回 ZipFile.open 两种方式）
+使用命令: python -m pytest test/test_zip_writer.py 或 python test/test_zip_writer.py
+"""
+
+import io
+import random
+import sys
+import unittest
+import zipfile
+import zlib
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core import zip_writer  # noqa: E402
+from core.zip_writer import DEFLATE_WINDOW, abort_member, begin_member, deflate_block, finish_member, \
+    iter_raw_data, raw_data_offset, write_member_data, write_raw_member  # noqa: E402
+
+
+def _deflate_chunks(data: bytes, block_size: int) -> list:
+    """按 PackageBuilder 的方式分块压缩"""
+    chunks = []
+    zdict = b''
+    for start in range(0, len(data), block_size):
+        block = data[start:start + block_size]
+        last = start + block_size >= len(data)
+        chunks.append(deflate_block(block, 6, zdict, last))
+        zdict = (zdict + block)[-DEFLATE_WINDOW:]
+    return chunks
+
+
+class ZipWriterTest(unittest.TestCase):
+    """直接写入已压缩的数据"""
+    raw_write = True
+
+    def setUp(self):
+        patcher = mock.patch.object(zip_writer, 'RAW_WRITE_SUPPORTED', self.raw_write)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        generator = random.Random(1)
+        words = [generator.randbytes(6).hex().encode() for _ in range(200)]
+        self.data = b' '.join(generator.choice(words) for _ in range(40000))
+
+    def test_members(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            deflated = zipfile.ZipInfo('a/deflated.txt')
+            deflated.compress_type = zipfile.ZIP_DEFLATED
+            write_raw_member(zf, deflated, _deflate_chunks(self.data, 64 * 1024),
+                             zlib.crc32(self.data), len(self.data))
+
+            stored = zipfile.ZipInfo('a/stored.bin')
+            member = begin_member(zf, stored)
+            write_member_data(zf, member, self.data[:1000])
+            write_member_data(zf, member, self.data[1000:5000])
+            finish_member(zf, stored, member, zlib.crc32(self.data[:5000]), 5000, 5000)
+
+            zf.writestr('a/normal.txt', b'normal')
+
+        with zipfile.ZipFile(buffer) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read('a/deflated.txt'), self.data)
+            self.assertEqual(zf.read('a/stored.bin'), self.data[:5000])
+            self.assertEqual(zf.read('a/normal.txt'), b'normal')
+
+            # 原始压缩数据可以直接复制到新的压缩包
+            zinfo = zf.getinfo('a/deflated.txt')
+            chunks = list(iter_raw_data(zf.fp, raw_data_offset(zf, zinfo), zinfo.compress_size, 4096))
+        self.assertEqual(zlib.decompress(b''.join(chunks), -15), self.data)
+
+    def test_abort(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zinfo = zipfile.ZipInfo('aborted.txt')
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            member = begin_member(zf, zinfo)
+            write_member_data(zf, member, _deflate_chunks(self.data, 64 * 1024)[0])
+            abort_member(zf, zinfo, member)
+            zf.writestr('kept.txt', b'kept')
+
+        with zipfile.ZipFile(buffer) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), ['kept.txt'])
+
+    def test_uncompressed_data_needs_fallback(self):
+        if not self.raw_write:
+            self.skipTest("退回 ZipFile.open 时可以提交未压缩的数据")
+        with zipfile.ZipFile(io.BytesIO(), 'w') as zf:
+            zinfo = zipfile.ZipInfo('plain.txt')
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with self.assertRaises(ValueError):
+                begin_member(zf, zinfo, 6)
+
+
+class ZipWriterFallbackTest(ZipWriterTest):
+    """zipfile 内部属性不可用时退回 ZipFile.open(mode='w')"""
+    raw_write = False
+
+    def test_uncompressed_data(self):
+        # 提交未压缩的数据时由 zipfile 按指定的级别压缩
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            for level in (1, 9):
+                zinfo = zipfile.ZipInfo(f'level{level}.txt')
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                member = begin_member(zf, zinfo, level)
+                for start in range(0, len(self.data), 64 * 1024):
+                    write_member_data(zf, member, self.data[start:start + 64 * 1024])
+                finish_member(zf, zinfo, member, zlib.crc32(self.data), len(self.data), 0)
+
+        with zipfile.ZipFile(buffer) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read('level1.txt'), self.data)
+            self.assertEqual(zf.read('level9.txt'), self.data)
+            self.assertLess(zf.getinfo('level9.txt').compress_size, zf.getinfo('level1.txt').compress_size)
+
+    def test_crc_mismatch(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zinfo = zipfile.ZipInfo('bad.txt')
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with self.assertRaises(zipfile.BadZipFile):
+                write_raw_member(zf, zinfo, _deflate_chunks(self.data, 64 * 1024), 0, len(self.data))
+
+
+class RawWriteCheckTest(unittest.TestCase):
+    """zipfile 内部属性的可用性检查"""
+
+    def test_supported(self):
+        self.assertTrue(zip_writer._check_raw_write())
+
+    def test_internals_changed(self):
+        with mock.patch.object(zip_writer, '_begin_raw_member', side_effect=AttributeError('_writing')):
+            self.assertFalse(zip_writer._check_raw_write())
+
+
+if __name__ == '__main__':
+    unittest.main()